@@ -0,0 +1,83 @@
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Dashboard figures are shared by all admins for this long
+STATS_CACHE_TTL_SECONDS = 30
+PLATFORM_FEE_RATE = 0.15
+ACTIVE_ORDER_STATUSES = ["pending", "quoted", "approved", "paid", "in_progress"]
+
+_stats_cache = TTLCache(STATS_CACHE_TTL_SECONDS, max_entries=10)
+
+def _count(match: dict) -> list:
+    return [{"$match": match}, {"$count": "n"}]
+
+def _first(facet: dict, name: str, field: str = "n", default=0):
+    rows = facet.get(name) or []
+    return rows[0].get(field, default) if rows else default
+
+async def _user_stats(db) -> dict:
+    rows = await db.users.aggregate([{"$facet": {
+        "total": [{"$count": "n"}],
+        "by_type": [{"$group": {"_id": "$user_type", "n": {"$sum": 1}}}],
+        "active_mechanics": _count({"user_type": "mechanic", "is_active": True, "approval_status": "approved"}),
+        "pending_mechanics": _count({"user_type": "mechanic", "approval_status": "pending_approval"})
+    }}]).to_list(1)
+    facet = rows[0] if rows else {}
+    by_type = {row["_id"]: row["n"] for row in facet.get("by_type", [])}
+    return {
+        "total_users": _first(facet, "total"),
+        "total_mechanics": by_type.get("mechanic", 0),
+        "total_clients": by_type.get("client", 0),
+        "active_mechanics": _first(facet, "active_mechanics"),
+        "pending_mechanics": _first(facet, "pending_mechanics")
+    }
+
+async def _order_stats(db) -> dict:
+    now = datetime.now(timezone.utc)
+    today = now.strftime('%Y-%m-%d')
+    tomorrow = (now + timedelta(days=1)).strftime('%Y-%m-%d')
+    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0).isoformat()
+
+    rows = await db.quotes.aggregate([{"$facet": {
+        "total": [{"$count": "n"}],
+        "completed": _count({"status": "completed"}),
+        "today": _count({"created_at": {"$gte": today, "$lt": tomorrow}}),
+        "active": _count({"status": {"$in": ACTIVE_ORDER_STATUSES}}),
+        "completed_month": [
+            {"$match": {"status": {"$in": ["completed", "reviewed"]}, "created_at": {"$gte": month_start}}},
+            {"$group": {"_id": None, "gross": {"$sum": {"$ifNull": ["$final_price", 0]}}}}
+        ]
+    }}]).to_list(1)
+    facet = rows[0] if rows else {}
+    return {
+        "total_quotes": _first(facet, "total"),
+        "completed_quotes": _first(facet, "completed"),
+        "orders_today": _first(facet, "today"),
+        "active_orders": _first(facet, "active"),
+        "revenue_month": round(_first(facet, "completed_month", "gross", 0.0) * PLATFORM_FEE_RATE, 2)
+    }
+
+async def _payment_stats(db) -> dict:
+    rows = await db.payments.aggregate([
+        {"$group": {"_id": None, "total": {"$sum": {"$ifNull": ["$amount", 0]}}}}
+    ]).to_list(1)
+    return {"total_revenue": round(rows[0]["total"], 2) if rows else 0.0}
+
+async def _dispute_stats(db) -> dict:
+    return {"open_disputes": await db.disputes.count_documents({"status": "open"})}
+
+async def compute_stats(db) -> dict:
+    """One aggregation per collection, run concurrently"""
+    parts = await asyncio.gather(_user_stats(db), _order_stats(db), _payment_stats(db), _dispute_stats(db))
+    stats = {"recent_activity": [], "generated_at": datetime.now(timezone.utc).isoformat()}
+    for part in parts:
+        stats.update(part)
+    return stats
+
+async def get_stats(db) -> dict:
+    """Cached platform statistics; concurrent misses share one computation"""
+    return await _stats_cache.get_or_compute("admin_stats", lambda: compute_stats(db))
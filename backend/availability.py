@@ -0,0 +1,310 @@
+import heapq
+import logging
+import os
+import time as time_module
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# Orders in these statuses hold the mechanic's time
+BOOKED_STATUSES = ["quoted", "approved", "prebooked", "paid", "in_progress"]
+DEFAULT_DURATION_MINUTES = 60
+DEFAULT_SLOT_STEP_MINUTES = 30
+MAX_SLOT_STEP_MINUTES = 240
+# Used until the mechanic configures working hours: Mon-Sat 08:00-18:00
+DEFAULT_WORKING_HOURS = [{"weekday": d, "start": "08:00", "end": "18:00"} for d in range(6)]
+INDEX_TTL_SECONDS = 60
+# Order date/time are the workshop's local time, as entered by the client
+SERVICE_TIMEZONE = ZoneInfo(os.environ.get('SERVICE_TIMEZONE', 'America/Sao_Paulo'))
+# Held intervals per mechanic and day: {_id: "<mechanic_id>:<date>",
+# intervals: [{order_id, start, end}]}. The day index above is a cache
+# for listing slots; bookings are decided by one conditional update here.
+BOOKINGS_COLLECTION = 'mechanic_bookings'
+
+class SlotConflictError(Exception):
+    """Requested interval overlaps an existing booking or blocked slot"""
+    pass
+
+def parse_minutes(value: str) -> int:
+    """"14:30" -> 870"""
+    hours, minutes = value.split(':')[:2]
+    return int(hours) * 60 + int(minutes)
+
+def format_minutes(value: int) -> str:
+    return f"{value // 60:02d}:{value % 60:02d}"
+
+class IntervalIndex:
+    """Disjoint [start, end) intervals (minutes of day) sorted by start.
+
+    Overlapping inserts are merged, so conflict checks are one bisect:
+    O(log n). Free-slot queries bisect to the window and walk the gaps.
+    """
+
+    def __init__(self):
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+
+    def __len__(self):
+        return len(self._starts)
+
+    def overlaps(self, start: int, end: int) -> bool:
+        i = bisect_right(self._starts, start)
+        if i > 0 and self._ends[i - 1] > start:
+            return True
+        return i < len(self._starts) and self._starts[i] < end
+
+    def add(self, start: int, end: int):
+        """Insert an interval, merging it with any intervals it touches"""
+        lo = bisect_left(self._ends, start)
+        hi = bisect_right(self._starts, end)
+        if lo < hi:
+            start = min(start, self._starts[lo])
+            end = max(end, self._ends[hi - 1])
+        self._starts[lo:hi] = [start]
+        self._ends[lo:hi] = [end]
+
+    def book(self, start: int, end: int):
+        """Insert an interval, refusing overlaps"""
+        if self.overlaps(start, end):
+            raise SlotConflictError(f"{format_minutes(start)}-{format_minutes(end)} is not available")
+        self.add(start, end)
+
+    def free_slots(self, window_start: int, window_end: int, duration: int, step: int):
+        """Yield slot start times inside the window that fit `duration` minutes"""
+        if step <= 0:
+            raise ValueError("step must be positive")
+        i = bisect_right(self._ends, window_start)
+        cursor = window_start
+        while cursor + duration <= window_end:
+            if i < len(self._starts) and self._starts[i] < cursor + duration:
+                # Busy interval in the way: jump past it, staying on the step grid
+                busy_end = self._ends[i]
+                i += 1
+                if busy_end > cursor:
+                    cursor = window_start + -(-(busy_end - window_start) // step) * step
+                continue
+            yield cursor
+            cursor += step
+
+def _weekday_windows(availability: dict, date: str) -> List[Tuple[int, int]]:
+    weekday = datetime.strptime(date, '%Y-%m-%d').weekday()
+    working_hours = availability.get("working_hours") or DEFAULT_WORKING_HOURS
+    return sorted(
+        (parse_minutes(wh["start"]), parse_minutes(wh["end"]))
+        for wh in working_hours if wh["weekday"] == weekday
+    )
+
+class DayIndex:
+    """Working windows plus busy intervals of one mechanic on one day"""
+
+    def __init__(self, windows: List[Tuple[int, int]], step: int):
+        self.windows = windows
+        self.step = step
+        self.busy = IntervalIndex()
+        self.built_at = time_module.monotonic()
+
+    def is_free(self, start: int, end: int) -> bool:
+        inside = any(ws <= start and end <= we for ws, we in self.windows)
+        return inside and not self.busy.overlaps(start, end)
+
+    def free_slots(self, duration: int, not_before: int = 0):
+        for window_start, window_end in self.windows:
+            for slot in self.busy.free_slots(window_start, window_end, duration, self.step):
+                if slot >= not_before:
+                    yield slot
+
+# {(mechanic_id, date): DayIndex}
+_day_indexes: Dict[Tuple[str, str], DayIndex] = {}
+
+def invalidate(mechanic_id: Optional[str], date: Optional[str] = None):
+    """Drop cached indexes after a booking or availability change"""
+    if not mechanic_id:
+        return
+    if date:
+        _day_indexes.pop((mechanic_id, date), None)
+        return
+    for key in [k for k in _day_indexes if k[0] == mechanic_id]:
+        _day_indexes.pop(key, None)
+
+async def ensure_indexes(db):
+    """Indexes for availability lookups and booked-order scans"""
+    await db.availability.create_index([("mechanic_id", ASCENDING)], unique=True)
+    await db.quotes.create_index([("mechanic_id", ASCENDING), ("date", ASCENDING), ("status", ASCENDING)])
+
+def _build_day_index(availability: dict, date: str, orders: List[dict]) -> DayIndex:
+    step = availability.get("slot_step_minutes") or DEFAULT_SLOT_STEP_MINUTES
+    if not 0 < step <= MAX_SLOT_STEP_MINUTES:
+        step = DEFAULT_SLOT_STEP_MINUTES
+    day = DayIndex(_weekday_windows(availability, date), step)
+    for blocked in availability.get("blocked_slots") or []:
+        if blocked["date"] == date:
+            day.busy.add(parse_minutes(blocked["start"]), parse_minutes(blocked["end"]))
+    for order in orders:
+        if not order.get("time"):
+            continue
+        start = parse_minutes(order["time"])
+        duration = order.get("estimated_duration_minutes") or DEFAULT_DURATION_MINUTES
+        day.busy.add(start, start + duration)
+    return day
+
+async def load_day_indexes(db, mechanic_ids: List[str], dates: List[str]) -> Dict[Tuple[str, str], DayIndex]:
+    """Return day indexes for every (mechanic, date), loading missing ones in two queries"""
+    now = time_module.monotonic()
+    result = {}
+    missing_mechanics = set()
+    missing_dates = set()
+    for mechanic_id in mechanic_ids:
+        for date in dates:
+            day = _day_indexes.get((mechanic_id, date))
+            if day and now - day.built_at < INDEX_TTL_SECONDS:
+                result[(mechanic_id, date)] = day
+            else:
+                missing_mechanics.add(mechanic_id)
+                missing_dates.add(date)
+
+    if not missing_mechanics:
+        return result
+
+    availabilities = await db.availability.find(
+        {"mechanic_id": {"$in": list(missing_mechanics)}}, {"_id": 0}
+    ).to_list(len(missing_mechanics))
+    by_mechanic = {a["mechanic_id"]: a for a in availabilities}
+
+    orders_by_key: Dict[Tuple[str, str], List[dict]] = {}
+    cursor = db.quotes.find(
+        {
+            "mechanic_id": {"$in": list(missing_mechanics)},
+            "date": {"$in": list(missing_dates)},
+            "status": {"$in": BOOKED_STATUSES}
+        },
+        {"_id": 0, "mechanic_id": 1, "date": 1, "time": 1, "estimated_duration_minutes": 1}
+    )
+    async for order in cursor:
+        orders_by_key.setdefault((order["mechanic_id"], order["date"]), []).append(order)
+
+    for mechanic_id in missing_mechanics:
+        for date in missing_dates:
+            key = (mechanic_id, date)
+            if key in result:
+                continue
+            day = _build_day_index(by_mechanic.get(mechanic_id, {}), date, orders_by_key.get(key, []))
+            _day_indexes[key] = day
+            result[key] = day
+    return result
+
+async def get_day_index(db, mechanic_id: str, date: str) -> DayIndex:
+    indexes = await load_day_indexes(db, [mechanic_id], [date])
+    return indexes[(mechanic_id, date)]
+
+async def _day_index_without(db, mechanic_id: str, date: str, order_id: str) -> DayIndex:
+    """Uncached day index ignoring one order (merged intervals can't be subtracted)"""
+    availability = await db.availability.find_one({"mechanic_id": mechanic_id}, {"_id": 0}) or {}
+    orders = await db.quotes.find(
+        {"mechanic_id": mechanic_id, "date": date, "status": {"$in": BOOKED_STATUSES}, "id": {"$ne": order_id}},
+        {"_id": 0, "time": 1, "estimated_duration_minutes": 1}
+    ).to_list(None)
+    return _build_day_index(availability, date, orders)
+
+async def check_booking(db, mechanic_id: str, date: str, time: str, duration_minutes: Optional[int] = None,
+                        order_id: Optional[str] = None):
+    """Raise SlotConflictError if the mechanic cannot take this date/time.
+
+    Pass `order_id` when (re)quoting an order, so its own interval doesn't count.
+    """
+    start = parse_minutes(time)
+    end = start + (duration_minutes or DEFAULT_DURATION_MINUTES)
+    if order_id:
+        day = await _day_index_without(db, mechanic_id, date, order_id)
+    else:
+        day = await get_day_index(db, mechanic_id, date)
+    if not day.is_free(start, end):
+        raise SlotConflictError(f"Mechanic not available on {date} at {time}")
+
+async def reserve(db, mechanic_id: str, date: str, time: str, duration_minutes: Optional[int], order_id: str):
+    """Hold the interval for an order, atomically across requests and workers.
+
+    The push only matches while no held interval overlaps; when it does
+    not match, the upsert collides with the existing day document.
+    """
+    start = parse_minutes(time)
+    end = start + (duration_minutes or DEFAULT_DURATION_MINUTES)
+    key = f"{mechanic_id}:{date}"
+    # Re-quoting the same order replaces its interval
+    await db[BOOKINGS_COLLECTION].update_one({"_id": key}, {"$pull": {"intervals": {"order_id": order_id}}})
+    try:
+        await db[BOOKINGS_COLLECTION].update_one(
+            {"_id": key, "intervals": {"$not": {"$elemMatch": {"start": {"$lt": end}, "end": {"$gt": start}}}}},
+            {
+                "$push": {"intervals": {"order_id": order_id, "start": start, "end": end}},
+                "$setOnInsert": {"mechanic_id": mechanic_id, "date": date}
+            },
+            upsert=True
+        )
+    except DuplicateKeyError:
+        raise SlotConflictError(f"Mechanic not available on {date} at {time}")
+    finally:
+        invalidate(mechanic_id, date)
+
+async def release(db, mechanic_id: Optional[str], date: Optional[str], order_id: str):
+    """Free an order's interval (quote rejected, expired, order reopened)"""
+    if not mechanic_id or not date:
+        return
+    await db[BOOKINGS_COLLECTION].update_one(
+        {"_id": f"{mechanic_id}:{date}"},
+        {"$pull": {"intervals": {"order_id": order_id}}}
+    )
+    invalidate(mechanic_id, date)
+
+def _minutes_now() -> Tuple[str, int]:
+    now = datetime.now(SERVICE_TIMEZONE)
+    return now.strftime('%Y-%m-%d'), now.hour * 60 + now.minute
+
+async def free_slots(db, mechanic_id: str, date: str, duration_minutes: int) -> List[str]:
+    """All free start times of one mechanic on one day"""
+    today, now_minutes = _minutes_now()
+    day = await get_day_index(db, mechanic_id, date)
+    not_before = now_minutes if date == today else 0
+    return [format_minutes(m) for m in day.free_slots(duration_minutes, not_before)]
+
+async def next_available_slots(
+    db,
+    mechanics: List[dict],
+    duration_minutes: int,
+    count: int = 5,
+    from_date: Optional[str] = None,
+    days: int = 7
+) -> List[dict]:
+    """Earliest `count` slots across the given mechanics, over `days` days"""
+    today, now_minutes = _minutes_now()
+    start_date = datetime.strptime(from_date or today, '%Y-%m-%d')
+    dates = [(start_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)]
+    by_id = {m["id"]: m for m in mechanics}
+    indexes = await load_day_indexes(db, list(by_id), dates)
+
+    def candidates(mechanic_id: str, date: str):
+        not_before = now_minutes if date == today else 0
+        for minutes in indexes[(mechanic_id, date)].free_slots(duration_minutes, not_before):
+            yield (date, minutes, by_id[mechanic_id].get("distance", 0), mechanic_id)
+
+    # Each generator is already sorted: lazily merge and stop after `count`
+    merged = heapq.merge(*(candidates(m, d) for m in by_id for d in dates))
+    slots = []
+    for date, minutes, distance, mechanic_id in merged:
+        mechanic = by_id[mechanic_id]
+        slots.append({
+            "mechanic_id": mechanic_id,
+            "mechanic_name": mechanic.get("name"),
+            "distance": mechanic.get("distance"),
+            "travel_fee": mechanic.get("travel_fee"),
+            "date": date,
+            "time": format_minutes(minutes),
+            "duration_minutes": duration_minutes
+        })
+        if len(slots) >= count:
+            break
+    return slots
@@ -0,0 +1,346 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from datetime import datetime, timezone, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# Persistent one-shot jobs (reminders, expiries) keyed by a deterministic
+# id such as "reminder_1h:<order_id>", so lifecycle events can schedule,
+# move and cancel their own jobs. The collection is the source of truth;
+# a loader pulls jobs due within LOOKAHEAD_SECONDS into an in-process
+# timing wheel that fires each one on its second. Firing claims the job
+# with a lease, so with several processes each job still runs once.
+# Rescheduling a job while it runs parks the new time in `next`, which
+# is applied when the run finishes.
+COLLECTION = 'delayed_jobs'
+LOOKAHEAD_SECONDS = int(os.environ.get('DELAYED_JOBS_LOOKAHEAD', '900'))
+LOAD_INTERVAL_SECONDS = 60
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 5
+RETRY_DELAY_SECONDS = 60
+FINISHED_RETENTION_DAYS = 7
+
+Handler = Callable[[Any, dict], Awaitable[None]]
+HANDLERS: Dict[str, Handler] = {}
+
+def handler(kind: str):
+    """Register the coroutine that runs jobs of `kind`: handler(db, payload)"""
+    def register(fn: Handler) -> Handler:
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+async def ensure_indexes(db):
+    await db[COLLECTION].create_index([('status', ASCENDING), ('run_at', ASCENDING)])
+    await db[COLLECTION].create_index([('status', ASCENDING), ('lease_until', ASCENDING)])
+    await db[COLLECTION].create_index('finished_at', expireAfterSeconds=FINISHED_RETENTION_DAYS * 24 * 3600)
+
+class TimingWheel:
+    """Hierarchical timing wheel.
+
+    Level 0 has `sizes[0]` one-tick slots, each higher level has slots
+    as wide as a full turn of the level below (60 x 1s, 60 x 1min,
+    24 x 1h by default). Adding and removing are O(1); when a coarse
+    slot comes up, its entries cascade down to finer levels.
+    """
+
+    def __init__(self, tick_seconds: float = 1.0, sizes: Tuple[int, ...] = (60, 60, 24)):
+        self.tick_seconds = tick_seconds
+        self.sizes = sizes
+        self.spans = [1]
+        for size in sizes[:-1]:
+            self.spans.append(self.spans[-1] * size)
+        self.levels: List[List[Dict[str, Tuple[int, Any]]]] = [[{} for _ in range(size)] for size in sizes]
+        self.entries: Dict[str, Tuple[int, int, int]] = {}  # key -> (level, slot, due tick)
+        self.current = self.tick_of(time.time())
+
+    @property
+    def horizon_seconds(self) -> float:
+        return self.spans[-1] * self.sizes[-1] * self.tick_seconds
+
+    def tick_of(self, timestamp: float) -> int:
+        return int(timestamp // self.tick_seconds)
+
+    def due_tick_of(self, timestamp: float) -> int:
+        """First tick at or after `timestamp`"""
+        return math.ceil(timestamp / self.tick_seconds)
+
+    def due_tick(self, key: str) -> Optional[int]:
+        entry = self.entries.get(key)
+        return entry[2] if entry else None
+
+    def add(self, key: str, timestamp: float, item: Any) -> bool:
+        """Place an entry; False if it is already due or beyond the horizon"""
+        self.remove(key)
+        return self._place(key, self.due_tick_of(timestamp), item)
+
+    def _place(self, key: str, due: int, item: Any) -> bool:
+        if due <= self.current:
+            return False
+        for level, (size, span) in enumerate(zip(self.sizes, self.spans)):
+            if due // span - self.current // span < size:
+                slot = (due // span) % size
+                self.levels[level][slot][key] = (due, item)
+                self.entries[key] = (level, slot, due)
+                return True
+        return False
+
+    def remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry:
+            level, slot, _ = entry
+            self.levels[level][slot].pop(key, None)
+
+    def advance(self, timestamp: float) -> List[Tuple[str, Any]]:
+        """Move to `timestamp`; returns the entries that came due"""
+        due_items = []
+        target = self.tick_of(timestamp)
+        while self.current < target:
+            self.current += 1
+            # Cascade coarse slots starting at this tick, highest level first
+            for level in range(len(self.sizes) - 1, 0, -1):
+                span = self.spans[level]
+                if self.current % span:
+                    continue
+                bucket = self.levels[level][(self.current // span) % self.sizes[level]]
+                moved = list(bucket.items())
+                bucket.clear()
+                for key, (due, item) in moved:
+                    self.entries.pop(key, None)
+                    if not self._place(key, due, item):
+                        due_items.append((key, item))
+            bucket = self.levels[0][self.current % self.sizes[0]]
+            for key, (due, item) in list(bucket.items()):
+                if due <= self.current:
+                    bucket.pop(key)
+                    self.entries.pop(key, None)
+                    due_items.append((key, item))
+        return due_items
+
+    def __len__(self):
+        return len(self.entries)
+
+async def schedule(db, kind: str, key: str, run_at: datetime, payload: Optional[dict] = None, replace: bool = True):
+    """Create or move a job. With replace=False an existing job is left alone."""
+    now = datetime.now(timezone.utc)
+    fields = {'kind': kind, 'run_at': run_at, 'payload': payload or {}, 'status': 'scheduled', 'attempts': 0}
+    if replace:
+        while True:
+            try:
+                await db[COLLECTION].update_one(
+                    {'_id': key, 'status': {'$ne': 'running'}},
+                    {'$set': {**fields, 'updated_at': now}, '$unset': {'finished_at': '', 'last_error': '', 'next': ''}, '$setOnInsert': {'created_at': now}},
+                    upsert=True
+                )
+                break
+            except DuplicateKeyError:
+                # Running right now: the run finishes, then the job moves to the new time
+                parked = await db[COLLECTION].update_one(
+                    {'_id': key, 'status': 'running'},
+                    {'$set': {'next': {'kind': kind, 'run_at': run_at, 'payload': payload or {}}, 'updated_at': now}}
+                )
+                if parked.matched_count:
+                    return
+                # The run finished in between; try the plain update again
+    else:
+        await db[COLLECTION].update_one(
+            {'_id': key},
+            {'$setOnInsert': {**fields, 'created_at': now, 'updated_at': now}},
+            upsert=True
+        )
+        job = await db[COLLECTION].find_one({'_id': key}, {'status': 1, 'run_at': 1})
+        if not job or job['status'] != 'scheduled':
+            return
+        run_at = job['run_at']
+    delayed_queue.track(key, run_at)
+
+async def cancel(db, key: str) -> bool:
+    """Cancel a scheduled job, or the reschedule parked on a running one"""
+    # The running case goes first: a run finishing in between applies
+    # `next` and leaves a scheduled job for the second update to cancel
+    parked = await db[COLLECTION].update_one(
+        {'_id': key, 'status': 'running', 'next': {'$exists': True}},
+        {'$unset': {'next': ''}}
+    )
+    result = await db[COLLECTION].update_one(
+        {'_id': key, 'status': 'scheduled'},
+        {'$set': {'status': 'cancelled', 'finished_at': datetime.now(timezone.utc)}}
+    )
+    delayed_queue.untrack(key)
+    return parked.modified_count > 0 or result.modified_count > 0
+
+async def status_counts(db) -> Dict[str, int]:
+    return {
+        row['_id']: row['count'] async for row in db[COLLECTION].aggregate([
+            {'$group': {'_id': '$status', 'count': {'$sum': 1}}}
+        ])
+    }
+
+def _aware(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+class DelayedJobQueue:
+    """Loader plus timing wheel driving the delayed_jobs collection"""
+
+    def __init__(self, lookahead_seconds: int = LOOKAHEAD_SECONDS):
+        self.lookahead_seconds = lookahead_seconds
+        self.db = None
+        self.wheel: Optional[TimingWheel] = None
+        self.tasks: List[asyncio.Task] = []
+        self.running: set = set()
+        self.metrics = {'loaded': 0, 'fired': 0, 'done': 0, 'retried': 0, 'failed': 0, 'skipped': 0}
+
+    async def start(self, db):
+        self.db = db
+        self.wheel = TimingWheel()
+        if self.lookahead_seconds >= self.wheel.horizon_seconds:
+            self.lookahead_seconds = int(self.wheel.horizon_seconds) - LOAD_INTERVAL_SECONDS
+        self.tasks = [asyncio.create_task(self._load_loop()), asyncio.create_task(self._tick_loop())]
+        logger.info(f"Delayed job queue started ({len(HANDLERS)} handlers, {self.lookahead_seconds}s lookahead)")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        # In-flight jobs keep their lease and are retried after it expires
+        for task in list(self.running):
+            task.cancel()
+        await asyncio.gather(*self.running, return_exceptions=True)
+
+    def track(self, key: str, run_at: datetime):
+        """Put a (re)scheduled job in the wheel if it falls in the loaded window"""
+        if self.wheel is None:
+            return
+        timestamp = _aware(run_at).timestamp()
+        if timestamp - time.time() > self.lookahead_seconds:
+            self.wheel.remove(key)
+        elif not self.wheel.add(key, timestamp, key):
+            self._fire(key)
+
+    def untrack(self, key: str):
+        if self.wheel is not None:
+            self.wheel.remove(key)
+
+    async def _load_loop(self):
+        while True:
+            try:
+                await self.load()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error loading delayed jobs: {str(e)}")
+            await asyncio.sleep(LOAD_INTERVAL_SECONDS)
+
+    async def load(self) -> int:
+        """Pull jobs due within the lookahead (and expired leases) into the wheel"""
+        now = datetime.now(timezone.utc)
+        await self.db[COLLECTION].update_many(
+            {'status': 'running', 'lease_until': {'$lt': now}},
+            {'$set': {'status': 'scheduled'}, '$unset': {'lease_until': ''}}
+        )
+        loaded = 0
+        cursor = self.db[COLLECTION].find(
+            {'status': 'scheduled', 'run_at': {'$lte': now + timedelta(seconds=self.lookahead_seconds)}},
+            {'_id': 1, 'run_at': 1}
+        ).sort('run_at', 1)
+        async for job in cursor:
+            timestamp = _aware(job['run_at']).timestamp()
+            if self.wheel.due_tick(job['_id']) == self.wheel.due_tick_of(timestamp):
+                continue
+            self.track(job['_id'], job['run_at'])
+            loaded += 1
+        self.metrics['loaded'] += loaded
+        return loaded
+
+    async def _tick_loop(self):
+        while True:
+            # Wake on the next tick boundary so jobs fire on their second
+            now = time.time()
+            await asyncio.sleep(self.wheel.tick_seconds - (now % self.wheel.tick_seconds))
+            for key, _ in self.wheel.advance(time.time()):
+                self._fire(key)
+
+    def _fire(self, key: str):
+        task = asyncio.create_task(self._run(key))
+        self.running.add(task)
+        task.add_done_callback(self.running.discard)
+
+    async def _run(self, key: str):
+        now = datetime.now(timezone.utc)
+        # Claim: still scheduled, not moved later, not taken by another process
+        job = await self.db[COLLECTION].find_one_and_update(
+            {'_id': key, 'status': 'scheduled', 'run_at': {'$lte': now + timedelta(seconds=1)}},
+            {'$set': {'status': 'running', 'lease_until': now + timedelta(seconds=LEASE_SECONDS)}, '$inc': {'attempts': 1}},
+            return_document=ReturnDocument.AFTER
+        )
+        if not job:
+            self.metrics['skipped'] += 1
+            return
+        self.metrics['fired'] += 1
+
+        fn = HANDLERS.get(job['kind'])
+        try:
+            if fn is None:
+                raise RuntimeError(f"No handler for {job['kind']}")
+            await fn(self.db, job.get('payload') or {})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._failed(job, e)
+            return
+        result = await self.db[COLLECTION].update_one(
+            {'_id': key, 'status': 'running', 'next': {'$exists': False}},
+            {'$set': {'status': 'done', 'finished_at': datetime.now(timezone.utc)}, '$unset': {'lease_until': ''}}
+        )
+        if not result.matched_count:
+            await self._apply_next(key)
+        self.metrics['done'] += 1
+
+    async def _apply_next(self, key: str):
+        """Move a job that was rescheduled while running to its new time"""
+        while True:
+            job = await self.db[COLLECTION].find_one({'_id': key, 'status': 'running'}, {'next': 1})
+            if not job or 'next' not in job:
+                return
+            result = await self.db[COLLECTION].update_one(
+                {'_id': key, 'status': 'running', 'next': job['next']},
+                {
+                    '$set': {**job['next'], 'status': 'scheduled', 'attempts': 0},
+                    '$unset': {'next': '', 'lease_until': '', 'last_error': ''}
+                }
+            )
+            if result.matched_count:
+                self.track(key, job['next']['run_at'])
+                return
+
+    async def _failed(self, job: dict, error: Exception):
+        logger.error(f"Delayed job {job['_id']} failed (attempt {job['attempts']}): {str(error)}")
+        if job['attempts'] < MAX_ATTEMPTS:
+            run_at = datetime.now(timezone.utc) + timedelta(seconds=RETRY_DELAY_SECONDS * 2 ** (job['attempts'] - 1))
+            update = {'status': 'scheduled', 'run_at': run_at, 'last_error': str(error)}
+            self.metrics['retried'] += 1
+        else:
+            update = {'status': 'failed', 'finished_at': datetime.now(timezone.utc), 'last_error': str(error)}
+            self.metrics['failed'] += 1
+            run_at = None
+        result = await self.db[COLLECTION].update_one(
+            {'_id': job['_id'], 'status': 'running', 'next': {'$exists': False}},
+            {'$set': update, '$unset': {'lease_until': ''}}
+        )
+        if not result.matched_count:
+            # Rescheduled while running: the new time replaces the retry
+            await self._apply_next(job['_id'])
+        elif run_at:
+            self.track(job['_id'], run_at)
+
+    def stats(self) -> dict:
+        return {**self.metrics, 'in_wheel': len(self.wheel) if self.wheel is not None else 0, 'running': len(self.running)}
+
+delayed_queue = DelayedJobQueue()
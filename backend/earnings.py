@@ -0,0 +1,194 @@
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import List, Optional
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+import rebuilds
+
+logger = logging.getLogger(__name__)
+
+# Per-mechanic earnings counters. One document per (mechanic, period):
+#   period_type 'all'   -> period 'all'         (lifetime totals)
+#   period_type 'month' -> period 'YYYY-MM'
+#   period_type 'day'   -> period 'YYYY-MM-DD'
+# Completions add to gross/fee/net, payments add to paid_amount; every
+# change is a $inc upsert on all three documents, so no read-modify-write.
+# The backfill runs as a fenced rebuild (see rebuilds.py), so writers
+# keep going while it runs.
+COLLECTION = 'earnings_buckets'
+FIELDS = {'completed_orders': 0, 'gross': 0.0, 'platform_fee': 0.0, 'net': 0.0, 'payments': 0, 'paid_amount': 0.0}
+PLATFORM_FEE_RATE = 0.15
+COMPLETED_STATUSES = ['completed', 'reviewed']
+
+DEFAULT_DAYS = 30
+DEFAULT_MONTHS = 12
+
+async def ensure_indexes(db):
+    """Unique bucket key (also serves the dashboard read)"""
+    await db[COLLECTION].create_index(
+        [('mechanic_id', ASCENDING), ('period_type', ASCENDING), ('period', ASCENDING)],
+        unique=True
+    )
+    await db.quotes.create_index([('mechanic_id', ASCENDING), ('status', ASCENDING), ('completed_at', DESCENDING)])
+
+def _periods(ts: str) -> List[tuple]:
+    day = ts[:10]
+    return [('all', 'all'), ('month', day[:7]), ('day', day)]
+
+async def _fence(db, mechanic_id: str, session=None) -> Optional[str]:
+    """Fence of a backfill covering this mechanic, if one is running"""
+    rebuild = await rebuilds.current(db, 'earnings', session)
+    if rebuild and rebuild.get('mechanic_id') in (None, mechanic_id):
+        return rebuild['fence']
+    return None
+
+def _bucket_ops(mechanic_id: str, ts: str, inc: dict, fence: Optional[str] = None) -> List[UpdateOne]:
+    now = datetime.now(timezone.utc).isoformat()
+    inc = rebuilds.fenced(inc, ts, fence)
+    return [
+        UpdateOne(
+            {'mechanic_id': mechanic_id, 'period_type': period_type, 'period': period},
+            {'$inc': inc, '$set': {'updated_at': now}},
+            upsert=True
+        )
+        for period_type, period in _periods(ts)
+    ]
+
+def completion_increments(final_price: float) -> dict:
+    """Counter deltas for one completed order"""
+    gross = float(final_price or 0)
+    fee = round(gross * PLATFORM_FEE_RATE, 2)
+    return {
+        'completed_orders': 1,
+        'gross': gross,
+        'platform_fee': fee,
+        'net': round(gross - fee, 2)
+    }
+
+async def record_completion(db, mechanic_id: str, final_price: float, completed_at: Optional[str] = None):
+    """Add a completed order to the mechanic's counters"""
+    ts = completed_at or datetime.now(timezone.utc).isoformat()
+    await db[COLLECTION].bulk_write(
+        _bucket_ops(mechanic_id, ts, completion_increments(final_price), await _fence(db, mechanic_id)),
+        ordered=False
+    )
+
+async def record_payment(db, mechanic_id: str, amount: float, paid_at: Optional[str] = None, session=None):
+    """Add a received payment (pass the session to join a transaction)"""
+    ts = paid_at or datetime.now(timezone.utc).isoformat()
+    await db[COLLECTION].bulk_write(
+        _bucket_ops(mechanic_id, ts, {'payments': 1, 'paid_amount': float(amount or 0)}, await _fence(db, mechanic_id, session)),
+        ordered=False,
+        session=session
+    )
+
+def _totals(doc: Optional[dict]) -> dict:
+    doc = doc or {}
+    return {
+        'total_orders': doc.get('completed_orders', 0),
+        'total_earnings': round(doc.get('gross', 0.0), 2),
+        'platform_fee': round(doc.get('platform_fee', 0.0), 2),
+        'net_earnings': round(doc.get('net', 0.0), 2),
+        'paid_amount': round(doc.get('paid_amount', 0.0), 2),
+        'payments': doc.get('payments', 0)
+    }
+
+async def get_summary(db, mechanic_id: str, days: int = DEFAULT_DAYS, months: int = DEFAULT_MONTHS) -> dict:
+    """Lifetime totals plus recent daily and monthly buckets in one query"""
+    today = datetime.now(timezone.utc)
+    first_day = (today - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+    year, month = today.year, today.month - (months - 1)
+    while month <= 0:
+        month += 12
+        year -= 1
+    first_month = f"{year:04d}-{month:02d}"
+
+    docs = await db[COLLECTION].find(
+        {
+            'mechanic_id': mechanic_id,
+            '$or': [
+                {'period_type': 'all'},
+                {'period_type': 'month', 'period': {'$gte': first_month}},
+                {'period_type': 'day', 'period': {'$gte': first_day}}
+            ]
+        },
+        {'_id': 0}
+    ).to_list(days + months + 1)
+
+    lifetime = next((d for d in docs if d['period_type'] == 'all'), None)
+
+    def series(period_type):
+        return [
+            {'period': d['period'], **_totals(d)}
+            for d in sorted((d for d in docs if d['period_type'] == period_type), key=lambda d: d['period'])
+        ]
+
+    return {**_totals(lifetime), 'daily': series('day'), 'monthly': series('month')}
+
+async def backfill(db, mechanic_id: Optional[str] = None) -> int:
+    """Rebuild buckets from completed orders and payments (all mechanics or one)"""
+    scope = {'mechanic_id': mechanic_id} if mechanic_id else {}
+    written = await rebuilds.run(
+        db, 'earnings', COLLECTION, scope, FIELDS,
+        lambda fence: _recount(db, mechanic_id, fence),
+        mechanic_id=mechanic_id
+    )
+    logger.info(f"Earnings backfill wrote {written} buckets")
+    return written
+
+async def _recount(db, mechanic_id: Optional[str], fence: str) -> List[rebuilds.Bucket]:
+    match = {
+        'status': {'$in': COMPLETED_STATUSES},
+        'mechanic_id': mechanic_id or {'$ne': None},
+        '$or': [
+            {'completed_at': {'$lt': fence}},
+            {'completed_at': None, 'updated_at': {'$lt': fence}}
+        ]
+    }
+
+    buckets = {}
+
+    def add(key, inc):
+        bucket = buckets.setdefault(key, {})
+        for field, value in inc.items():
+            bucket[field] = bucket.get(field, 0) + value
+
+    # Grouped server-side per mechanic and day; months and totals are derived
+    completions = db.quotes.aggregate([
+        {'$match': match},
+        {'$project': {
+            'mechanic_id': 1,
+            'final_price': {'$ifNull': ['$final_price', 0]},
+            'day': {'$substrCP': [{'$ifNull': ['$completed_at', '$updated_at']}, 0, 10]}
+        }},
+        {'$group': {
+            '_id': {'mechanic_id': '$mechanic_id', 'day': '$day'},
+            'completed_orders': {'$sum': 1},
+            'gross': {'$sum': '$final_price'}
+        }}
+    ], allowDiskUse=True)
+    async for row in completions:
+        gross = row['gross']
+        fee = round(gross * PLATFORM_FEE_RATE, 2)
+        inc = {'completed_orders': row['completed_orders'], 'gross': gross, 'platform_fee': fee, 'net': round(gross - fee, 2)}
+        for period in _periods(row['_id']['day'] or ''):
+            add((row['_id']['mechanic_id'], *period), inc)
+
+    payment_pipeline = [
+        {'$match': {'status': 'completed', 'mechanic_earnings': {'$gt': 0}, 'created_at': {'$lt': fence}}},
+        {'$lookup': {'from': 'quotes', 'localField': 'quote_id', 'foreignField': 'id', 'as': 'order'}},
+        {'$unwind': '$order'},
+        {'$match': {'order.mechanic_id': mechanic_id} if mechanic_id else {'order.mechanic_id': {'$ne': None}}},
+        {'$group': {
+            '_id': {'mechanic_id': '$order.mechanic_id', 'day': {'$substrCP': ['$created_at', 0, 10]}},
+            'payments': {'$sum': 1},
+            'paid_amount': {'$sum': {'$ifNull': ['$mechanic_earnings', 0]}}
+        }}
+    ]
+    async for row in db.payments.aggregate(payment_pipeline, allowDiskUse=True):
+        for period in _periods(row['_id']['day'] or ''):
+            add((row['_id']['mechanic_id'], *period), {'payments': row['payments'], 'paid_amount': row['paid_amount']})
+
+    return [
+        ({'mechanic_id': key[0], 'period_type': key[1], 'period': key[2]}, values)
+        for key, values in buckets.items()
+    ]
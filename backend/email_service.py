@@ -1,7 +1,7 @@
 import os
 import logging
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
+from typing import List
+import notification_templates as templates
 
 logger = logging.getLogger(__name__)
 
@@ -9,68 +9,23 @@ SENDGRID_API_KEY = os.environ.get('SENDGRID_API_KEY')
 FROM_EMAIL = os.environ.get('SENDGRID_FROM_EMAIL', 'noreply@clickmecanico.com')
 FRONTEND_URL = os.environ.get('FRONTEND_URL', 'https://clickmecanico.emergent.host')
 
-def send_email(to_email: str, subject: str, html_content: str):
-    """Send email via SendGrid"""
-    if not SENDGRID_API_KEY:
-        logger.warning("SendGrid API key not configured")
-        return False
-    
-    try:
-        message = Mail(
-            from_email=FROM_EMAIL,
-            to_emails=to_email,
-            subject=subject,
-            html_content=html_content
-        )
-        
-        sg = SendGridAPIClient(SENDGRID_API_KEY)
-        response = sg.send(message)
-        
-        logger.info(f"Email sent to {to_email}: {subject} (Status: {response.status_code})")
-        return True
-    except Exception as e:
-        logger.error(f"Error sending email: {str(e)}")
-        return False
+# Email builders. Each returns outbox messages for `outbox.enqueue`,
+# rendered from the compiled templates in notification_templates.
+def email_new_order_to_mechanics(mechanics: List[dict], order_id: str, service: str, location: str) -> List[dict]:
+    """Notify mechanics about a new order (one batch per locale)"""
+    shared = {'order_id': order_id, 'service': service, 'location': location, 'url': f"{FRONTEND_URL}/mechanic/dashboard"}
+    return templates.email_batch('new_order', shared, mechanics)
 
-# Email templates
-def email_new_order_to_mechanic(mechanic_email: str, mechanic_name: str, order_id: str, service: str, location: str):
-    """Notify mechanic about new order"""
-    subject = f"Novo Pedido #{order_id} - ClickMecanico"
-    html = f"""
-    <h2>Olá {mechanic_name}!</h2>
-    <p>Você tem um novo pedido disponível:</p>
-    <ul>
-        <li><strong>Pedido:</strong> #{order_id}</li>
-        <li><strong>Serviço:</strong> {service}</li>
-        <li><strong>Local:</strong> {location}</li>
-    </ul>
-    <p>Acesse o dashboard para enviar seu orçamento.</p>
-    <a href="{FRONTEND_URL}/mechanic/dashboard" style="background:#1EC6C6;color:white;padding:10px 20px;text-decoration:none;border-radius:5px;">Ver Pedido</a>
-    """
-    return send_email(mechanic_email, subject, html)
-
-def email_quote_to_client(client_email: str, client_name: str, order_id: str, mechanic_name: str, price: float):
+def email_quote_to_client(client: dict, order_id: str, mechanic_name: str, price: float) -> List[dict]:
     """Notify client about mechanic quote"""
-    subject = f"Orçamento Recebido - Pedido #{order_id}"
-    html = f"""
-    <h2>Olá {client_name}!</h2>
-    <p>O mecânico <strong>{mechanic_name}</strong> enviou um orçamento:</p>
-    <ul>
-        <li><strong>Pedido:</strong> #{order_id}</li>
-        <li><strong>Valor:</strong> R$ {price:.2f}</li>
-    </ul>
-    <p>Acesse o dashboard para aprovar ou recusar.</p>
-    <a href="{FRONTEND_URL}/dashboard" style="background:#1EC6C6;color:white;padding:10px 20px;text-decoration:none;border-radius:5px;">Ver Orçamento</a>
-    """
-    return send_email(client_email, subject, html)
+    shared = {'order_id': order_id, 'mechanic_name': mechanic_name, 'price': price, 'url': f"{FRONTEND_URL}/dashboard"}
+    return templates.email_batch('quote_received', shared, [client])
 
-def email_payment_confirmed(mechanic_email: str, mechanic_name: str, order_id: str):
+def email_payment_confirmed(mechanic: dict, order_id: str) -> List[dict]:
     """Notify mechanic that payment was confirmed"""
-    subject = f"Pagamento Confirmado - Pedido #{order_id}"
-    html = f"""
-    <h2>Ótima notícia, {mechanic_name}!</h2>
-    <p>O pagamento do pedido <strong>#{order_id}</strong> foi confirmado.</p>
-    <p>O serviço está agendado. Acesse o dashboard para ver detalhes.</p>
-    <a href="{FRONTEND_URL}/mechanic/dashboard" style="background:#27AE60;color:white;padding:10px 20px;text-decoration:none;border-radius:5px;">Ver Agenda</a>
-    """
-    return send_email(mechanic_email, subject, html)
+    shared = {'order_id': order_id, 'url': f"{FRONTEND_URL}/mechanic/dashboard"}
+    return templates.email_batch('payment_confirmed', shared, [mechanic])
+
+def email_notification(to_email: str, title: str, message: str) -> List[dict]:
+    """In-app notification mirrored to email"""
+    return templates.email_batch('notification', {'title': title, 'message': message}, [{'email': to_email}])
@@ -0,0 +1,62 @@
+import json
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Optional
+from pubsub import bus
+
+logger = logging.getLogger(__name__)
+
+# Per-user Server-Sent Events: notifications, order status changes and
+# payment confirmations are published on the user's topic and streamed to
+# every open /events/stream connection of that user in this process.
+HEARTBEAT_SECONDS = 15
+RETRY_MS = 3000
+
+def user_topic(user_id: str) -> str:
+    return f"events:{user_id}"
+
+def publish(user_id: Optional[str], event: str, data: dict):
+    """Publish to one user's stream (no-op without a user)"""
+    if user_id:
+        bus.publish_event(user_topic(user_id), event, data)
+
+def _seq(event_id: str) -> int:
+    return int(event_id.rpartition('-')[2])
+
+def format_event(message: dict) -> str:
+    return f"id: {message['id']}\nevent: {message['event']}\ndata: {json.dumps(message['data'], default=str)}\n\n"
+
+async def stream(
+    user_id: str,
+    last_event_id: Optional[str],
+    is_disconnected: Callable[[], Awaitable[bool]],
+    heartbeat: float = HEARTBEAT_SECONDS
+) -> AsyncIterator[str]:
+    """SSE body: replay since `last_event_id`, then live events and heartbeats.
+
+    If the missed events are no longer buffered (restart, long absence) a
+    `resync` event tells the client to reload its state once.
+    """
+    # Subscribe before replaying so nothing published in between is lost
+    async with bus.subscription(user_topic(user_id)) as queue:
+        yield f"retry: {RETRY_MS}\n\n"
+        last_seq = 0
+        if last_event_id:
+            missed = bus.replay(user_topic(user_id), last_event_id)
+            if missed is None:
+                yield "event: resync\ndata: {}\n\n"
+            else:
+                for message in missed:
+                    last_seq = _seq(message['id'])
+                    yield format_event(message)
+
+        while True:
+            message = await bus.wait_for(queue, heartbeat)
+            if await is_disconnected():
+                break
+            if message is None:
+                yield ": ping\n\n"
+                continue
+            # Already sent during replay
+            if _seq(message['id']) <= last_seq:
+                continue
+            yield format_event(message)
@@ -0,0 +1,229 @@
+import base64
+import csv
+import importlib.util
+import io
+import json
+import logging
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from pymongo import ASCENDING
+
+logger = logging.getLogger(__name__)
+
+# Admin exports stream a Motor cursor batch by batch into the response
+# body, so memory stays at one batch whatever the export size. Rows come
+# in (created_at, id) order and end with an opaque `cursor` column; pass
+# the last row's cursor as `after` to resume an interrupted export.
+BATCH_SIZE = 1000
+
+# Column name -> type (str, float, int, bool) per export
+EXPORTS: Dict[str, dict] = {
+    'orders': {
+        'collection': 'quotes',
+        'columns': {
+            'id': str, 'created_at': str, 'updated_at': str, 'status': str,
+            'client_id': str, 'mechanic_id': str, 'service': str, 'location': str, 'area': str,
+            'plate': str, 'make': str, 'model': str, 'year': str,
+            'date': str, 'time': str, 'location_type': str,
+            'labor_price': float, 'estimated_price': float, 'final_price': float, 'travel_fee': float,
+            'prebooking_paid': bool, 'prebooking_amount': float, 'payment_status': str,
+            'completed_at': str, 'duration_minutes': int
+        }
+    },
+    'payments': {
+        'collection': 'payments',
+        'columns': {
+            'id': str, 'created_at': str, 'status': str, 'quote_id': str, 'client_id': str,
+            'amount': float, 'payment_method': str, 'payment_type': str,
+            'platform_fee': float, 'mechanic_earnings': float
+        }
+    },
+    'reviews': {
+        'collection': 'reviews',
+        'columns': {
+            'id': str, 'created_at': str, 'order_id': str, 'client_id': str, 'client_name': str, 'mechanic_id': str,
+            'rating': int, 'comment': str
+        }
+    }
+}
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+class ExportError(Exception):
+    pass
+
+async def ensure_indexes(db):
+    """Keyset order of every export, optionally filtered by status"""
+    for spec in EXPORTS.values():
+        await db[spec['collection']].create_index([('created_at', ASCENDING), ('id', ASCENDING)])
+        if 'status' in spec['columns']:
+            await db[spec['collection']].create_index([('status', ASCENDING), ('created_at', ASCENDING), ('id', ASCENDING)])
+
+def encode_cursor(*values: str) -> str:
+    """Opaque, URL-safe keyset cursor"""
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).rstrip(b'=').decode()
+
+def decode_cursor(cursor: str, size: int = 2) -> Tuple[str, ...]:
+    """Values of a cursor from encode_cursor; ValueError if it isn't one"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size or not all(isinstance(v, str) and v for v in values):
+        raise ValueError("Invalid cursor")
+    return tuple(values)
+
+def row_cursor(doc: dict) -> str:
+    return encode_cursor(doc.get('created_at') or '', doc.get('id') or '')
+
+def parse_after(after: Optional[str]) -> Optional[Tuple[str, str]]:
+    """Cursor of the last exported row"""
+    if not after:
+        return None
+    try:
+        return decode_cursor(after)
+    except ValueError:
+        raise ExportError("after must be the cursor of the last exported row")
+
+def build_query(start: Optional[str] = None, end: Optional[str] = None,
+                statuses: Optional[List[str]] = None, after: Optional[Tuple[str, str]] = None) -> dict:
+    """Date range and status filter plus the keyset resume condition"""
+    conditions = []
+    created_at = {}
+    if start:
+        created_at['$gte'] = start
+    if end:
+        created_at['$lt'] = end
+    if created_at:
+        conditions.append({'created_at': created_at})
+    if statuses:
+        conditions.append({'status': {'$in': statuses}})
+    if after:
+        conditions.append({'$or': [
+            {'created_at': {'$gt': after[0]}},
+            {'created_at': after[0], 'id': {'$gt': after[1]}}
+        ]})
+    if not conditions:
+        return {}
+    return conditions[0] if len(conditions) == 1 else {'$and': conditions}
+
+async def _batches(db, export: str, query: dict, batch_size: int) -> AsyncIterator[List[dict]]:
+    spec = EXPORTS[export]
+    projection = {'_id': 0, **{column: 1 for column in spec['columns']}}
+    cursor = db[spec['collection']].find(query, projection).sort(
+        [('created_at', ASCENDING), ('id', ASCENDING)]
+    ).batch_size(batch_size)
+
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _cell(value, kind):
+    if value is None or value == '':
+        return None
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        return None
+
+async def stream_csv(db, export: str, query: dict, batch_size: int = BATCH_SIZE) -> AsyncIterator[bytes]:
+    """CSV bytes, one chunk per cursor batch"""
+    columns = list(EXPORTS[export]['columns'])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns + ['cursor'])
+    rows = 0
+
+    async for batch in _batches(db, export, query, batch_size):
+        for doc in batch:
+            writer.writerow(['' if doc.get(c) is None else doc.get(c) for c in columns] + [row_cursor(doc)])
+        rows += len(batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+    logger.info(f"Streamed {rows} {export} rows as CSV")
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object whose contents are drained after each row group"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer.extend(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+def _parquet_schema(export: str):
+    import pyarrow as pa
+
+    types = {str: pa.string(), float: pa.float64(), int: pa.int64(), bool: pa.bool_()}
+    return pa.schema(
+        [(name, types[kind]) for name, kind in EXPORTS[export]['columns'].items()] + [('cursor', pa.string())]
+    )
+
+def _require_parquet():
+    if importlib.util.find_spec('pyarrow') is None:
+        raise ExportError("Parquet export requires pyarrow (pip install pyarrow)")
+
+async def stream_parquet(db, export: str, query: dict, batch_size: int = BATCH_SIZE) -> AsyncIterator[bytes]:
+    """Parquet bytes, one row group per cursor batch"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = EXPORTS[export]['columns']
+    schema = _parquet_schema(export)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='snappy')
+    rows = 0
+    try:
+        async for batch in _batches(db, export, query, batch_size):
+            table = pa.Table.from_pydict(
+                {
+                    **{name: [_cell(doc.get(name), kind) for doc in batch] for name, kind in columns.items()},
+                    'cursor': [row_cursor(doc) for doc in batch]
+                },
+                schema=schema
+            )
+            writer.write_table(table, row_group_size=len(batch))
+            rows += len(batch)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    finally:
+        writer.close()
+    yield sink.drain()
+    logger.info(f"Streamed {rows} {export} rows as Parquet")
+
+def stream_export(db, export: str, fmt: str, query: dict, batch_size: int = BATCH_SIZE) -> AsyncIterator[bytes]:
+    """Validate the request, then return the body iterator"""
+    if export not in EXPORTS:
+        raise ExportError(f"Unknown export: {export}")
+    if fmt == 'csv':
+        return stream_csv(db, export, query, batch_size)
+    if fmt == 'parquet':
+        _require_parquet()
+        return stream_parquet(db, export, query, batch_size)
+    raise ExportError(f"Unknown format: {fmt}")
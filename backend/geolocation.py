@@ -1,5 +1,7 @@
 import math
 import logging
+import unicodedata
+from typing import Optional
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +20,17 @@ def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
     distance = R * c
     return round(distance, 2)
 
+def normalize_area(location: Optional[str]) -> Optional[str]:
+    """Reduce a free-text location to an area key (city, lowercase, no accents).
+
+    "São Paulo, SP" -> "sao paulo"
+    """
+    if not location:
+        return None
+    city = location.split(',')[0].split(' - ')[0].strip().lower()
+    city = unicodedata.normalize('NFKD', city).encode('ascii', 'ignore').decode()
+    return ' '.join(city.split()) or None
+
 def calculate_travel_fee(distance_km: float) -> float:
     """Calculate travel fee based on distance"""
     if distance_km <= 5:
@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Optional
+from uuid import uuid4
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# Stored responses for requests sent with an `Idempotency-Key` header.
+# A repeat returns the stored response; a concurrent duplicate waits for
+# the first request to finish instead of running the handler again.
+COLLECTION = 'idempotency_keys'
+KEY_TTL_SECONDS = 24 * 3600
+# An in-progress record older than this belongs to a crashed request. A
+# slow owner can still be running when it is taken over, so each claim
+# carries an owner token and only its owner may release or complete it.
+IN_PROGRESS_TIMEOUT_SECONDS = 60
+POLL_INTERVAL_SECONDS = 0.2
+
+# Requests currently executing in this process: {record_id: Event}
+_inflight: Dict[str, asyncio.Event] = {}
+
+async def ensure_indexes(db):
+    """TTL index expiring stored responses"""
+    await db[COLLECTION].create_index([('created_at', ASCENDING)], expireAfterSeconds=KEY_TTL_SECONDS)
+
+def request_fingerprint(payload) -> str:
+    """Stable hash of the request body, to detect a key reused for another request"""
+    body = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(body.encode()).hexdigest()
+
+def _replay(record: dict) -> JSONResponse:
+    return JSONResponse(
+        content=record['response'],
+        status_code=record.get('status_code', 200),
+        headers={'Idempotent-Replayed': 'true'}
+    )
+
+async def _wait_for_first(db, record_id: str, timeout: float):
+    """Wait until the request owning `record_id` finishes (or timeout)"""
+    event = _inflight.get(record_id)
+    if event:
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return
+
+    # Owned by another worker process: poll
+    deadline = asyncio.get_running_loop().time() + timeout
+    while asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(POLL_INTERVAL_SECONDS)
+        record = await db[COLLECTION].find_one({'_id': record_id}, {'status': 1})
+        if not record or record['status'] != 'in_progress':
+            return
+
+async def run_idempotent(
+    db,
+    key: Optional[str],
+    user_id: str,
+    scope: str,
+    fingerprint: str,
+    handler: Callable[[], Awaitable]
+):
+    """Run `handler` at most once per (scope, user, Idempotency-Key)"""
+    if not key:
+        return await handler()
+
+    record_id = f"{scope}:{user_id}:{key}"
+    owner = uuid4().hex
+    while True:
+        try:
+            await db[COLLECTION].insert_one({
+                '_id': record_id,
+                'status': 'in_progress',
+                'owner': owner,
+                'fingerprint': fingerprint,
+                'created_at': datetime.now(timezone.utc)
+            })
+            break
+        except DuplicateKeyError:
+            record = await db[COLLECTION].find_one({'_id': record_id})
+            if not record:
+                continue  # expired or released meanwhile - try to claim again
+
+            if record['fingerprint'] != fingerprint:
+                raise HTTPException(status_code=422, detail="Idempotency-Key already used for a different request")
+
+            if record['status'] == 'completed':
+                logger.info(f"Idempotent replay for {record_id}")
+                return _replay(record)
+
+            created_at = record['created_at'].replace(tzinfo=timezone.utc)
+            age = (datetime.now(timezone.utc) - created_at).total_seconds()
+            if age > IN_PROGRESS_TIMEOUT_SECONDS:
+                # Owner died without releasing the key: take it over
+                await db[COLLECTION].delete_one({'_id': record_id, 'status': 'in_progress', 'owner': record.get('owner'), 'created_at': record['created_at']})
+                continue
+
+            await _wait_for_first(db, record_id, IN_PROGRESS_TIMEOUT_SECONDS - age)
+
+    event = asyncio.Event()
+    _inflight[record_id] = event
+    try:
+        result = await handler()
+    except BaseException:
+        # Failures are not stored: the client may fix the request and retry
+        await db[COLLECTION].delete_one({'_id': record_id, 'status': 'in_progress', 'owner': owner})
+        raise
+    else:
+        response = jsonable_encoder(result)
+        stored = await db[COLLECTION].update_one(
+            {'_id': record_id, 'status': 'in_progress', 'owner': owner},
+            {'$set': {
+                'status': 'completed',
+                'status_code': 200,
+                'response': response,
+                'completed_at': datetime.now(timezone.utc)
+            }}
+        )
+        if not stored.matched_count:
+            logger.warning(f"Idempotency key {record_id} was taken over while its request ran")
+        return response
+    finally:
+        event.set()
+        if _inflight.get(record_id) is event:
+            del _inflight[record_id]
@@ -0,0 +1,246 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional, Tuple
+from uuid import uuid4
+from pymongo import ASCENDING, DESCENDING
+
+logger = logging.getLogger(__name__)
+
+# Append-only double-entry ledger of mechanic money.
+# Every transaction is a set of entries whose amounts sum to zero; all
+# entries carry the mechanic_id so one index serves both sides.
+ENTRIES = 'ledger_entries'
+SNAPSHOTS = 'ledger_snapshots'
+RECONCILIATIONS = 'ledger_reconciliations'
+
+# Accounts
+MECHANIC_PENDING = 'mechanic_pending'
+MECHANIC_AVAILABLE = 'mechanic_available'
+PLATFORM_CLEARING = 'platform_clearing'  # money collected from clients
+PLATFORM_PAYOUTS = 'platform_payouts'  # money sent to mechanics
+
+# Snapshots only cover entries older than this, so transactions still
+# committing with an earlier timestamp are never skipped
+SNAPSHOT_LAG = timedelta(minutes=5)
+TOLERANCE = 0.005
+
+async def ensure_indexes(db):
+    """Indexes for balance reads, point-in-time rebuilds and reconciliation"""
+    await db[ENTRIES].create_index([('mechanic_id', ASCENDING), ('ts', ASCENDING), ('id', ASCENDING)])
+    await db[ENTRIES].create_index([('ts', ASCENDING)])
+    await db[ENTRIES].create_index([('txn_id', ASCENDING)])
+    await db[SNAPSHOTS].create_index([('mechanic_id', ASCENDING), ('as_of', DESCENDING)])
+    await db[SNAPSHOTS].create_index([('as_of', DESCENDING)])
+
+def _transaction(kind: str, mechanic_id: str, amount: float, debit: str, credit: str,
+                 reference_id: Optional[str] = None, ts: Optional[str] = None) -> List[dict]:
+    """Two balanced entries moving `amount` from `debit` to `credit`"""
+    txn_id = str(uuid4())
+    ts = ts or datetime.now(timezone.utc).isoformat()
+    base = {'txn_id': txn_id, 'kind': kind, 'mechanic_id': mechanic_id, 'reference_id': reference_id, 'ts': ts}
+    return [
+        {**base, 'id': str(uuid4()), 'account': credit, 'amount': round(amount, 2)},
+        {**base, 'id': str(uuid4()), 'account': debit, 'amount': -round(amount, 2)}
+    ]
+
+def credit_entries(mechanic_id: str, amount: float, payment_id: str, ts: Optional[str] = None) -> List[dict]:
+    """Client payment: mechanic earnings become pending"""
+    return _transaction('credit', mechanic_id, amount, PLATFORM_CLEARING, MECHANIC_PENDING, payment_id, ts)
+
+def release_entries(mechanic_id: str, amount: float, reference_id: str, ts: Optional[str] = None) -> List[dict]:
+    """Hold period over: pending becomes available"""
+    return _transaction('release', mechanic_id, amount, MECHANIC_PENDING, MECHANIC_AVAILABLE, reference_id, ts)
+
+def payout_entries(mechanic_id: str, amount: float, payout_id: str, ts: Optional[str] = None) -> List[dict]:
+    """Money sent to the mechanic"""
+    return _transaction('payout', mechanic_id, amount, MECHANIC_AVAILABLE, PLATFORM_PAYOUTS, payout_id, ts)
+
+async def post_entries(db, entries: List[dict], session=None):
+    """Append entries (pass the session to join a transaction)"""
+    if abs(sum(e['amount'] for e in entries)) > TOLERANCE:
+        raise ValueError("Unbalanced ledger transaction")
+    await db[ENTRIES].insert_many([dict(e) for e in entries], session=session)
+
+def _add_balances(balances: Dict[str, float], totals: Dict[str, float]) -> Dict[str, float]:
+    result = dict(balances)
+    for account, amount in totals.items():
+        result[account] = round(result.get(account, 0.0) + amount, 2)
+    return result
+
+async def _sum_entries(db, mechanic_id: str, after: Optional[str], until: Optional[str]) -> Dict[str, float]:
+    ts_range = {}
+    if after:
+        ts_range['$gt'] = after
+    if until:
+        ts_range['$lte'] = until
+    match = {'mechanic_id': mechanic_id}
+    if ts_range:
+        match['ts'] = ts_range
+    rows = await db[ENTRIES].aggregate([
+        {'$match': match},
+        {'$group': {'_id': '$account', 'total': {'$sum': '$amount'}}}
+    ]).to_list(None)
+    return {row['_id']: row['total'] for row in rows}
+
+async def get_balance(db, mechanic_id: str, at: Optional[str] = None) -> dict:
+    """Balances from the latest snapshot (before `at`) plus the entries after it"""
+    snapshot_query = {'mechanic_id': mechanic_id}
+    if at:
+        snapshot_query['as_of'] = {'$lte': at}
+    snapshot = await db[SNAPSHOTS].find_one(snapshot_query, {'_id': 0}, sort=[('as_of', -1)])
+
+    base = snapshot['balances'] if snapshot else {}
+    tail = await _sum_entries(db, mechanic_id, snapshot['as_of'] if snapshot else None, at)
+    balances = _add_balances(base, tail)
+    return {
+        'mechanic_id': mechanic_id,
+        'as_of': at or datetime.now(timezone.utc).isoformat(),
+        'pending_balance': balances.get(MECHANIC_PENDING, 0.0),
+        'available_balance': balances.get(MECHANIC_AVAILABLE, 0.0),
+        'snapshot_as_of': snapshot['as_of'] if snapshot else None,
+        'balances': balances
+    }
+
+async def take_snapshots(db, batch_size: int = 1000) -> int:
+    """Write a snapshot for every mechanic with entries since the previous run"""
+    last = await db[SNAPSHOTS].find_one({}, {'_id': 0, 'as_of': 1}, sort=[('as_of', -1)])
+    previous_as_of = last['as_of'] if last else ''
+    as_of = (datetime.now(timezone.utc) - SNAPSHOT_LAG).isoformat()
+    if as_of <= previous_as_of:
+        return 0
+
+    # Per-mechanic deltas since the last run, in one grouped scan of the ts index
+    deltas: Dict[str, Dict[str, float]] = defaultdict(dict)
+    counts: Dict[str, int] = defaultdict(int)
+    cursor = db[ENTRIES].aggregate([
+        {'$match': {'ts': {'$gt': previous_as_of, '$lte': as_of}}},
+        {'$group': {
+            '_id': {'mechanic_id': '$mechanic_id', 'account': '$account'},
+            'total': {'$sum': '$amount'},
+            'count': {'$sum': 1}
+        }}
+    ], allowDiskUse=True)
+    async for row in cursor:
+        mechanic_id = row['_id']['mechanic_id']
+        deltas[mechanic_id][row['_id']['account']] = row['total']
+        counts[mechanic_id] += row['count']
+
+    mechanic_ids = list(deltas)
+    written = 0
+    for i in range(0, len(mechanic_ids), batch_size):
+        chunk = mechanic_ids[i:i + batch_size]
+        previous = await _latest_snapshots(db, chunk)
+        snapshots = []
+        for mechanic_id in chunk:
+            prior = previous.get(mechanic_id, {})
+            snapshots.append({
+                'id': str(uuid4()),
+                'mechanic_id': mechanic_id,
+                'as_of': as_of,
+                'balances': _add_balances(prior.get('balances', {}), deltas[mechanic_id]),
+                'entry_count': prior.get('entry_count', 0) + counts[mechanic_id],
+                'created_at': datetime.now(timezone.utc).isoformat()
+            })
+        if snapshots:
+            await db[SNAPSHOTS].insert_many(snapshots)
+            written += len(snapshots)
+
+    logger.info(f"Ledger snapshots written: {written} (as of {as_of})")
+    return written
+
+async def _latest_snapshots(db, mechanic_ids: List[str], until: Optional[str] = None) -> Dict[str, dict]:
+    match = {'mechanic_id': {'$in': mechanic_ids}}
+    if until:
+        match['as_of'] = {'$lte': until}
+    rows = await db[SNAPSHOTS].aggregate([
+        {'$match': match},
+        {'$sort': {'mechanic_id': 1, 'as_of': -1}},
+        {'$group': {'_id': '$mechanic_id', 'snapshot': {'$first': '$$ROOT'}}}
+    ]).to_list(None)
+    return {row['_id']: row['snapshot'] for row in rows}
+
+async def reconcile(db) -> dict:
+    """Recompute ledger sums up to the last snapshot run and compare in bulk.
+
+    Checks that every transaction balances, that each mechanic's latest
+    snapshot equals the sum of its entries up to the snapshot time and
+    that every snapshot nets to zero.
+    """
+    last = await db[SNAPSHOTS].find_one({}, {'_id': 0, 'as_of': 1}, sort=[('as_of', -1)])
+    report = {
+        'id': str(uuid4()),
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'as_of': last['as_of'] if last else None,
+        'unbalanced_transactions': [],
+        'mismatches': [],
+        'checked_mechanics': 0
+    }
+
+    unbalanced = db[ENTRIES].aggregate([
+        {'$group': {'_id': '$txn_id', 'total': {'$sum': '$amount'}}},
+        {'$match': {'$or': [{'total': {'$gt': TOLERANCE}}, {'total': {'$lt': -TOLERANCE}}]}},
+        {'$limit': 1000}
+    ], allowDiskUse=True)
+    report['unbalanced_transactions'] = [row['_id'] async for row in unbalanced]
+
+    if last:
+        # Each mechanic's latest snapshot at or before the run (one grouped pass)
+        latest = db[SNAPSHOTS].aggregate([
+            {'$match': {'as_of': {'$lte': last['as_of']}}},
+            {'$sort': {'mechanic_id': 1, 'as_of': -1}},
+            {'$group': {'_id': '$mechanic_id', 'balances': {'$first': '$balances'}}}
+        ], allowDiskUse=True)
+        expected: Dict[str, Dict[str, float]] = {}
+        async for row in latest:
+            expected[row['_id']] = row['balances']
+
+        actual: Dict[str, Dict[str, float]] = defaultdict(dict)
+        sums = db[ENTRIES].aggregate([
+            {'$match': {'ts': {'$lte': last['as_of']}}},
+            {'$group': {
+                '_id': {'mechanic_id': '$mechanic_id', 'account': '$account'},
+                'total': {'$sum': '$amount'}
+            }}
+        ], allowDiskUse=True)
+        async for row in sums:
+            actual[row['_id']['mechanic_id']][row['_id']['account']] = row['total']
+
+        for mechanic_id in set(expected) | set(actual):
+            snapshot_balances = expected.get(mechanic_id, {})
+            ledger_balances = actual.get(mechanic_id, {})
+            accounts = set(snapshot_balances) | set(ledger_balances)
+            diffs = {
+                account: round(ledger_balances.get(account, 0.0) - snapshot_balances.get(account, 0.0), 2)
+                for account in accounts
+                if abs(ledger_balances.get(account, 0.0) - snapshot_balances.get(account, 0.0)) > TOLERANCE
+            }
+            if abs(sum(snapshot_balances.values())) > TOLERANCE:
+                diffs['_net'] = round(sum(snapshot_balances.values()), 2)
+            if diffs:
+                report['mismatches'].append({'mechanic_id': mechanic_id, 'diffs': diffs})
+        report['checked_mechanics'] = len(set(expected) | set(actual))
+
+    report['ok'] = not report['unbalanced_transactions'] and not report['mismatches']
+    report['finished_at'] = datetime.now(timezone.utc).isoformat()
+    await db[RECONCILIATIONS].insert_one(dict(report))
+
+    if report['ok']:
+        logger.info(f"Ledger reconciliation ok ({report['checked_mechanics']} mechanics)")
+    else:
+        logger.error(
+            f"Ledger reconciliation found {len(report['mismatches'])} mismatches and "
+            f"{len(report['unbalanced_transactions'])} unbalanced transactions"
+        )
+    return report
+
+async def list_entries(db, mechanic_id: str, before: Optional[Tuple[str, str]] = None, limit: int = 50) -> List[dict]:
+    """Mechanic-side entries, newest first; `before` is the (ts, id) of the last one seen"""
+    query = {'mechanic_id': mechanic_id, 'account': {'$in': [MECHANIC_PENDING, MECHANIC_AVAILABLE]}}
+    if before:
+        # Entries of one transaction share a ts, so id breaks the tie
+        query['$or'] = [
+            {'ts': {'$lt': before[0]}},
+            {'ts': before[0], 'id': {'$lt': before[1]}}
+        ]
+    return await db[ENTRIES].find(query, {'_id': 0}).sort([('ts', -1), ('id', -1)]).limit(limit).to_list(limit)
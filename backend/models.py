@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, EmailStr
-from typing import Optional, List
+from typing import Dict, Literal, Optional, List
 from datetime import datetime, timezone
 import uuid
 
@@ -10,6 +10,12 @@ class UserCreate(BaseModel):
     name: str
     phone: Optional[str] = None
     user_type: str = "client"  # client, mechanic, admin
+    locale: Optional[Literal["pt-BR", "en"]] = None
+
+class UserUpdate(BaseModel):
+    name: Optional[str] = None
+    phone: Optional[str] = None
+    locale: Optional[Literal["pt-BR", "en"]] = None
 
 class UserLogin(BaseModel):
     email: EmailStr
@@ -23,11 +29,14 @@ class User(BaseModel):
     phone: Optional[str] = None
     user_type: str = "client"
     is_active: bool = True
+    locale: Optional[str] = None  # email/SMS language, e.g. pt-BR, en (default pt-BR)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     
     # Mechanic-specific fields
     rating: Optional[float] = None
     review_count: Optional[int] = 0
+    rating_sum: Optional[int] = 0
+    rating_histogram: Optional[Dict[str, int]] = None
     specialties: Optional[List[str]] = []
     location: Optional[str] = None
     years_experience: Optional[int] = None
@@ -42,6 +51,7 @@ class UserResponse(BaseModel):
     phone: Optional[str]
     user_type: str
     is_active: bool
+    locale: Optional[str] = None
     rating: Optional[float] = None
     review_count: Optional[int] = None
 
@@ -86,6 +96,7 @@ class QuoteCreate(BaseModel):
     description: Optional[str] = None
     date: Optional[str] = None
     time: Optional[str] = None
+    estimated_duration_minutes: Optional[int] = 60
     location_type: Optional[str] = "mobile"
 
 # ===== VEHICLE MODEL =====
@@ -126,6 +137,7 @@ class Order(BaseModel):
     description: Optional[str] = None
     date: Optional[str] = None
     time: Optional[str] = None
+    estimated_duration_minutes: Optional[int] = 60
     location_type: Optional[str] = "mobile"
     
     # Pricing
@@ -151,6 +163,7 @@ class OrderCreate(BaseModel):
     description: Optional[str] = None
     date: Optional[str] = None
     time: Optional[str] = None
+    estimated_duration_minutes: Optional[int] = 60
     location_type: Optional[str] = "mobile"
 
 # Keep Quote for backward compatibility
@@ -192,6 +205,7 @@ class Wallet(BaseModel):
     available_balance: float = 0.0
     pending_balance: float = 0.0
     total_earned: float = 0.0
+    released_through: Optional[str] = None  # pending earnings up to this time were released
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class PayoutRequest(BaseModel):
@@ -199,6 +213,7 @@ class PayoutRequest(BaseModel):
     mechanic_id: str
     amount: float
     status: str = "pending"  # pending, approved, paid, rejected
+    batch_id: Optional[str] = None
     requested_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     processed_at: Optional[datetime] = None
 
@@ -216,6 +231,7 @@ class Review(BaseModel):
     mechanic_id: str
     rating: int  # 1-5 stars
     comment: Optional[str] = None
+    client_name: Optional[str] = None  # copied at write time for listing
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 # ===== MECHANIC QUOTE MODELS =====
@@ -291,12 +307,47 @@ class Notification(BaseModel):
     user_id: str
     title: str
     message: str
-    type: str  # order, payment, review, reservation, system
+    type: str  # order, payment, review, reservation, dispute, system
     reference_id: Optional[str] = None  # order_id, reservation_id, etc
     is_read: bool = False
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     read_at: Optional[datetime] = None
 
+# ===== AVAILABILITY MODELS =====
+class WorkingHours(BaseModel):
+    weekday: int  # 0=Monday ... 6=Sunday
+    start: str  # "08:00"
+    end: str  # "18:00"
+
+class BlockedSlot(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    date: str  # "2026-10-20"
+    start: str
+    end: str
+    reason: Optional[str] = None
+
+class BlockedSlotCreate(BaseModel):
+    date: str
+    start: str
+    end: str
+    reason: Optional[str] = None
+
+class MechanicAvailability(BaseModel):
+    mechanic_id: str
+    working_hours: List[WorkingHours] = []
+    blocked_slots: List[BlockedSlot] = []
+    slot_step_minutes: int = 30
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class LocationUpdate(BaseModel):
+    latitude: float = Field(ge=-90, le=90)
+    longitude: float = Field(ge=-180, le=180)
+    location: Optional[str] = None  # display address
+
+class AvailabilityUpdate(BaseModel):
+    working_hours: List[WorkingHours]
+    slot_step_minutes: Optional[int] = Field(30, gt=0, le=240)
+
 # ===== SERVICE STATUS HISTORY =====
 class ServiceStatusHistory(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
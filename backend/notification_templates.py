@@ -0,0 +1,267 @@
+import html
+import logging
+import re
+from string import Formatter
+from typing import Dict, Iterable, List, Optional, Tuple
+from outbox import email_message, sms_message
+
+logger = logging.getLogger(__name__)
+
+# Email/SMS templates per locale, compiled once at import into literal and
+# field segments. A batch binds the shared values once; per recipient only
+# the remaining fields are filled in. For email, those remaining fields
+# become SendGrid substitution tags, so a whole batch shares one body.
+DEFAULT_LOCALE = 'pt-BR'
+
+_BUTTON = 'style="background:{color};color:white;padding:10px 20px;text-decoration:none;border-radius:5px;"'
+
+TEMPLATES: Dict[str, Dict[str, Dict[str, str]]] = {
+    'new_order': {
+        'pt-BR': {
+            'subject': 'Novo Pedido #{order_id} - ClickMecanico',
+            'html': (
+                '<h2>Olá {name}!</h2>'
+                '<p>Você tem um novo pedido disponível:</p>'
+                '<ul><li><strong>Pedido:</strong> #{order_id}</li>'
+                '<li><strong>Serviço:</strong> {service}</li>'
+                '<li><strong>Local:</strong> {location}</li></ul>'
+                '<p>Acesse o dashboard para enviar seu orçamento.</p>'
+                '<a href="{url}" ' + _BUTTON.format(color='#1EC6C6') + '>Ver Pedido</a>'
+            ),
+            'text': (
+                'Olá {name}!\n\nVocê tem um novo pedido disponível:\n'
+                'Pedido: #{order_id}\nServiço: {service}\nLocal: {location}\n\n'
+                'Acesse o dashboard para enviar seu orçamento: {url}'
+            )
+        },
+        'en': {
+            'subject': 'New Order #{order_id} - ClickMecanico',
+            'html': (
+                '<h2>Hi {name}!</h2>'
+                '<p>A new order is available:</p>'
+                '<ul><li><strong>Order:</strong> #{order_id}</li>'
+                '<li><strong>Service:</strong> {service}</li>'
+                '<li><strong>Location:</strong> {location}</li></ul>'
+                '<p>Open your dashboard to send a quote.</p>'
+                '<a href="{url}" ' + _BUTTON.format(color='#1EC6C6') + '>View Order</a>'
+            ),
+            'text': (
+                'Hi {name}!\n\nA new order is available:\n'
+                'Order: #{order_id}\nService: {service}\nLocation: {location}\n\n'
+                'Open your dashboard to send a quote: {url}'
+            )
+        }
+    },
+    'quote_received': {
+        'pt-BR': {
+            'subject': 'Orçamento Recebido - Pedido #{order_id}',
+            'html': (
+                '<h2>Olá {name}!</h2>'
+                '<p>O mecânico <strong>{mechanic_name}</strong> enviou um orçamento:</p>'
+                '<ul><li><strong>Pedido:</strong> #{order_id}</li>'
+                '<li><strong>Valor:</strong> R$ {price:.2f}</li></ul>'
+                '<p>Acesse o dashboard para aprovar ou recusar.</p>'
+                '<a href="{url}" ' + _BUTTON.format(color='#1EC6C6') + '>Ver Orçamento</a>'
+            ),
+            'text': (
+                'Olá {name}!\n\nO mecânico {mechanic_name} enviou um orçamento:\n'
+                'Pedido: #{order_id}\nValor: R$ {price:.2f}\n\n'
+                'Acesse o dashboard para aprovar ou recusar: {url}'
+            )
+        },
+        'en': {
+            'subject': 'Quote Received - Order #{order_id}',
+            'html': (
+                '<h2>Hi {name}!</h2>'
+                '<p>Mechanic <strong>{mechanic_name}</strong> sent you a quote:</p>'
+                '<ul><li><strong>Order:</strong> #{order_id}</li>'
+                '<li><strong>Price:</strong> R$ {price:.2f}</li></ul>'
+                '<p>Open your dashboard to accept or decline it.</p>'
+                '<a href="{url}" ' + _BUTTON.format(color='#1EC6C6') + '>View Quote</a>'
+            ),
+            'text': (
+                'Hi {name}!\n\nMechanic {mechanic_name} sent you a quote:\n'
+                'Order: #{order_id}\nPrice: R$ {price:.2f}\n\n'
+                'Open your dashboard to accept or decline it: {url}'
+            )
+        }
+    },
+    'payment_confirmed': {
+        'pt-BR': {
+            'subject': 'Pagamento Confirmado - Pedido #{order_id}',
+            'html': (
+                '<h2>Ótima notícia, {name}!</h2>'
+                '<p>O pagamento do pedido <strong>#{order_id}</strong> foi confirmado.</p>'
+                '<p>O serviço está agendado. Acesse o dashboard para ver detalhes.</p>'
+                '<a href="{url}" ' + _BUTTON.format(color='#27AE60') + '>Ver Agenda</a>'
+            ),
+            'text': (
+                'Ótima notícia, {name}!\n\nO pagamento do pedido #{order_id} foi confirmado.\n'
+                'O serviço está agendado. Detalhes: {url}'
+            )
+        },
+        'en': {
+            'subject': 'Payment Confirmed - Order #{order_id}',
+            'html': (
+                '<h2>Great news, {name}!</h2>'
+                '<p>Payment for order <strong>#{order_id}</strong> was confirmed.</p>'
+                '<p>The service is scheduled. Open your dashboard for details.</p>'
+                '<a href="{url}" ' + _BUTTON.format(color='#27AE60') + '>View Schedule</a>'
+            ),
+            'text': (
+                'Great news, {name}!\n\nPayment for order #{order_id} was confirmed.\n'
+                'The service is scheduled. Details: {url}'
+            )
+        }
+    },
+    'notification': {
+        'pt-BR': {'subject': '{title}', 'html': '<p>{message}</p>', 'text': '{message}', 'sms': '{title}: {message}'}
+    },
+    'reminder_24h': {
+        'pt-BR': {'sms': "Olá {name}! Lembrete: seu serviço '{service}' está agendado para amanhã ({date}) às {time}. ClickMecanico"},
+        'en': {'sms': "Hi {name}! Reminder: your '{service}' service is booked for tomorrow ({date}) at {time}. ClickMecanico"}
+    },
+    'reminder_1h': {
+        'pt-BR': {'sms': 'Olá {name}! Seu mecânico chegará em 1 hora (às {time}). ClickMecanico'},
+        'en': {'sms': 'Hi {name}! Your mechanic will arrive in 1 hour (at {time}). ClickMecanico'}
+    },
+    'service_completed': {
+        'pt-BR': {'sms': 'Olá {name}! Seu serviço #{order_id} foi concluído. Avalie o mecânico: {url}'},
+        'en': {'sms': 'Hi {name}! Your service #{order_id} is complete. Rate your mechanic: {url}'}
+    }
+}
+
+# Segment: (literal, field name or None, format spec)
+Segment = Tuple[str, Optional[str], str]
+
+class CompiledTemplate:
+    """A template split once into literal text and fields"""
+
+    def __init__(self, segments: List[Segment]):
+        self.segments = segments
+        self.fields = {field for _, field, _ in segments if field}
+        self.field_specs = {(field, spec) for _, field, spec in segments if field}
+
+    @classmethod
+    def compile(cls, source: str) -> 'CompiledTemplate':
+        return cls([(literal, field, spec or '') for literal, field, spec, _ in Formatter().parse(source)])
+
+    def bind(self, values: dict, escape: bool = False) -> 'CompiledTemplate':
+        """Fill the fields present in `values`; the rest stay fields"""
+        segments: List[Segment] = []
+        pending = ''
+        for literal, field, spec in self.segments:
+            pending += literal
+            if field is None:
+                continue
+            if field in values:
+                pending += _value(values[field], spec, escape)
+            else:
+                segments.append((pending, field, spec))
+                pending = ''
+        segments.append((pending, None, ''))
+        return CompiledTemplate(segments)
+
+    def render(self, values: dict, escape: bool = False) -> str:
+        return ''.join(
+            literal + (_value(values.get(field, ''), spec, escape) if field else '')
+            for literal, field, spec in self.segments
+        )
+
+    def tags(self, suffix: str = '') -> str:
+        """Remaining fields as SendGrid substitution tags (see tag())"""
+        return ''.join(
+            literal + (tag(field, spec, suffix) if field else '')
+            for literal, field, spec in self.segments
+        )
+
+def tag(field: str, spec: str = '', suffix: str = '') -> str:
+    """Substitution tag of a field: -field- or, with a format spec, -field_x2e2f- for {field:.2f}"""
+    if spec:
+        field += '_' + re.sub(r'[^A-Za-z0-9]', lambda m: f'x{ord(m.group()):02x}', spec)
+    return f'-{field}{suffix}-'
+
+def _value(value, spec: str, escape: bool) -> str:
+    text = format(value, spec) if spec else str(value)
+    return html.escape(text) if escape else text
+
+_compiled: Dict[Tuple[str, str], Dict[str, CompiledTemplate]] = {}
+
+def compile_all():
+    """Compile every template for every locale"""
+    _compiled.clear()
+    for name, locales in TEMPLATES.items():
+        for locale, variants in locales.items():
+            _compiled[(name, locale)] = {
+                variant: CompiledTemplate.compile(source) for variant, source in variants.items()
+            }
+    logger.info(f"Compiled {len(_compiled)} notification templates")
+
+def get(name: str, locale: Optional[str] = None) -> Dict[str, CompiledTemplate]:
+    """Compiled variants for a locale, falling back to the default locale"""
+    template = _compiled.get((name, locale or DEFAULT_LOCALE)) or _compiled.get((name, DEFAULT_LOCALE))
+    if template is None:
+        raise KeyError(f"Unknown template: {name}")
+    return template
+
+def render(name: str, values: dict, locale: Optional[str] = None) -> Dict[str, str]:
+    """Every variant of a template; html values are escaped"""
+    return {
+        variant: compiled.render(values, escape=(variant == 'html'))
+        for variant, compiled in get(name, locale).items()
+    }
+
+def render_batch(name: str, shared: dict, recipients: Iterable[dict], variant: str = 'text',
+                 locale_key: str = 'locale') -> List[str]:
+    """One variant for many recipients; shared values are bound once per locale"""
+    bound: Dict[Optional[str], CompiledTemplate] = {}
+    escape = variant == 'html'
+    rendered = []
+    for recipient in recipients:
+        locale = recipient.get(locale_key)
+        if locale not in bound:
+            bound[locale] = get(name, locale)[variant].bind(shared, escape)
+        rendered.append(bound[locale].render(recipient, escape))
+    return rendered
+
+def email_batch(name: str, shared: dict, recipients: Iterable[dict], to_key: str = 'email') -> List[dict]:
+    """Outbox emails for many recipients.
+
+    Per locale the subject and bodies are rendered once with per-recipient
+    fields left as substitution tags, so each locale's batch is a single
+    SendGrid request with one personalization per recipient.
+    """
+    bodies: Dict[Optional[str], tuple] = {}
+    messages = []
+    for recipient in recipients:
+        if not recipient.get(to_key):
+            continue
+        locale = recipient.get('locale')
+        if locale not in bodies:
+            template = get(name, locale)
+            subject = template['subject'].bind(shared)
+            html_body = template['html'].bind(shared, escape=True)
+            text_body = template['text'].bind(shared)
+            bodies[locale] = (
+                subject.tags(),
+                html_body.tags('_html'),
+                text_body.tags(),
+                subject.field_specs | html_body.field_specs | text_body.field_specs
+            )
+        subject, html_body, text_body, field_specs = bodies[locale]
+        substitutions = {}
+        for field, spec in field_specs:
+            # Formatted with the field's spec, as render() does
+            value = _value(recipient[field], spec, False) if field in recipient else ''
+            substitutions[tag(field, spec)] = value
+            substitutions[tag(field, spec, '_html')] = html.escape(value)
+        messages.append(email_message(recipient[to_key], subject, html_body, substitutions, text=text_body))
+    return messages
+
+def sms_batch(name: str, shared: dict, recipients: Iterable[dict], to_key: str = 'phone') -> List[dict]:
+    """Outbox SMS for many recipients"""
+    recipients = [r for r in recipients if r.get(to_key)]
+    bodies = render_batch(name, shared, recipients, variant='sms')
+    return [sms_message(r[to_key], body) for r, body in zip(recipients, bodies)]
+
+compile_all()
@@ -0,0 +1,304 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+from models import Notification
+from socket_manager import push_to_user
+import events
+from email_service import email_notification
+from sms_service import sms_notification
+import outbox
+
+logger = logging.getLogger(__name__)
+
+# Handlers call `notifier.notify(...)` and return at once. A background
+# task buffers notifications, stores each batch with one insert_many,
+# pushes them over Socket.IO and fans out to email/SMS by preference.
+COLLECTION = 'notifications'
+# One document per user: {_id: user_id, unread: n}
+COUNTERS = 'notification_counters'
+BATCH_SIZE = 100
+FLUSH_INTERVAL_SECONDS = 0.2
+# A failed insert is retried (only the failed documents) with backoff
+STORE_ATTEMPTS = 5
+STORE_BACKOFF_SECONDS = 0.5
+DUPLICATE_KEY = 11000
+
+# External channels are opt-in; in-app delivery is always on
+DEFAULT_PREFERENCES = {'email': False, 'sms': False}
+
+async def ensure_indexes(db):
+    """Indexes for the notification list"""
+    await db[COLLECTION].create_index([('user_id', ASCENDING), ('created_at', DESCENDING)])
+    await db[COLLECTION].create_index([('user_id', ASCENDING), ('is_read', ASCENDING)])
+
+async def migrate(db):
+    """One-shot data migrations, each recorded in db.migrations once done"""
+    await _run_once(db, 'notifications_single_schema', _migrate_schema)
+    # Counters created by the first increment started at 0 and missed older
+    # unread notifications: recount them once
+    await _run_once(db, 'notification_counters_seeded', rebuild_counters)
+
+async def _run_once(db, name: str, migration):
+    # Marked only after it finished, so an interrupted run is redone
+    if await db.migrations.find_one({'_id': name}) is not None:
+        return
+    await migration(db)
+    await db.migrations.update_one(
+        {'_id': name},
+        {'$setOnInsert': {'applied_at': datetime.now(timezone.utc).isoformat()}},
+        upsert=True
+    )
+    logger.info(f"Applied migration {name}")
+
+async def _migrate_schema(db):
+    # Older handlers wrote `read` and datetime created_at
+    await db[COLLECTION].update_many(
+        {'read': {'$exists': True}},
+        [{'$set': {'is_read': '$read'}}, {'$unset': 'read'}]
+    )
+    await db[COLLECTION].update_many(
+        {'created_at': {'$type': 'date'}},
+        [{'$set': {'created_at': {'$dateToString': {'date': '$created_at', 'format': '%Y-%m-%dT%H:%M:%S.%L+00:00'}}}}]
+    )
+    await db[COLLECTION].update_many({'type': {'$exists': False}}, {'$set': {'type': 'system'}})
+
+def build(user_id: str, title: str, message: str, type: str = 'system', reference_id: Optional[str] = None) -> dict:
+    """Notification document in the stored schema"""
+    notification = Notification(user_id=user_id, title=title, message=message, type=type, reference_id=reference_id)
+    doc = notification.model_dump()
+    doc['created_at'] = doc['created_at'].isoformat()
+    return doc
+
+class NotificationDispatcher:
+    """Buffered writer and fan-out for user notifications"""
+
+    def __init__(self, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL_SECONDS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.db = None
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.metrics = {'queued': 0, 'stored': 0, 'pushed': 0, 'emailed': 0, 'texted': 0, 'failed': 0}
+
+    async def start(self, db):
+        self.db = db
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+        logger.info("Notification dispatcher started")
+
+    async def stop(self):
+        """Flush what is buffered, then stop"""
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.queue and not self.queue.empty():
+            batch = []
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            await self._deliver(batch)
+
+    def notify(self, user_id: str, title: str, message: str, type: str = 'system',
+               reference_id: Optional[str] = None, channels: Optional[List[str]] = None) -> dict:
+        """Queue a notification (fire-and-forget). `channels` limits external delivery."""
+        doc = build(user_id, title, message, type, reference_id)
+        if self.queue is None:
+            logger.warning(f"Notification dispatcher not started, dropping notification for {user_id}")
+            return doc
+        self.queue.put_nowait((doc, channels))
+        self.metrics['queued'] += 1
+        return doc
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            # Collect what arrives within the flush window
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._deliver(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.metrics['failed'] += len(batch)
+                logger.error(f"Error delivering {len(batch)} notifications: {str(e)}")
+
+    async def _deliver(self, batch: List[tuple]):
+        batch = await self._store(batch)
+        if not batch:
+            return
+        docs = [doc for doc, _ in batch]
+        self.metrics['stored'] += len(docs)
+        await increment_unread(self.db, docs)
+
+        for doc in docs:
+            await push_to_user(doc['user_id'], 'notification', doc)
+            events.publish(doc['user_id'], 'notification', doc)
+        self.metrics['pushed'] += len(docs)
+
+        await self._send_external(batch)
+
+    async def _store(self, batch: List[tuple]) -> List[tuple]:
+        """Insert the batch; returns the entries that were stored.
+
+        `_id` is the notification id, so retrying a document that was in
+        fact written fails as a duplicate and counts as stored.
+        """
+        stored, pending = [], list(batch)
+        for attempt in range(STORE_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(STORE_BACKOFF_SECONDS * 2 ** (attempt - 1))
+            try:
+                await self.db[COLLECTION].insert_many([{**doc, '_id': doc['id']} for doc, _ in pending], ordered=False)
+                return stored + pending
+            except BulkWriteError as e:
+                failed = {
+                    error['index'] for error in e.details.get('writeErrors', [])
+                    if error.get('code') != DUPLICATE_KEY
+                }
+                stored += [entry for i, entry in enumerate(pending) if i not in failed]
+                pending = [entry for i, entry in enumerate(pending) if i in failed]
+                if not pending:
+                    return stored
+                logger.warning(f"Storing notifications: {len(pending)} failed (attempt {attempt + 1}): {str(e)}")
+            except Exception as e:
+                logger.warning(f"Storing notifications: {len(pending)} failed (attempt {attempt + 1}): {str(e)}")
+        self.metrics['failed'] += len(pending)
+        logger.error(f"Dropping {len(pending)} notifications after {STORE_ATTEMPTS} attempts")
+        return stored
+
+    async def _send_external(self, batch: List[tuple]):
+        user_ids = list({doc['user_id'] for doc, _ in batch})
+        users = await self.db.users.find(
+            {'id': {'$in': user_ids}},
+            {'_id': 0, 'id': 1, 'email': 1, 'phone': 1, 'notification_preferences': 1}
+        ).to_list(len(user_ids))
+        by_id: Dict[str, dict] = {u['id']: u for u in users}
+
+        messages = []
+        for doc, channels in batch:
+            user = by_id.get(doc['user_id'])
+            if not user:
+                continue
+            preferences = {**DEFAULT_PREFERENCES, **(user.get('notification_preferences') or {})}
+            wanted = [c for c in ('email', 'sms') if preferences.get(c) and (channels is None or c in channels)]
+            if 'email' in wanted and user.get('email'):
+                messages += email_notification(user['email'], doc['title'], doc['message'])
+                self.metrics['emailed'] += 1
+            if 'sms' in wanted and user.get('phone'):
+                messages += sms_notification(user['phone'], doc['title'], doc['message'])
+                self.metrics['texted'] += 1
+        # Sent by the outbox workers
+        await outbox.enqueue(self.db, messages)
+
+    def stats(self) -> dict:
+        return {**self.metrics, 'buffered': self.queue.qsize() if self.queue else 0}
+
+notifier = NotificationDispatcher()
+
+async def increment_unread(db, docs: List[dict]):
+    """Add newly stored notifications to their users' unread counters.
+
+    Only existing counters are incremented. A user without one is seeded
+    from a count of their unread notifications, which already includes
+    the new ones; `$max` lets concurrent seeders settle on the later count.
+    """
+    added: Dict[str, int] = {}
+    for doc in docs:
+        added[doc['user_id']] = added.get(doc['user_id'], 0) + 1
+    user_ids = list(added)
+    existing = set(await db[COUNTERS].distinct('_id', {'_id': {'$in': user_ids}}))
+    if existing:
+        await db[COUNTERS].bulk_write([
+            UpdateOne({'_id': user_id}, {'$inc': {'unread': added[user_id]}})
+            for user_id in existing
+        ], ordered=False)
+    for user_id in user_ids:
+        if user_id not in existing:
+            await _seed_counter(db, user_id)
+
+async def _seed_counter(db, user_id: str) -> int:
+    count = await db[COLLECTION].count_documents({'user_id': user_id, 'is_read': False})
+    await db[COUNTERS].update_one(
+        {'_id': user_id},
+        [{'$set': {'unread': {'$max': [{'$ifNull': ['$unread', 0]}, count]}}}],
+        upsert=True
+    )
+    return count
+
+async def _decrement_unread(db, user_id: str, n: int):
+    if n:
+        # Never below zero, even if the counter drifted
+        await db[COUNTERS].update_one(
+            {'_id': user_id},
+            [{'$set': {'unread': {'$max': [0, {'$subtract': [{'$ifNull': ['$unread', 0]}, n]}]}}}]
+        )
+
+async def unread_count(db, user_id: str) -> int:
+    """Counter read; seeded from the collection the first time"""
+    counter = await db[COUNTERS].find_one({'_id': user_id})
+    if counter is not None:
+        return counter.get('unread', 0)
+    return await _seed_counter(db, user_id)
+
+async def list_for_user(db, user_id: str, limit: int = 50):
+    """Latest notifications and the unread count, read concurrently"""
+    return await asyncio.gather(
+        db[COLLECTION].find({'user_id': user_id}, {'_id': 0}).sort('created_at', DESCENDING).limit(limit).to_list(limit),
+        unread_count(db, user_id)
+    )
+
+async def mark_read(db, user_id: str, notification_id: str) -> bool:
+    result = await db[COLLECTION].update_one(
+        {'id': notification_id, 'user_id': user_id, 'is_read': False},
+        {'$set': {'is_read': True, 'read_at': datetime.now(timezone.utc).isoformat()}}
+    )
+    await _decrement_unread(db, user_id, result.modified_count)
+    return result.modified_count > 0
+
+async def mark_all_read(db, user_id: str) -> int:
+    """One update_many; the counter drops by exactly what it changed, so
+    notifications stored meanwhile stay counted"""
+    result = await db[COLLECTION].update_many(
+        {'user_id': user_id, 'is_read': False},
+        {'$set': {'is_read': True, 'read_at': datetime.now(timezone.utc).isoformat()}}
+    )
+    await _decrement_unread(db, user_id, result.modified_count)
+    return result.modified_count
+
+async def rebuild_counters(db) -> int:
+    """Recount unread notifications per user (repairs drift)"""
+    counts = {
+        row['_id']: row['n'] async for row in db[COLLECTION].aggregate([
+            {'$match': {'is_read': False}},
+            {'$group': {'_id': '$user_id', 'n': {'$sum': 1}}}
+        ])
+    }
+    await db[COUNTERS].update_many({'_id': {'$nin': list(counts)}}, {'$set': {'unread': 0}})
+    if counts:
+        await db[COUNTERS].bulk_write([
+            UpdateOne({'_id': user_id}, {'$set': {'unread': n}}, upsert=True)
+            for user_id, n in counts.items()
+        ], ordered=False)
+    return len(counts)
+
+async def get_preferences(db, user_id: str) -> dict:
+    user = await db.users.find_one({'id': user_id}, {'_id': 0, 'notification_preferences': 1})
+    return {**DEFAULT_PREFERENCES, **((user or {}).get('notification_preferences') or {})}
+
+async def set_preferences(db, user_id: str, preferences: dict) -> dict:
+    updates = {f'notification_preferences.{k}': bool(v) for k, v in preferences.items() if k in DEFAULT_PREFERENCES}
+    if updates:
+        await db.users.update_one({'id': user_id}, {'$set': updates})
+    return await get_preferences(db, user_id)
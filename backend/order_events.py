@@ -0,0 +1,168 @@
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import List, Optional, Tuple
+from pymongo import ASCENDING, ReturnDocument
+from models import ServiceStatusHistory
+import events
+
+logger = logging.getLogger(__name__)
+
+# Append-only log of order transitions.
+#   seq      -> per-order sequence (1, 2, 3...) used for timelines
+#   position -> global monotonic sequence used by tailing consumers
+# Positions are allocated before the insert, so N+1 can commit before N.
+# Readers stop at a gap until the event after it is GAP_GRACE_SECONDS
+# old; by then the missing insert has failed rather than being in flight.
+EVENTS_COLLECTION = 'order_events'
+CURSORS_COLLECTION = 'event_cursors'
+COUNTER_ID = 'order_events'
+GAP_GRACE_SECONDS = 10
+
+async def ensure_indexes(db):
+    """Create indexes for the order event log"""
+    await db[EVENTS_COLLECTION].create_index([('order_id', ASCENDING), ('seq', ASCENDING)], unique=True)
+    await db[EVENTS_COLLECTION].create_index([('position', ASCENDING)], unique=True)
+
+async def _next_position(db) -> int:
+    counter = await db.counters.find_one_and_update(
+        {'_id': COUNTER_ID},
+        {'$inc': {'seq': 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter['seq']
+
+async def _next_order_seq(db, order_id: str) -> Tuple[int, dict]:
+    """Next per-order seq, plus the order's participants"""
+    order = await db.quotes.find_one_and_update(
+        {'id': order_id},
+        {'$inc': {'event_seq': 1}},
+        projection={'_id': 0, 'event_seq': 1, 'client_id': 1, 'mechanic_id': 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if order:
+        return order['event_seq'], order
+    # Order document missing (deleted/legacy) - fall back to the log itself
+    last = await db[EVENTS_COLLECTION].find_one(
+        {'order_id': order_id}, {'_id': 0, 'seq': 1}, sort=[('seq', -1)]
+    )
+    return (last['seq'] if last else 0) + 1, {}
+
+async def record_order_event(
+    db,
+    order_id: str,
+    status: str,
+    changed_by: str,
+    changed_by_role: str,
+    notes: Optional[str] = None,
+    data: Optional[dict] = None
+):
+    """Append an order transition to the event log.
+
+    Never raises: a failure to log must not fail the request that
+    already changed the order.
+    """
+    try:
+        event = ServiceStatusHistory(
+            order_id=order_id,
+            status=status,
+            changed_by=changed_by,
+            changed_by_role=changed_by_role,
+            notes=notes
+        )
+        event_dict = event.model_dump()
+        event_dict['created_at'] = event_dict['created_at'].isoformat()
+        event_dict['seq'], order = await _next_order_seq(db, order_id)
+        event_dict['position'] = await _next_position(db)
+        event_dict['data'] = data or {}
+
+        await db[EVENTS_COLLECTION].insert_one(event_dict)
+        event_dict.pop('_id', None)
+
+        update = {'order_id': order_id, 'status': status, 'seq': event_dict['seq'], 'created_at': event_dict['created_at']}
+        for user_id in {order.get('client_id'), order.get('mechanic_id')}:
+            events.publish(user_id, 'order_status', update)
+        return event_dict
+    except Exception as e:
+        logger.error(f"Error recording event for order {order_id}: {str(e)}")
+        return None
+
+async def get_order_timeline(db, order_id: str, limit: int = 500):
+    """Get the ordered transition history of one order"""
+    return await db[EVENTS_COLLECTION].find(
+        {'order_id': order_id}, {'_id': 0}
+    ).sort('seq', 1).to_list(limit)
+
+def _contiguous(events: List[dict], after_position: int) -> List[dict]:
+    """Events up to the first gap that may still be filled"""
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=GAP_GRACE_SECONDS)).isoformat()
+    expected = after_position + 1
+    ready = []
+    for event in events:
+        if event['position'] != expected and event['created_at'] > cutoff:
+            break
+        ready.append(event)
+        expected = event['position'] + 1
+    return ready
+
+async def read_events(db, after_position: int = 0, limit: int = 100):
+    """Read events after a global position (ascending), never past a pending gap"""
+    events = await db[EVENTS_COLLECTION].find(
+        {'position': {'$gt': after_position}}, {'_id': 0}
+    ).sort('position', 1).limit(limit).to_list(limit)
+    return _contiguous(events, after_position)
+
+class EventTail:
+    """Resumable tailing cursor over the order event log.
+
+    The last processed position is stored per consumer in
+    `event_cursors`, so a restarted consumer resumes where it stopped
+    instead of re-reading or polling `db.quotes`.
+    """
+
+    def __init__(self, db, consumer: str, batch_size: int = 100, poll_interval: float = 1.0):
+        self.db = db
+        self.consumer = consumer
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.position = None
+
+    async def load_position(self) -> int:
+        cursor = await self.db[CURSORS_COLLECTION].find_one({'_id': self.consumer})
+        self.position = cursor['position'] if cursor else 0
+        return self.position
+
+    async def commit(self, position: int):
+        """Persist the consumer position (only moves forward)"""
+        await self.db[CURSORS_COLLECTION].update_one(
+            {'_id': self.consumer},
+            {
+                '$max': {'position': position},
+                '$set': {'updated_at': datetime.now(timezone.utc).isoformat()}
+            },
+            upsert=True
+        )
+        self.position = max(self.position or 0, position)
+
+    async def next_batch(self):
+        if self.position is None:
+            await self.load_position()
+        return await read_events(self.db, self.position, self.batch_size)
+
+    async def follow(self, handler):
+        """Feed every new event to `handler` forever, committing after each batch"""
+        while True:
+            try:
+                events = await self.next_batch()
+                if not events:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                for event in events:
+                    await handler(event)
+                await self.commit(events[-1]['position'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Event consumer {self.consumer} error: {str(e)}")
+                await asyncio.sleep(self.poll_interval)
@@ -0,0 +1,366 @@
+import asyncio
+import logging
+import os
+import random
+import uuid
+import httpx
+from datetime import datetime, timezone, timedelta
+from itertools import groupby
+from typing import Dict, List, Optional
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Handlers enqueue email/SMS here and return; worker tasks claim due
+# messages with a lease, send them through the channel's provider and
+# retry transient failures with exponential backoff. A message whose
+# lease expires (worker crash, restart) is picked up again, so the lease
+# is renewed before every provider batch and each batch's outcome is
+# written as soon as it is known, guarded by the lease.
+COLLECTION = 'outbox'
+NUM_WORKERS = int(os.environ.get('OUTBOX_WORKERS', '2'))
+BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '100'))
+MAX_ATTEMPTS = 6
+BASE_DELAY_SECONDS = 5
+MAX_DELAY_SECONDS = 3600
+LEASE_SECONDS = 120
+POLL_SECONDS = 5
+SENT_RETENTION_DAYS = 30
+
+# Provider selection: 'fake' keeps everything in memory (tests, local dev)
+EMAIL_PROVIDER = os.environ.get('EMAIL_PROVIDER', 'sendgrid')
+SMS_PROVIDER = os.environ.get('SMS_PROVIDER', 'twilio')  # 'stub' for a local transport
+
+class ProviderError(Exception):
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+async def ensure_indexes(db):
+    """Claim order of due messages; sent messages expire after a while"""
+    await db[COLLECTION].create_index([('status', ASCENDING), ('next_attempt_at', ASCENDING)])
+    await db[COLLECTION].create_index([('status', ASCENDING), ('lease_until', ASCENDING)])
+    await db[COLLECTION].create_index('sent_at', expireAfterSeconds=SENT_RETENTION_DAYS * 24 * 3600)
+
+def _message(channel: str, to: str, **fields) -> dict:
+    now = datetime.now(timezone.utc)
+    return {
+        '_id': str(uuid.uuid4()),
+        'channel': channel,
+        'to': to,
+        **fields,
+        'status': 'queued',
+        'attempts': 0,
+        'next_attempt_at': now,
+        'created_at': now
+    }
+
+def email_message(to: str, subject: str, html: str, substitutions: Optional[Dict[str, str]] = None,
+                  text: Optional[str] = None) -> dict:
+    """Emails with the same subject and bodies share one provider request;
+    per-recipient values go in `substitutions` ({'-name-': 'Ana'})"""
+    return _message('email', to, subject=subject, html=html, text=text, substitutions=substitutions or {})
+
+def sms_message(to: str, body: str) -> dict:
+    return _message('sms', to, body=body)
+
+async def enqueue(db, messages: List[dict]) -> int:
+    """Store messages and wake the workers.
+
+    Messages whose `_id` is already stored are skipped, so callers can
+    make a send idempotent by choosing the id (see `with_id`).
+    """
+    if not messages:
+        return 0
+    try:
+        await db[COLLECTION].insert_many(messages, ordered=False)
+        inserted = len(messages)
+    except BulkWriteError as e:
+        if any(err.get('code') != 11000 for err in e.details.get('writeErrors', [])):
+            raise
+        inserted = e.details.get('nInserted', 0)
+    outbox_sender.wake()
+    return inserted
+
+def with_id(message: dict, message_id: str) -> dict:
+    """Give a message a deterministic id (e.g. one per order and reminder)"""
+    return {**message, '_id': message_id}
+
+class FakeProvider:
+    """Records what would have been sent; `fail_with` simulates provider errors"""
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.bucket = TokenBucket(1000)
+        self.sent: List[dict] = []
+        self.fail_with: Optional[ProviderError] = None
+
+    def batches(self, messages: List[dict]) -> List[List[dict]]:
+        return [[m] for m in messages]
+
+    async def send(self, batch: List[dict]):
+        if self.fail_with:
+            raise self.fail_with
+        self.sent.extend(batch)
+
+class SendGridProvider:
+    """SendGrid v3 over one pooled HTTP client, one request per template"""
+
+    URL = 'https://api.sendgrid.com/v3/mail/send'
+    MAX_PERSONALIZATIONS = 1000
+
+    def __init__(self, api_key: str, from_email: str, rate_per_second: float = 10):
+        self.from_email = from_email
+        self.bucket = TokenBucket(rate_per_second)
+        self.client = httpx.AsyncClient(
+            headers={'Authorization': f'Bearer {api_key}'},
+            timeout=httpx.Timeout(10.0),
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=10)
+        )
+
+    def batches(self, messages: List[dict]) -> List[List[dict]]:
+        def template(m):
+            return (m['subject'], m['html'], m.get('text') or '')
+        batches = []
+        for _, group in groupby(sorted(messages, key=template), key=template):
+            group = list(group)
+            for i in range(0, len(group), self.MAX_PERSONALIZATIONS):
+                batches.append(group[i:i + self.MAX_PERSONALIZATIONS])
+        return batches
+
+    def payload(self, batch: List[dict]) -> dict:
+        # One personalization per recipient, so nobody sees the others
+        return {
+            'personalizations': [
+                {
+                    'to': [{'email': m['to']}],
+                    **({'substitutions': m['substitutions']} if m.get('substitutions') else {}),
+                    'custom_args': {'outbox_id': m['_id']}
+                }
+                for m in batch
+            ],
+            'from': {'email': self.from_email},
+            'subject': batch[0]['subject'],
+            # SendGrid wants text/plain before text/html
+            'content': (
+                ([{'type': 'text/plain', 'value': batch[0]['text']}] if batch[0].get('text') else [])
+                + [{'type': 'text/html', 'value': batch[0]['html']}]
+            )
+        }
+
+    async def send(self, batch: List[dict]):
+        try:
+            response = await self.client.post(self.URL, json=self.payload(batch))
+        except httpx.HTTPError as e:
+            raise ProviderError(f"SendGrid request failed: {str(e)}")
+        if response.status_code == 429 or response.status_code >= 500:
+            raise ProviderError(f"SendGrid {response.status_code}: {response.text[:200]}")
+        if response.status_code >= 400:
+            raise ProviderError(f"SendGrid {response.status_code}: {response.text[:200]}", retryable=False)
+
+    async def close(self):
+        await self.client.aclose()
+
+class SmsProvider:
+    """Twilio through sms_service's async sender; messages of a batch go out
+    concurrently, throttled by the sender's own semaphore and rate limit"""
+
+    BATCH = 50
+
+    def __init__(self, sender):
+        self.sender = sender
+        self.bucket = None
+        # The sender is shared by every worker: a batch must go out well
+        # within one lease even when all workers wait on the same rate limit
+        budget = sender.bucket.rate * LEASE_SECONDS / (2 * NUM_WORKERS)
+        self.batch_size = max(1, min(self.BATCH, int(budget)))
+
+    def batches(self, messages: List[dict]) -> List[List[dict]]:
+        return [messages[i:i + self.batch_size] for i in range(0, len(messages), self.batch_size)]
+
+    async def send(self, batch: List[dict]) -> Dict[str, ProviderError]:
+        failures = await self.sender.send_many(batch)
+        return {message_id: ProviderError(str(e), e.retryable) for message_id, e in failures.items()}
+
+    async def close(self):
+        await self.sender.close()
+
+def build_providers(db) -> dict:
+    """Provider per channel from the environment; unconfigured channels are skipped"""
+    import email_service
+    import sms_service
+
+    providers = {}
+    if EMAIL_PROVIDER == 'fake':
+        providers['email'] = FakeProvider('email')
+    elif email_service.SENDGRID_API_KEY:
+        providers['email'] = SendGridProvider(
+            email_service.SENDGRID_API_KEY,
+            email_service.FROM_EMAIL,
+            float(os.environ.get('SENDGRID_RATE_PER_SECOND', '10'))
+        )
+    transport = sms_service.build_transport(SMS_PROVIDER)
+    if transport is not None:
+        providers['sms'] = SmsProvider(sms_service.SmsSender(db, transport))
+    return providers
+
+def backoff(attempts: int) -> timedelta:
+    """Exponential delay with jitter after the n-th failed attempt"""
+    delay = min(BASE_DELAY_SECONDS * 2 ** (attempts - 1), MAX_DELAY_SECONDS)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+class Outbox:
+    """Background sender workers for the outbox collection"""
+
+    def __init__(self, num_workers: int = NUM_WORKERS, batch_size: int = BATCH_SIZE):
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+        self.db = None
+        self.providers: dict = {}
+        self.tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self.metrics = {'sent': 0, 'retried': 0, 'failed': 0, 'skipped': 0, 'requests': 0}
+
+    async def start(self, db, providers: Optional[dict] = None):
+        self.db = db
+        self.providers = build_providers(db) if providers is None else providers
+        self._wakeup = asyncio.Event()
+        self.tasks = [asyncio.create_task(self._worker(i)) for i in range(self.num_workers)]
+        logger.info(f"Outbox started with {self.num_workers} workers ({', '.join(self.providers) or 'no providers'})")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        for provider in self.providers.values():
+            if hasattr(provider, 'close'):
+                await provider.close()
+
+    def wake(self):
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def _claim(self) -> List[dict]:
+        """Lease up to batch_size due messages to this worker"""
+        now = datetime.now(timezone.utc)
+        due = await self.db[COLLECTION].find(
+            {'$or': [
+                {'status': 'queued', 'next_attempt_at': {'$lte': now}},
+                {'status': 'sending', 'lease_until': {'$lt': now}}
+            ]},
+            {'_id': 1}
+        ).sort('next_attempt_at', 1).limit(self.batch_size).to_list(self.batch_size)
+        if not due:
+            return []
+
+        lease = str(uuid.uuid4())
+        # Re-check the status so two workers never hold the same message
+        await self.db[COLLECTION].update_many(
+            {
+                '_id': {'$in': [m['_id'] for m in due]},
+                '$or': [{'status': 'queued'}, {'status': 'sending', 'lease_until': {'$lt': now}}]
+            },
+            {'$set': {'status': 'sending', 'lease': lease, 'lease_until': now + timedelta(seconds=LEASE_SECONDS)}}
+        )
+        return await self.db[COLLECTION].find({'lease': lease, 'status': 'sending'}).to_list(self.batch_size)
+
+    async def _worker(self, index: int):
+        while True:
+            try:
+                messages = await self._claim()
+                if not messages:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), POLL_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._send(messages, messages[0]['lease'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Outbox worker {index} error: {str(e)}")
+                await asyncio.sleep(POLL_SECONDS)
+
+    async def _renew(self, lease: str, batch: List[dict]) -> List[dict]:
+        """Extend the lease; returns the part of `batch` this worker still holds"""
+        await self.db[COLLECTION].update_many(
+            {'lease': lease, 'status': 'sending'},
+            {'$set': {'lease_until': datetime.now(timezone.utc) + timedelta(seconds=LEASE_SECONDS)}}
+        )
+        held = set(await self.db[COLLECTION].distinct(
+            '_id', {'_id': {'$in': [m['_id'] for m in batch]}, 'lease': lease, 'status': 'sending'}
+        ))
+        return [m for m in batch if m['_id'] in held]
+
+    async def _send(self, messages: List[dict], lease: str):
+        for channel, group in groupby(sorted(messages, key=lambda m: m['channel']), key=lambda m: m['channel']):
+            group = list(group)
+            provider = self.providers.get(channel)
+            if provider is None:
+                await self.db[COLLECTION].bulk_write([UpdateOne({'_id': m['_id'], 'lease': lease}, {
+                    '$set': {'status': 'skipped', 'last_error': f"No {channel} provider configured"},
+                    '$unset': {'lease': '', 'lease_until': ''}
+                }) for m in group], ordered=False)
+                self.metrics['skipped'] += len(group)
+                continue
+
+            for batch in provider.batches(group):
+                if provider.bucket:
+                    await provider.bucket.acquire()
+                # Waiting on the rate limit may outlast the lease; never send what another worker took over
+                batch = await self._renew(lease, batch)
+                if not batch:
+                    continue
+                self.metrics['requests'] += 1
+                ops = []
+                try:
+                    # Providers may report failures per message
+                    failures = await provider.send(batch) or {}
+                except ProviderError as e:
+                    ops = [self._failure(m, e, lease) for m in batch]
+                    logger.warning(f"Outbox {channel} batch of {len(batch)} failed: {str(e)}")
+                    failures = None
+                if failures is not None:
+                    now = datetime.now(timezone.utc)
+                    for m in batch:
+                        if m['_id'] in failures:
+                            ops.append(self._failure(m, failures[m['_id']], lease))
+                            continue
+                        ops.append(UpdateOne({'_id': m['_id'], 'lease': lease}, {
+                            '$set': {'status': 'sent', 'sent_at': now},
+                            '$inc': {'attempts': 1},
+                            '$unset': {'lease': '', 'lease_until': ''}
+                        }))
+                        self.metrics['sent'] += 1
+                # Recorded per batch, so a crash later in the claim cannot resend it
+                await self.db[COLLECTION].bulk_write(ops, ordered=False)
+
+    def _failure(self, message: dict, error: ProviderError, lease: str) -> UpdateOne:
+        attempts = message.get('attempts', 0) + 1
+        if error.retryable and attempts < MAX_ATTEMPTS:
+            self.metrics['retried'] += 1
+            update = {'status': 'queued', 'next_attempt_at': datetime.now(timezone.utc) + backoff(attempts)}
+        else:
+            self.metrics['failed'] += 1
+            update = {'status': 'failed'}
+        return UpdateOne({'_id': message['_id'], 'lease': lease}, {
+            '$set': {**update, 'attempts': attempts, 'last_error': str(error)},
+            '$unset': {'lease': '', 'lease_until': ''}
+        })
+
+    def stats(self) -> dict:
+        return {**self.metrics, 'workers': len(self.tasks), 'providers': list(self.providers)}
+
+async def status_counts(db) -> Dict[str, int]:
+    """Stored messages per status"""
+    return {
+        row['_id']: row['count'] async for row in db[COLLECTION].aggregate([
+            {'$group': {'_id': '$status', 'count': {'$sum': 1}}}
+        ])
+    }
+
+outbox_sender = Outbox()
@@ -0,0 +1,75 @@
+import logging
+from datetime import datetime, timezone
+from uuid import uuid4
+from pymongo import ASCENDING, DESCENDING
+from pymongo.read_concern import ReadConcern
+from pymongo.write_concern import WriteConcern
+from models import Payment
+import ledger
+import earnings
+
+logger = logging.getLogger(__name__)
+
+# Transactions need a replica set (a single-node one is enough locally):
+#   mongod --replSet rs0  &&  mongosh --eval "rs.initiate()"
+#   MONGO_URL=mongodb://localhost:27017/?replicaSet=rs0
+
+async def ensure_indexes(db):
+    """Indexes used by payment application"""
+    await db.payments.create_index([("id", ASCENDING)], unique=True)
+    await db.payments.create_index([("quote_id", ASCENDING)])
+    await db.payments.create_index([("client_id", ASCENDING), ("created_at", DESCENDING)])
+    await db.wallets.create_index([("mechanic_id", ASCENDING)], unique=True)
+    await db.quotes.create_index([("id", ASCENDING)], unique=True)
+
+def wallet_credit_update(mechanic_id: str, amount: float, now: str) -> dict:
+    """Single upsert that creates the wallet on first credit"""
+    return {
+        "$inc": {
+            "pending_balance": amount,
+            "total_earned": amount
+        },
+        "$set": {"updated_at": now},
+        "$setOnInsert": {
+            "id": str(uuid4()),
+            "mechanic_id": mechanic_id,
+            "available_balance": 0.0
+        }
+    }
+
+async def apply_payment(db, client, payment: Payment, quote_update: dict, mechanic_id: str = None):
+    """Insert the payment, update the order and credit the wallet atomically.
+
+    Runs in one multi-document transaction (ledger entries and earnings
+    counters included); `with_transaction` retries on transient errors
+    and unknown commit results, so a crash midway leaves either all writes or none.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    payment_dict = payment.model_dump()
+    payment_dict['created_at'] = payment_dict['created_at'].isoformat()
+    quote_update = {**quote_update, "updated_at": now}
+    credit = payment.mechanic_earnings or 0.0
+
+    async def callback(session):
+        await db.payments.insert_one(dict(payment_dict), session=session)
+        await db.quotes.update_one({"id": payment.quote_id}, {"$set": quote_update}, session=session)
+        if mechanic_id and credit:
+            await db.wallets.update_one(
+                {"mechanic_id": mechanic_id},
+                wallet_credit_update(mechanic_id, credit, now),
+                upsert=True,
+                session=session
+            )
+            await ledger.post_entries(db, ledger.credit_entries(mechanic_id, credit, payment.id, now), session=session)
+            # Bucketed by the payment's own timestamp, as the backfill counts it
+            await earnings.record_payment(db, mechanic_id, credit, payment_dict['created_at'], session=session)
+
+    async with await client.start_session() as session:
+        await session.with_transaction(
+            callback,
+            read_concern=ReadConcern("snapshot"),
+            write_concern=WriteConcern("majority")
+        )
+
+    logger.info(f"Payment {payment.id} applied to order {payment.quote_id}")
+    return payment
@@ -0,0 +1,313 @@
+import csv
+import logging
+import os
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+from uuid import uuid4
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.read_concern import ReadConcern
+from pymongo.write_concern import WriteConcern
+from models import PayoutRequest
+import ledger
+
+logger = logging.getLogger(__name__)
+
+# Settlement runs in two phases:
+#   1. release - earnings older than the hold period move from pending to
+#      available (window of ledger entries since the previous run)
+#   2. payout  - wallets with enough available balance are paid in batches;
+#      each batch is one transaction and one CSV/OFX file
+RUNS = 'payout_runs'
+BATCHES = 'payout_batches'
+REQUESTS = 'payout_requests'
+
+HOLD_DAYS = int(os.environ.get('PAYOUT_HOLD_DAYS', '7'))
+MIN_PAYOUT_AMOUNT = float(os.environ.get('PAYOUT_MIN_AMOUNT', '20'))
+BATCH_SIZE = int(os.environ.get('PAYOUT_BATCH_SIZE', '1000'))
+BATCH_DIR = Path(os.environ.get('PAYOUT_BATCH_DIR', Path(__file__).parent / 'payout_batches'))
+BATCH_FORMAT = os.environ.get('PAYOUT_BATCH_FORMAT', 'csv')  # csv, ofx
+
+async def ensure_indexes(db):
+    """Indexes for eligible-wallet selection and run bookkeeping"""
+    await db.wallets.create_index([('available_balance', DESCENDING)])
+    await db[RUNS].create_index([('status', ASCENDING), ('started_at', DESCENDING)])
+    await db[REQUESTS].create_index([('mechanic_id', ASCENDING), ('requested_at', DESCENDING)])
+    await db[REQUESTS].create_index([('batch_id', ASCENDING)])
+    await db[BATCHES].create_index([('status', ASCENDING), ('created_at', ASCENDING)])
+
+def _chunks(items: List, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+async def _in_transaction(client, callback):
+    async with await client.start_session() as session:
+        await session.with_transaction(
+            callback,
+            read_concern=ReadConcern('snapshot'),
+            write_concern=WriteConcern('majority')
+        )
+
+async def _start_run(db) -> dict:
+    """Resume an unfinished run (same window) or open the next one"""
+    run = await db[RUNS].find_one({'status': {'$ne': 'completed'}}, {'_id': 0}, sort=[('started_at', 1)])
+    if run:
+        logger.info(f"Resuming payout run {run['id']}")
+        return run
+
+    last = await db[RUNS].find_one({'status': 'completed'}, {'_id': 0, 'release_until': 1}, sort=[('started_at', -1)])
+    run = {
+        'id': str(uuid4()),
+        'status': 'releasing',
+        'release_from': last['release_until'] if last else '',
+        'release_until': (datetime.now(timezone.utc) - timedelta(days=HOLD_DAYS)).isoformat(),
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'released_wallets': 0,
+        'released_amount': 0.0,
+        'batches': []
+    }
+    await db[RUNS].insert_one(dict(run))
+    return run
+
+async def _releasable(db, run: dict) -> Dict[str, float]:
+    """Net pending credits per mechanic inside the run window (one grouped scan)"""
+    cursor = db[ledger.ENTRIES].aggregate([
+        {'$match': {
+            'ts': {'$gt': run['release_from'], '$lte': run['release_until']},
+            'account': ledger.MECHANIC_PENDING,
+            'kind': {'$in': ['credit', 'debit']}
+        }},
+        {'$group': {'_id': '$mechanic_id', 'total': {'$sum': '$amount'}}}
+    ], allowDiskUse=True)
+    return {row['_id']: round(row['total'], 2) async for row in cursor if round(row['total'], 2) > 0}
+
+class ReleaseConflict(Exception):
+    """Another run released some of the chunk's wallets first"""
+
+async def _release_chunk(db, client, run: dict, chunk: List[str], amounts: Dict[str, float]) -> List[str]:
+    # Wallets already released for this window (an interrupted or concurrent run) are skipped
+    done = set(await db.wallets.distinct(
+        'mechanic_id',
+        {'mechanic_id': {'$in': chunk}, 'released_through': {'$gte': run['release_until']}}
+    ))
+    todo = [m for m in chunk if m not in done]
+    if not todo:
+        return []
+
+    now = datetime.now(timezone.utc).isoformat()
+    # The write itself re-checks the window, so two runs can never both release a wallet
+    ops = [
+        UpdateOne(
+            {'mechanic_id': m, 'released_through': {'$not': {'$gte': run['release_until']}}},
+            {
+                '$inc': {'pending_balance': -amounts[m], 'available_balance': amounts[m]},
+                '$set': {'released_through': run['release_until'], 'updated_at': now}
+            }
+        )
+        for m in todo
+    ]
+    entries = [e for m in todo for e in ledger.release_entries(m, amounts[m], run['id'], now)]
+
+    async def callback(session):
+        result = await db.wallets.bulk_write(ops, ordered=False, session=session)
+        if result.matched_count != len(ops):
+            raise ReleaseConflict(f"{len(ops) - result.matched_count} wallets already released")
+        await ledger.post_entries(db, entries, session=session)
+
+    await _in_transaction(client, callback)
+    return todo
+
+async def release_pending(db, client, run: dict) -> dict:
+    """Move held earnings from pending to available, a chunk per transaction"""
+    amounts = await _releasable(db, run)
+    mechanic_ids = list(amounts)
+    released_wallets, released_amount = 0, 0.0
+
+    for chunk in _chunks(mechanic_ids, BATCH_SIZE):
+        while True:
+            try:
+                released = await _release_chunk(db, client, run, chunk, amounts)
+                break
+            except ReleaseConflict as e:
+                # The transaction was rolled back; recompute what is left of the chunk
+                logger.warning(f"Payout run {run['id']}: {str(e)}, retrying chunk")
+        released_wallets += len(released)
+        released_amount += sum(amounts[m] for m in released)
+
+    await db[RUNS].update_one(
+        {'id': run['id']},
+        {
+            '$set': {'status': 'paying'},
+            '$inc': {'released_wallets': released_wallets, 'released_amount': round(released_amount, 2)}
+        }
+    )
+    logger.info(f"Payout run {run['id']}: released {released_amount:.2f} to {released_wallets} wallets")
+    return {'wallets': released_wallets, 'amount': round(released_amount, 2)}
+
+def _write_csv(path: Path, batch: dict, items: List[dict]):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['payout_id', 'mechanic_id', 'name', 'email', 'amount', 'currency', 'batch_id', 'created_at'])
+        for item in items:
+            writer.writerow([
+                item['payout_id'], item['mechanic_id'], item.get('name', ''), item.get('email', ''),
+                f"{item['amount']:.2f}", 'BRL', batch['id'], batch['created_at']
+            ])
+
+def _write_ofx(path: Path, batch: dict, items: List[dict]):
+    stamp = batch['created_at'][:19].replace('-', '').replace(':', '').replace('T', '')
+    transactions = ''.join(
+        '<STMTTRN>'
+        '<TRNTYPE>DEBIT'
+        f'<DTPOSTED>{stamp}'
+        f"<TRNAMT>-{item['amount']:.2f}"
+        f"<FITID>{item['payout_id']}"
+        f"<NAME>{(item.get('name') or item['mechanic_id'])[:32]}"
+        f"<MEMO>QuickMechanic payout {item['mechanic_id']}"
+        '</STMTTRN>\n'
+        for item in items
+    )
+    total = sum(item['amount'] for item in items)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(
+            'OFXHEADER:100\nDATA:OFXSGML\nVERSION:102\nSECURITY:NONE\nENCODING:UTF-8\n'
+            'CHARSET:NONE\nCOMPRESSION:NONE\nOLDFILEUID:NONE\nNEWFILEUID:NONE\n\n'
+            '<OFX><BANKMSGSRSV1><STMTTRNRS>'
+            f"<TRNUID>{batch['id']}<STATUS><CODE>0<SEVERITY>INFO</STATUS>"
+            f'<STMTRS><CURDEF>BRL<BANKTRANLIST><DTSTART>{stamp}<DTEND>{stamp}\n'
+            f'{transactions}'
+            f'</BANKTRANLIST><LEDGERBAL><BALAMT>-{total:.2f}<DTASOF>{stamp}</LEDGERBAL>'
+            '</STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>\n'
+        )
+
+def write_batch_file(batch: dict, items: List[dict], fmt: str = BATCH_FORMAT) -> str:
+    """Write the bank file of a payout batch, returns its path"""
+    BATCH_DIR.mkdir(parents=True, exist_ok=True)
+    path = BATCH_DIR / f"payout_{batch['created_at'][:10]}_{batch['id']}.{fmt}"
+    if fmt == 'ofx':
+        _write_ofx(path, batch, items)
+    else:
+        _write_csv(path, batch, items)
+    return str(path)
+
+async def export_batch(db, batch: dict) -> dict:
+    """Write the bank file of a committed batch from its payout requests"""
+    requests = await db[REQUESTS].find(
+        {'batch_id': batch['id']}, {'_id': 0, 'id': 1, 'mechanic_id': 1, 'amount': 1}
+    ).to_list(None)
+    # Names for the bank file, one query per batch
+    users = await db.users.find(
+        {'id': {'$in': [r['mechanic_id'] for r in requests]}},
+        {'_id': 0, 'id': 1, 'name': 1, 'email': 1}
+    ).to_list(len(requests))
+    by_id = {u['id']: u for u in users}
+    items = [
+        {
+            'payout_id': r['id'],
+            'mechanic_id': r['mechanic_id'],
+            'amount': r['amount'],
+            'name': by_id.get(r['mechanic_id'], {}).get('name', ''),
+            'email': by_id.get(r['mechanic_id'], {}).get('email', '')
+        }
+        for r in requests
+    ]
+
+    path = write_batch_file(batch, items)
+    await db[BATCHES].update_one({'id': batch['id']}, {'$set': {'status': 'exported', 'file': path}})
+    await db[RUNS].update_one({'id': batch['run_id']}, {'$addToSet': {'batches': batch['id']}})
+    logger.info(f"Payout batch {batch['id']}: {batch['payouts']} payouts, {batch['total_amount']:.2f} -> {path}")
+    return {**batch, 'status': 'exported', 'file': path}
+
+async def export_pending_batches(db) -> List[dict]:
+    """Re-emit files for batches committed but never exported (crash after commit)"""
+    exported = []
+    async for batch in db[BATCHES].find({'status': 'created'}, {'_id': 0}).sort('created_at', 1):
+        try:
+            exported.append(await export_batch(db, batch))
+        except Exception as e:
+            logger.error(f"Error exporting payout batch {batch['id']}: {str(e)}")
+    return exported
+
+async def pay_out(db, client, run: dict) -> List[dict]:
+    """Pay every wallet above the minimum, one transaction and file per batch"""
+    eligible = await db.wallets.find(
+        {'available_balance': {'$gte': MIN_PAYOUT_AMOUNT}},
+        {'_id': 0, 'mechanic_id': 1, 'available_balance': 1}
+    ).to_list(None)
+
+    batches = []
+    for chunk in _chunks(eligible, BATCH_SIZE):
+        now = datetime.now(timezone.utc)
+        batch = {
+            'id': str(uuid4()),
+            'run_id': run['id'],
+            'status': 'created',
+            'created_at': now.isoformat()
+        }
+        requests = []
+        items = []
+        for wallet in chunk:
+            amount = round(wallet['available_balance'], 2)
+            payout = PayoutRequest(
+                mechanic_id=wallet['mechanic_id'], amount=amount, status='approved',
+                batch_id=batch['id'], processed_at=now
+            )
+            payout_dict = payout.model_dump()
+            payout_dict['requested_at'] = payout_dict['requested_at'].isoformat()
+            payout_dict['processed_at'] = payout_dict['processed_at'].isoformat()
+            requests.append(payout_dict)
+            items.append({'payout_id': payout.id, 'mechanic_id': payout.mechanic_id, 'amount': amount})
+
+        # Only debit balances that are still there; any mismatch aborts the batch
+        ops = [
+            UpdateOne(
+                {'mechanic_id': item['mechanic_id'], 'available_balance': {'$gte': item['amount']}},
+                {'$inc': {'available_balance': -item['amount']}, '$set': {'updated_at': batch['created_at']}}
+            )
+            for item in items
+        ]
+        entries = [
+            e for item in items
+            for e in ledger.payout_entries(item['mechanic_id'], item['amount'], item['payout_id'], batch['created_at'])
+        ]
+        batch['payouts'] = len(items)
+        batch['total_amount'] = round(sum(item['amount'] for item in items), 2)
+
+        async def callback(session):
+            result = await db.wallets.bulk_write(ops, ordered=False, session=session)
+            if result.matched_count != len(ops):
+                raise RuntimeError(f"Payout batch {batch['id']}: {len(ops) - result.matched_count} wallets changed")
+            await db[REQUESTS].insert_many([dict(r) for r in requests], session=session)
+            await ledger.post_entries(db, entries, session=session)
+            await db[BATCHES].insert_one(dict(batch), session=session)
+
+        try:
+            await _in_transaction(client, callback)
+        except Exception as e:
+            logger.error(f"Error paying batch {batch['id']}: {str(e)}")
+            continue
+
+        try:
+            batches.append(await export_batch(db, batch))
+        except Exception as e:
+            # Committed but not exported: export_pending_batches re-emits it
+            logger.error(f"Error exporting payout batch {batch['id']}: {str(e)}")
+
+    return batches
+
+async def run_settlement(db, client) -> dict:
+    """Release held earnings and pay out eligible wallets"""
+    await export_pending_batches(db)
+    run = await _start_run(db)
+    if run['status'] == 'releasing':
+        await release_pending(db, client, run)
+    await pay_out(db, client, run)
+
+    finished_at = datetime.now(timezone.utc).isoformat()
+    await db[RUNS].update_one({'id': run['id']}, {'$set': {'status': 'completed', 'finished_at': finished_at}})
+    return await db[RUNS].find_one({'id': run['id']}, {'_id': 0})
+
+async def list_batches(db, limit: int = 50, before: Optional[str] = None) -> List[dict]:
+    """Most recent payout batches"""
+    query = {'created_at': {'$lt': before}} if before else {}
+    return await db[BATCHES].find(query, {'_id': 0}).sort('created_at', -1).limit(limit).to_list(limit)
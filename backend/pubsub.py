@@ -0,0 +1,111 @@
+import asyncio
+import itertools
+import logging
+import uuid
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+class PubSub:
+    """In-process publish/subscribe on string topics.
+
+    Each subscriber gets its own queue; publishing never blocks. Only
+    reaches subscribers in this process.
+
+    `publish_event` also keeps the last `history_size` events of a topic
+    (for up to `max_topics` topics) so a reconnecting stream can replay
+    what it missed. Event ids are `<epoch>-<seq>`; the epoch changes on
+    restart, when ids from before can no longer be resumed. Each topic
+    remembers the newest seq it has lost (trimmed from its history, or
+    evicted with a whole topic), so replay can tell when it's incomplete.
+    """
+
+    def __init__(self, max_queue_size: int = 100, history_size: int = 100, max_topics: int = 10000):
+        self.max_queue_size = max_queue_size
+        self.history_size = history_size
+        self.max_topics = max_topics
+        self.epoch = uuid.uuid4().hex[:8]
+        self._seq = itertools.count(1)
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self._history: "OrderedDict[str, Deque[dict]]" = OrderedDict()
+        self._lost: Dict[str, int] = {}  # topic -> newest seq no longer kept
+        self._evicted = 0  # newest seq of any evicted topic
+
+    def subscribe(self, topic: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._subscribers[topic].add(queue)
+        return queue
+
+    def unsubscribe(self, topic: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(topic)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[topic]
+
+    def publish(self, topic: str, message: Any) -> int:
+        """Deliver to every current subscriber; returns how many received it"""
+        delivered = 0
+        for queue in list(self._subscribers.get(topic, ())):
+            try:
+                queue.put_nowait(message)
+                delivered += 1
+            except asyncio.QueueFull:
+                logger.warning(f"Subscriber queue full on {topic}, message dropped")
+        return delivered
+
+    def publish_event(self, topic: str, event: str, data: Any) -> dict:
+        """Publish `{id, event, data}` and keep it for replay"""
+        seq = next(self._seq)
+        message = {'id': f"{self.epoch}-{seq}", 'event': event, 'data': data}
+        history = self._history.get(topic)
+        if history is None:
+            history = self._history[topic] = deque(maxlen=self.history_size)
+            # Earlier events of this topic may have been evicted with it
+            self._lost[topic] = self._evicted
+            if len(self._history) > self.max_topics:
+                evicted_topic, evicted = self._history.popitem(last=False)
+                self._lost.pop(evicted_topic, None)
+                if evicted:
+                    self._evicted = max(self._evicted, _seq_of(evicted[-1]))
+        else:
+            self._history.move_to_end(topic)
+            if len(history) == history.maxlen:
+                self._lost[topic] = _seq_of(history[0])
+        history.append(message)
+        self.publish(topic, message)
+        return message
+
+    def replay(self, topic: str, last_event_id: str) -> Optional[List[dict]]:
+        """Events after `last_event_id`, or None if they are no longer buffered"""
+        epoch, _, seq = last_event_id.partition('-')
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        history = self._history.get(topic)
+        lost = self._lost[topic] if history is not None else self._evicted
+        if seq < lost:
+            return None
+        return [m for m in history or () if _seq_of(m) > seq]
+
+    @asynccontextmanager
+    async def subscription(self, topic: str):
+        queue = self.subscribe(topic)
+        try:
+            yield queue
+        finally:
+            self.unsubscribe(topic, queue)
+
+    async def wait_for(self, queue: asyncio.Queue, timeout: float) -> Optional[Any]:
+        """Next message from a subscription queue, or None on timeout"""
+        try:
+            return await asyncio.wait_for(queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+def _seq_of(message: dict) -> int:
+    return int(message['id'].rpartition('-')[2])
+
+bus = PubSub()
@@ -0,0 +1,163 @@
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from cache import TTLCache
+from order_events import EVENTS_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+# Mechanic ranking score (0-100) stored on the user document:
+#   70% Bayesian-smoothed rating: (PRIOR_WEIGHT * prior + rating_sum) / (PRIOR_WEIGHT + review_count)
+#   30% reliability: decayed completions vs decayed cancellations (accepted
+#       orders the mechanic dropped), smoothed towards PRIOR_RELIABILITY.
+#       A client rejecting a quote is not held against the mechanic.
+# Decayed counters halve every HALF_LIFE_DAYS. The same pipeline stages
+# update one mechanic on an event and all mechanics in the batch job.
+PRIOR_WEIGHT = 5
+DEFAULT_PRIOR_MEAN = 4.0
+PRIOR_RELIABILITY = 0.9
+RELIABILITY_WEIGHT = 2
+RATING_SHARE = 0.7
+HALF_LIFE_DAYS = 90
+HALF_LIFE_MS = HALF_LIFE_DAYS * 24 * 3600 * 1000
+
+PARAMS = 'ranking_params'
+# Dropping an order in one of these counts as a cancellation
+ACCEPTED_STATUSES = ['approved', 'prebooked', 'paid', 'in_progress']
+DROPPED_STATUSES = ['pending', 'cancelled']
+
+_params_cache = TTLCache(3600, max_entries=1)
+
+async def ensure_indexes(db):
+    """Ranked listing is an indexed sort"""
+    await db.users.create_index([
+        ('user_type', ASCENDING), ('is_active', ASCENDING), ('ranking_score', DESCENDING), ('id', ASCENDING)
+    ])
+
+def _decay_factor() -> dict:
+    age_ms = {'$subtract': ['$$NOW', {'$toDate': {'$ifNull': ['$ranking_decay_ts', '$$NOW']}}]}
+    return {'$pow': [0.5, {'$divide': [age_ms, HALF_LIFE_MS]}]}
+
+def decay_stages(completed: int = 0, cancelled: int = 0) -> List[dict]:
+    """Decay the counters to now and add the new events"""
+    factor = _decay_factor()
+    return [{'$set': {
+        'decayed_completions': {'$add': [{'$multiply': [{'$ifNull': ['$decayed_completions', 0]}, factor]}, completed]},
+        'decayed_cancels': {'$add': [{'$multiply': [{'$ifNull': ['$decayed_cancels', 0]}, factor]}, cancelled]},
+        'ranking_decay_ts': '$$NOW'
+    }}]
+
+def score_stages(prior_mean: float = DEFAULT_PRIOR_MEAN) -> List[dict]:
+    """Recompute ranking_score from the rating and decayed counters"""
+    count = {'$ifNull': ['$review_count', 0]}
+    rating_sum = {'$ifNull': ['$rating_sum', {'$multiply': [{'$ifNull': ['$rating', 0]}, count]}]}
+    completions = {'$ifNull': ['$decayed_completions', 0]}
+    cancels = {'$ifNull': ['$decayed_cancels', 0]}
+    return [
+        {'$set': {
+            '_bayes': {'$divide': [
+                {'$add': [PRIOR_WEIGHT * prior_mean, rating_sum]},
+                {'$add': [PRIOR_WEIGHT, count]}
+            ]},
+            '_reliability': {'$divide': [
+                {'$add': [completions, RELIABILITY_WEIGHT * PRIOR_RELIABILITY]},
+                {'$add': [completions, cancels, RELIABILITY_WEIGHT]}
+            ]}
+        }},
+        {'$set': {
+            'ranking_score': {'$round': [{'$multiply': [100, {'$add': [
+                {'$multiply': [RATING_SHARE, {'$divide': ['$_bayes', 5]}]},
+                {'$multiply': [1 - RATING_SHARE, '$_reliability']}
+            ]}]}, 4]},
+            'ranking_updated_at': '$$NOW'
+        }},
+        {'$unset': ['_bayes', '_reliability']}
+    ]
+
+async def prior_mean(db) -> float:
+    """Platform-wide mean rating, as computed by the last batch run"""
+    async def load():
+        params = await db[PARAMS].find_one({'_id': 'current'})
+        return params['prior_mean'] if params else DEFAULT_PRIOR_MEAN
+    return await _params_cache.get_or_compute('prior_mean', load)
+
+async def _apply(db, mechanic_id: str, stages: List[dict]):
+    try:
+        await db.users.update_one({'id': mechanic_id, 'user_type': 'mechanic'}, stages)
+    except Exception as e:
+        logger.error(f"Error updating ranking for {mechanic_id}: {str(e)}")
+
+async def record_completion(db, mechanic_id: str):
+    await _apply(db, mechanic_id, decay_stages(completed=1) + score_stages(await prior_mean(db)))
+
+def cancelled_by_mechanic(order: dict, status: str, user_id: str) -> Optional[str]:
+    """The mechanic to charge with a cancellation, when they drop their accepted order"""
+    mechanic_id = order.get('mechanic_id')
+    if mechanic_id and mechanic_id == user_id and order.get('status') in ACCEPTED_STATUSES and status in DROPPED_STATUSES:
+        return mechanic_id
+    return None
+
+async def record_cancel(db, mechanic_id: str):
+    await _apply(db, mechanic_id, decay_stages(cancelled=1) + score_stages(await prior_mean(db)))
+
+async def _decayed_sums(cursor) -> Dict[str, float]:
+    return {row['_id']: row['total'] async for row in cursor if row['_id']}
+
+def _decayed_sum_stage(ts_field: str, group_field: str) -> dict:
+    age_ms = {'$subtract': ['$$NOW', {'$toDate': f'${ts_field}'}]}
+    return {'$group': {
+        '_id': f'${group_field}',
+        'total': {'$sum': {'$pow': [0.5, {'$divide': [age_ms, HALF_LIFE_MS]}]}}
+    }}
+
+async def recompute_all(db, batch_size: int = 1000) -> dict:
+    """Rebuild decayed counters from history and rescore every mechanic"""
+    completions = await _decayed_sums(db.quotes.aggregate([
+        {'$match': {
+            'status': {'$in': ['completed', 'reviewed']},
+            'mechanic_id': {'$ne': None},
+            'completed_at': {'$type': 'string'}
+        }},
+        _decayed_sum_stage('completed_at', 'mechanic_id')
+    ], allowDiskUse=True))
+    cancels = await _decayed_sums(db[EVENTS_COLLECTION].aggregate([
+        {'$match': {'data.cancelled_mechanic_id': {'$type': 'string'}}},
+        _decayed_sum_stage('created_at', 'data.cancelled_mechanic_id')
+    ], allowDiskUse=True))
+
+    now = datetime.now(timezone.utc)
+    await db.users.update_many(
+        {'user_type': 'mechanic'},
+        {'$set': {'decayed_completions': 0, 'decayed_cancels': 0, 'ranking_decay_ts': now}}
+    )
+    mechanic_ids = list(set(completions) | set(cancels))
+    for i in range(0, len(mechanic_ids), batch_size):
+        await db.users.bulk_write([
+            UpdateOne(
+                {'id': m, 'user_type': 'mechanic'},
+                {'$set': {'decayed_completions': completions.get(m, 0), 'decayed_cancels': cancels.get(m, 0)}}
+            )
+            for m in mechanic_ids[i:i + batch_size]
+        ], ordered=False)
+
+    rows = await db.users.aggregate([
+        {'$match': {'user_type': 'mechanic', 'review_count': {'$gt': 0}}},
+        {'$group': {
+            '_id': None,
+            'sum': {'$sum': {'$ifNull': ['$rating_sum', {'$multiply': ['$rating', '$review_count']}]}},
+            'count': {'$sum': '$review_count'}
+        }}
+    ]).to_list(1)
+    mean = round(rows[0]['sum'] / rows[0]['count'], 4) if rows and rows[0]['count'] else DEFAULT_PRIOR_MEAN
+    await db[PARAMS].update_one(
+        {'_id': 'current'},
+        {'$set': {'prior_mean': mean, 'updated_at': now.isoformat()}},
+        upsert=True
+    )
+    _params_cache.set('prior_mean', mean)
+
+    # One server-side pass scores every mechanic
+    result = await db.users.update_many({'user_type': 'mechanic'}, score_stages(mean))
+    logger.info(f"Ranking recomputed for {result.modified_count} mechanics (prior mean {mean})")
+    return {'mechanics': result.modified_count, 'prior_mean': mean}
@@ -0,0 +1,136 @@
+import logging
+from datetime import datetime, timezone
+from typing import List, Optional
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+import ranking
+
+logger = logging.getLogger(__name__)
+
+# Rating counters kept on the mechanic's user document:
+#   rating_sum, review_count, rating_histogram {"1": n, ..., "5": n}
+# and `rating`, the rounded average derived from them.
+STARS = ['1', '2', '3', '4', '5']
+COUNTER_FIELDS = {'_id': 0, 'id': 1, 'rating': 1, 'rating_sum': 1, 'review_count': 1, 'rating_histogram': 1}
+
+async def ensure_indexes(db):
+    """One review per order; keyset-paged reviews per mechanic"""
+    await db.reviews.create_index([('order_id', ASCENDING)], unique=True)
+    await db.reviews.create_index([('mechanic_id', ASCENDING), ('created_at', DESCENDING), ('id', DESCENDING)])
+
+def add_rating_update(rating: int) -> List[dict]:
+    """Pipeline update adding one review to the counters.
+
+    Counters and average change in one atomic single-document write.
+    Mechanics rated before the counters existed are seeded from their
+    stored average until `check(fix=True)` has run.
+    """
+    star = str(rating)
+    previous_sum = {'$ifNull': ['$rating_sum', {'$multiply': [
+        {'$ifNull': ['$rating', 0]}, {'$ifNull': ['$review_count', 0]}
+    ]}]}
+    return [
+        {'$set': {
+            'rating_sum': {'$add': [previous_sum, rating]},
+            'review_count': {'$add': [{'$ifNull': ['$review_count', 0]}, 1]},
+            f'rating_histogram.{star}': {'$add': [{'$ifNull': [f'$rating_histogram.{star}', 0]}, 1]}
+        }},
+        {'$set': {'rating': {'$round': [{'$divide': ['$rating_sum', '$review_count']}, 1]}}}
+    ]
+
+async def add_rating(db, mechanic_id: str, rating: int):
+    """Add a review and rescore the mechanic in the same write"""
+    stages = add_rating_update(rating) + ranking.score_stages(await ranking.prior_mean(db))
+    await db.users.update_one({'id': mechanic_id}, stages)
+
+def summary(user: Optional[dict]) -> dict:
+    """Average and star distribution from the counters"""
+    user = user or {}
+    count = user.get('review_count') or 0
+    histogram = {star: (user.get('rating_histogram') or {}).get(star, 0) for star in STARS}
+    rating_sum = user.get('rating_sum')
+    average = round(rating_sum / count, 2) if count and rating_sum is not None else user.get('rating')
+    return {
+        'average': average,
+        'review_count': count,
+        'histogram': histogram,
+        'distribution': [
+            {'stars': int(star), 'count': histogram[star], 'percentage': round(100 * histogram[star] / count) if count else 0}
+            for star in reversed(STARS)
+        ]
+    }
+
+async def get_summary(db, mechanic_id: str) -> Optional[dict]:
+    user = await db.users.find_one({'id': mechanic_id}, COUNTER_FIELDS)
+    return summary(user) if user else None
+
+async def check(db, fix: bool = False, batch_size: int = 1000) -> dict:
+    """Recompute counters from the reviews by aggregation and compare.
+
+    With `fix` the stored counters are overwritten (this is also the
+    backfill for mechanics reviewed before the counters existed).
+    """
+    star_counts = {
+        star: {'$sum': {'$cond': [{'$eq': ['$rating', int(star)]}, 1, 0]}}
+        for star in STARS
+    }
+    cursor = db.reviews.aggregate([
+        {'$group': {'_id': '$mechanic_id', 'rating_sum': {'$sum': '$rating'}, 'review_count': {'$sum': 1}, **star_counts}}
+    ], allowDiskUse=True)
+    expected = {}
+    async for row in cursor:
+        expected[row['_id']] = {
+            'rating_sum': row['rating_sum'],
+            'review_count': row['review_count'],
+            'rating_histogram': {star: row[star] for star in STARS},
+            'rating': round(row['rating_sum'] / row['review_count'], 1)
+        }
+
+    # Mechanics with counters but no reviews must be reset too
+    stale = await db.users.distinct('id', {
+        'user_type': 'mechanic',
+        'review_count': {'$gt': 0},
+        'id': {'$nin': list(expected)}
+    })
+    for mechanic_id in stale:
+        expected[mechanic_id] = {
+            'rating_sum': 0,
+            'review_count': 0,
+            'rating_histogram': {star: 0 for star in STARS},
+            'rating': None
+        }
+
+    mismatches = []
+    mechanic_ids = list(expected)
+    for i in range(0, len(mechanic_ids), batch_size):
+        chunk = mechanic_ids[i:i + batch_size]
+        stored = {
+            u['id']: u async for u in db.users.find({'id': {'$in': chunk}}, COUNTER_FIELDS)
+        }
+        ops = []
+        for mechanic_id in chunk:
+            want = expected[mechanic_id]
+            have = stored.get(mechanic_id)
+            if have is None:
+                continue
+            have_values = {
+                'rating_sum': have.get('rating_sum'),
+                'review_count': have.get('review_count') or 0,
+                'rating_histogram': {star: (have.get('rating_histogram') or {}).get(star, 0) for star in STARS},
+                'rating': have.get('rating')
+            }
+            if have_values != want:
+                mismatches.append({'mechanic_id': mechanic_id, 'stored': have_values, 'expected': want})
+                ops.append(UpdateOne({'id': mechanic_id}, {'$set': want}))
+        if fix and ops:
+            await db.users.bulk_write(ops, ordered=False)
+
+    report = {
+        'checked_mechanics': len(expected),
+        'mismatches': len(mismatches),
+        'fixed': fix,
+        'examples': mismatches[:20],
+        'checked_at': datetime.now(timezone.utc).isoformat()
+    }
+    if mismatches:
+        logger.warning(f"Rating counters: {len(mismatches)} mismatches{' fixed' if fix else ''}")
+    return report
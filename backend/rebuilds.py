@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# Rebuilding $inc counters (earnings buckets, metric rollups) from history
+# without stopping writers. A rebuild stores a fence timestamp here under
+# its name; it recounts history before the fence, while writers of events
+# at or after it also add to the bucket's `since_fence`. Each bucket is
+# then set to recount + since_fence in one atomic update, so increments
+# made during the rebuild are neither lost nor counted twice.
+COLLECTION = 'counter_rebuilds'
+GRACE_SECONDS = 10  # lets writes timestamped before the fence land
+TIMEOUT = timedelta(hours=1)  # a lock this old belongs to a crashed run
+
+# (bucket filter, recounted values)
+Bucket = Tuple[dict, Dict[str, float]]
+
+async def current(db, name: str, session=None) -> Optional[dict]:
+    """The running rebuild's lock document ({fence, ...}), if any"""
+    return await db[COLLECTION].find_one({'_id': name}, session=session)
+
+def fenced(increments: Dict[str, float], ts: str, fence: Optional[str]) -> Dict[str, float]:
+    """$inc for a writer: also counted in since_fence when at or after the fence"""
+    if fence and ts >= fence:
+        return {**increments, **{f'since_fence.{field}': value for field, value in increments.items()}}
+    return increments
+
+async def run(db, name: str, collection: str, scope: dict, fields: Dict[str, float],
+              recount: Callable[[str], Awaitable[List[Bucket]]], **lock) -> int:
+    """Rebuild the buckets of `collection` matching `scope`.
+
+    `recount(fence)` returns the recounted buckets from history before the
+    fence; `fields` are every counter with its zero value. Extra `lock`
+    fields are stored on the lock document for writers to inspect.
+    """
+    started = datetime.now(timezone.utc)
+    await db[COLLECTION].delete_one({'_id': name, 'started_at': {'$lt': (started - TIMEOUT).isoformat()}})
+    # Leftovers of a previous run, before any writer can see the new fence
+    await db[collection].update_many({**scope, 'since_fence': {'$exists': True}}, {'$unset': {'since_fence': ''}})
+    fence = started.isoformat()
+    try:
+        await db[COLLECTION].insert_one({'_id': name, 'fence': fence, 'started_at': fence, **lock})
+    except DuplicateKeyError:
+        raise RuntimeError(f"A {name} rebuild is already running")
+    try:
+        await asyncio.sleep(GRACE_SECONDS)
+        return await replace_buckets(db, collection, scope, fields, await recount(fence), fence)
+    finally:
+        await db[COLLECTION].delete_one({'_id': name, 'fence': fence})
+
+async def replace_buckets(db, collection: str, scope: dict, fields: Dict[str, float],
+                          buckets: List[Bucket], fence: str) -> int:
+    """Set every bucket in scope to its recount plus what was added since the fence"""
+    now = datetime.now(timezone.utc).isoformat()
+
+    def replace(values: dict) -> list:
+        return [
+            {'$set': {
+                **{field: {'$add': [value, {'$ifNull': [f'$since_fence.{field}', 0]}]} for field, value in {**fields, **values}.items()},
+                'updated_at': now,
+                'rebuilt_at': fence
+            }},
+            {'$project': {'since_fence': 0}}
+        ]
+
+    ops = [UpdateOne(key, replace(values), upsert=True) for key, values in buckets]
+    for i in range(0, len(ops), 1000):
+        await db[collection].bulk_write(ops[i:i + 1000], ordered=False)
+    # Buckets with no history before the fence keep only what came after it
+    await db[collection].update_many({**scope, 'rebuilt_at': {'$ne': fence}}, replace({}))
+    return len(ops)
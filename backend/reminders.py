@@ -0,0 +1,123 @@
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Callable, Dict, List, Optional
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError
+from sms_service import sms_reminder_24h, sms_reminder_1h
+from availability import SERVICE_TIMEZONE
+import delayed_jobs
+import outbox
+
+logger = logging.getLogger(__name__)
+
+# Each paid order gets one delayed job per reminder, due exactly 24h and
+# 1h before the service. Order date/time are the workshop's local time
+# (availability.SERVICE_TIMEZONE, Brasília by default).
+# Every reminder is recorded in reminders_sent (unique per order and
+# kind) and its outbox message id is derived from the same pair, so
+# retries and reruns never text a client twice.
+COLLECTION = 'reminders_sent'
+BATCH_SIZE = 500
+OFFSETS = {'24h': timedelta(hours=24), '1h': timedelta(hours=1)}
+ORDER_FIELDS = {'_id': 0, 'id': 1, 'client_id': 1, 'service': 1, 'date': 1, 'time': 1}
+CLIENT_FIELDS = {'_id': 0, 'id': 1, 'name': 1, 'phone': 1, 'locale': 1}
+
+async def ensure_indexes(db):
+    await db[COLLECTION].create_index([('order_id', ASCENDING), ('kind', ASCENDING)], unique=True)
+    await db.quotes.create_index([('status', ASCENDING), ('date', ASCENDING), ('time', ASCENDING)])
+
+def _builders() -> Dict[str, Callable[[dict, dict], List[dict]]]:
+    return {
+        '24h': lambda order, client: sms_reminder_24h([client], order['service'], order['date'], order['time']),
+        '1h': lambda order, client: sms_reminder_1h([client], order['service'], order['time'])
+    }
+
+async def _process_batch(db, kind: str, orders: List[dict]) -> int:
+    order_ids = [o['id'] for o in orders]
+    already = set(await db[COLLECTION].distinct('order_id', {'order_id': {'$in': order_ids}, 'kind': kind}))
+    orders = [o for o in orders if o['id'] not in already]
+    if not orders:
+        return 0
+
+    client_ids = list({o['client_id'] for o in orders})
+    clients = {
+        c['id']: c async for c in db.users.find({'id': {'$in': client_ids}}, CLIENT_FIELDS)
+    }
+
+    build = _builders()[kind]
+    messages, sent = [], []
+    now = datetime.now(timezone.utc).isoformat()
+    for order in orders:
+        client = clients.get(order['client_id'])
+        built = build(order, client) if client else []
+        if not built:
+            continue
+        messages.append(outbox.with_id(built[0], f"reminder:{kind}:{order['id']}"))
+        sent.append({'order_id': order['id'], 'kind': kind, 'client_id': client['id'], 'sent_at': now})
+
+    await outbox.enqueue(db, messages)
+    if sent:
+        try:
+            await db[COLLECTION].insert_many(sent, ordered=False)
+        except BulkWriteError as e:
+            # Another run recorded some of them first; the outbox ids kept it to one SMS
+            if any(err.get('code') != 11000 for err in e.details.get('writeErrors', [])):
+                raise
+    return len(messages)
+
+def service_time(order: dict) -> Optional[datetime]:
+    try:
+        local = datetime.strptime(f"{order['date']} {order['time']}", '%Y-%m-%d %H:%M').replace(tzinfo=SERVICE_TIMEZONE)
+        return local.astimezone(timezone.utc)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def job_key(kind: str, order_id: str) -> str:
+    return f"reminder_{kind}:{order_id}"
+
+async def schedule_for_order(db, order: dict, replace: bool = True) -> int:
+    """Schedule the reminders still ahead of a paid order"""
+    starts_at = service_time(order)
+    if not starts_at:
+        return 0
+    now = datetime.now(timezone.utc)
+    scheduled = 0
+    for kind, offset in OFFSETS.items():
+        run_at = starts_at - offset
+        if run_at <= now:
+            continue
+        await delayed_jobs.schedule(
+            db, f"reminder_{kind}", job_key(kind, order['id']), run_at,
+            {'order_id': order['id'], 'date': order['date'], 'time': order['time']},
+            replace=replace
+        )
+        scheduled += 1
+    return scheduled
+
+async def cancel_for_order(db, order_id: str):
+    for kind in OFFSETS:
+        await delayed_jobs.cancel(db, job_key(kind, order_id))
+
+async def schedule_upcoming(db) -> int:
+    """Backfill jobs for paid orders from before reminders were scheduled per order"""
+    today = datetime.now(SERVICE_TIMEZONE).strftime('%Y-%m-%d')
+    scheduled = 0
+    async for order in db.quotes.find({'status': 'paid', 'date': {'$gte': today}}, ORDER_FIELDS).batch_size(BATCH_SIZE):
+        scheduled += await schedule_for_order(db, order, replace=False)
+    logger.info(f"Scheduled {scheduled} reminder jobs for upcoming orders")
+    return scheduled
+
+async def _send_one(db, kind: str, payload: dict):
+    order = await db.quotes.find_one({'id': payload['order_id'], 'status': 'paid'}, ORDER_FIELDS)
+    # Cancelled, started or rebooked since the job was scheduled
+    if not order or (order.get('date'), order.get('time')) != (payload.get('date'), payload.get('time')):
+        return
+    await _process_batch(db, kind, [order])
+
+@delayed_jobs.handler('reminder_24h')
+async def reminder_24h_job(db, payload: dict):
+    await _send_one(db, '24h', payload)
+
+@delayed_jobs.handler('reminder_1h')
+async def reminder_1h_job(db, payload: dict):
+    await _send_one(db, '1h', payload)
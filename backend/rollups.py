@@ -0,0 +1,182 @@
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional
+from pymongo import ASCENDING, UpdateOne
+import rebuilds
+
+logger = logging.getLogger(__name__)
+
+# Pre-aggregated platform metrics. One document per (granularity, bucket)
+# holding a counter per metric:
+#   {granularity: 'hour', bucket: '2026-10-19T14', orders_created: 3, gmv: 420.0, ...}
+#   {granularity: 'day',  bucket: '2026-10-19',    orders_created: 41, ...}
+# Writers $inc the hour and day documents; `rebuild` recomputes them from
+# the source collections as a fenced rebuild (see rebuilds.py).
+COLLECTION = 'metric_rollups'
+METRICS = ['orders_created', 'orders_completed', 'gmv', 'platform_fee', 'new_mechanics', 'new_clients']
+GRANULARITIES = {'hour': 13, 'day': 10}  # bucket = ISO timestamp prefix of this length
+PLATFORM_FEE_RATE = 0.15
+MAX_POINTS = 2000
+
+async def ensure_indexes(db):
+    """Unique bucket key, which also serves range reads"""
+    await db[COLLECTION].create_index([('granularity', ASCENDING), ('bucket', ASCENDING)], unique=True)
+
+def _buckets(ts: str) -> Dict[str, str]:
+    return {granularity: ts[:length] for granularity, length in GRANULARITIES.items()}
+
+async def record(db, increments: Dict[str, float], ts: Optional[str] = None):
+    """Add to the hour and day buckets of `ts` (never raises)"""
+    try:
+        ts = ts or datetime.now(timezone.utc).isoformat()
+        now = datetime.now(timezone.utc).isoformat()
+        rebuild = await rebuilds.current(db, 'metric_rollups')
+        increments = rebuilds.fenced(increments, ts, rebuild and rebuild['fence'])
+        await db[COLLECTION].bulk_write([
+            UpdateOne(
+                {'granularity': granularity, 'bucket': bucket},
+                {'$inc': increments, '$set': {'updated_at': now}},
+                upsert=True
+            )
+            for granularity, bucket in _buckets(ts).items()
+        ], ordered=False)
+    except Exception as e:
+        logger.error(f"Error recording rollup {increments}: {str(e)}")
+
+async def record_order_created(db, ts: Optional[str] = None):
+    await record(db, {'orders_created': 1}, ts)
+
+async def record_order_completed(db, final_price: float, ts: Optional[str] = None):
+    gross = float(final_price or 0)
+    await record(db, {
+        'orders_completed': 1,
+        'gmv': gross,
+        'platform_fee': round(gross * PLATFORM_FEE_RATE, 2)
+    }, ts)
+
+async def record_signup(db, user_type: str, ts: Optional[str] = None):
+    metric = {'mechanic': 'new_mechanics', 'client': 'new_clients'}.get(user_type)
+    if metric:
+        await record(db, {metric: 1}, ts)
+
+def _hour_group(field: str, match: dict, fields: Dict[str, dict]) -> List[dict]:
+    """Pipeline grouping `match`ed documents by the hour prefix of a timestamp field"""
+    return [
+        {'$match': match},
+        {'$group': {'_id': {'$substrCP': [f'${field}', 0, GRANULARITIES['hour']]}, **fields}}
+    ]
+
+async def rebuild(db, since: Optional[str] = None) -> int:
+    """Recompute all buckets from `since` (a date, default everything)"""
+    since = (since or '')[:10]
+    scope = {'bucket': {'$gte': since}} if since else {}
+    written = await rebuilds.run(
+        db, 'metric_rollups', COLLECTION, scope, {metric: 0 for metric in METRICS},
+        lambda fence: _recount(db, since, fence)
+    )
+    logger.info(f"Rebuilt {written} rollup buckets since {since or 'the beginning'}")
+    return written
+
+async def _recount(db, since: str, fence: str) -> List[rebuilds.Bucket]:
+    window = {'$gte': since, '$lt': fence}
+    hours: Dict[str, Dict[str, float]] = {}
+
+    def add(bucket: str, values: dict):
+        if not bucket:
+            return
+        target = hours.setdefault(bucket, {})
+        for metric, value in values.items():
+            target[metric] = target.get(metric, 0) + value
+
+    created = db.quotes.aggregate(_hour_group(
+        'created_at', {'created_at': window},
+        {'orders_created': {'$sum': 1}}
+    ), allowDiskUse=True)
+    async for row in created:
+        add(row['_id'], {'orders_created': row['orders_created']})
+
+    completed = db.quotes.aggregate(_hour_group(
+        'completed_at',
+        {'status': {'$in': ['completed', 'reviewed']}, 'completed_at': window},
+        {'orders_completed': {'$sum': 1}, 'gmv': {'$sum': {'$ifNull': ['$final_price', 0]}}}
+    ), allowDiskUse=True)
+    async for row in completed:
+        add(row['_id'], {
+            'orders_completed': row['orders_completed'],
+            'gmv': row['gmv'],
+            'platform_fee': round(row['gmv'] * PLATFORM_FEE_RATE, 2)
+        })
+
+    signups = db.users.aggregate([
+        {'$match': {'created_at': window, 'user_type': {'$in': ['mechanic', 'client']}}},
+        {'$group': {
+            '_id': {
+                'bucket': {'$substrCP': ['$created_at', 0, GRANULARITIES['hour']]},
+                'user_type': '$user_type'
+            },
+            'n': {'$sum': 1}
+        }}
+    ], allowDiskUse=True)
+    async for row in signups:
+        metric = 'new_mechanics' if row['_id']['user_type'] == 'mechanic' else 'new_clients'
+        add(row['_id']['bucket'], {metric: row['n']})
+
+    # Days are derived from hours, no second scan
+    days: Dict[str, Dict[str, float]] = {}
+    for bucket, values in hours.items():
+        target = days.setdefault(bucket[:GRANULARITIES['day']], {})
+        for metric, value in values.items():
+            target[metric] = target.get(metric, 0) + value
+
+    return [
+        ({'granularity': granularity, 'bucket': bucket}, values)
+        for granularity, buckets in (('hour', hours), ('day', days))
+        for bucket, values in buckets.items()
+    ]
+
+def _utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+def _bucket_range(granularity: str, start: datetime, end: datetime) -> List[str]:
+    start, end = _utc(start), _utc(end)
+    step = timedelta(hours=1) if granularity == 'hour' else timedelta(days=1)
+    length = GRANULARITIES[granularity]
+    current = start.replace(minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        current = current.replace(hour=0)
+    buckets = []
+    while current <= end and len(buckets) <= MAX_POINTS:
+        buckets.append(current.isoformat()[:length])
+        current += step
+    return buckets
+
+async def get_series(db, granularity: str, start: datetime, end: datetime,
+                     metrics: Optional[List[str]] = None) -> dict:
+    """Zero-filled series for a range, read with one indexed query"""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity: {granularity}")
+    metrics = metrics or METRICS
+    unknown = [m for m in metrics if m not in METRICS]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {', '.join(unknown)}")
+
+    buckets = _bucket_range(granularity, start, end)
+    if len(buckets) > MAX_POINTS:
+        raise ValueError(f"Range too large: more than {MAX_POINTS} {granularity} buckets")
+    if not buckets:
+        return {'granularity': granularity, 'buckets': [], 'series': {m: [] for m in metrics}, 'totals': {m: 0 for m in metrics}}
+
+    projection = {'_id': 0, 'bucket': 1, **{m: 1 for m in metrics}}
+    docs = await db[COLLECTION].find(
+        {'granularity': granularity, 'bucket': {'$gte': buckets[0], '$lte': buckets[-1]}},
+        projection
+    ).to_list(len(buckets))
+    by_bucket = {doc['bucket']: doc for doc in docs}
+
+    series = {m: [by_bucket.get(b, {}).get(m, 0) for b in buckets] for m in metrics}
+    return {
+        'granularity': granularity,
+        'buckets': buckets,
+        'series': series,
+        'totals': {m: round(sum(values), 2) for m, values in series.items()}
+    }
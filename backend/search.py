@@ -0,0 +1,214 @@
+import base64
+import json
+import logging
+from typing import List, Optional
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, UpdateOne
+from geolocation import calculate_travel_fee
+
+logger = logging.getLogger(__name__)
+
+# Mechanic directory search: filters, sort, page and facet counts in one
+# aggregation. Mechanic coordinates are mirrored into a GeoJSON `geo`
+# field for the 2dsphere index: every write of latitude/longitude goes
+# through `geo_fields`, and `sync_geo` repairs mechanics written elsewhere.
+MAX_LIMIT = 50
+DEFAULT_MAX_DISTANCE_KM = 20
+
+# sort name -> (field, direction); ties broken by id ascending
+SORTS = {
+    'ranking': ('ranking_score', -1),
+    'rating': ('rating', -1),
+    'experience': ('years_experience', -1),
+    'distance': ('distance_km', 1)
+}
+
+RATING_BUCKETS = [0, 3, 4, 4.5, 5.01]
+EXPERIENCE_BUCKETS = [0, 2, 5, 10, 100]
+
+PUBLIC_FIELDS = {
+    '_id': 0, 'id': 1, 'name': 1, 'rating': 1, 'review_count': 1, 'specialties': 1, 'location': 1,
+    'years_experience': 1, 'mobile_service': 1, 'workshop_service': 1, 'ranking_score': 1,
+    'distance_km': 1, '_sort': 1
+}
+
+class SearchError(Exception):
+    pass
+
+def geo_fields(latitude: float, longitude: float) -> dict:
+    """Coordinates plus their GeoJSON mirror, for one $set"""
+    return {
+        'latitude': latitude,
+        'longitude': longitude,
+        'geo': {'type': 'Point', 'coordinates': [longitude, latitude]}
+    }
+
+async def sync_geo(db, mechanic_id: Optional[str] = None) -> int:
+    """Mirror coordinates into `geo` where it is missing or stale"""
+    query = {
+        'user_type': 'mechanic',
+        'latitude': {'$type': 'number'},
+        'longitude': {'$type': 'number'},
+        '$or': [
+            {'geo': {'$exists': False}},
+            {'$expr': {'$or': [
+                {'$ne': [{'$arrayElemAt': ['$geo.coordinates', 0]}, '$longitude']},
+                {'$ne': [{'$arrayElemAt': ['$geo.coordinates', 1]}, '$latitude']}
+            ]}}
+        ]
+    }
+    if mechanic_id:
+        query['id'] = mechanic_id
+    ops = [
+        # Only while the coordinates are still the ones read here
+        UpdateOne(
+            {'id': user['id'], 'latitude': user['latitude'], 'longitude': user['longitude']},
+            {'$set': {'geo': geo_fields(user['latitude'], user['longitude'])['geo']}}
+        )
+        async for user in db.users.find(query, {'_id': 0, 'id': 1, 'latitude': 1, 'longitude': 1})
+    ]
+    if ops:
+        await db.users.bulk_write(ops, ordered=False)
+    return len(ops)
+
+async def ensure_indexes(db):
+    """Geo, multikey and compound indexes behind the directory filters"""
+    await sync_geo(db)
+    await db.users.create_index([('geo', GEOSPHERE)])
+    base = [('user_type', ASCENDING), ('approval_status', ASCENDING), ('is_active', ASCENDING)]
+    await db.users.create_index(base + [('specialties', ASCENDING), ('rating', DESCENDING)])
+    await db.users.create_index(base + [('mobile_service', ASCENDING), ('workshop_service', ASCENDING), ('rating', DESCENDING)])
+    await db.users.create_index(base + [('rating', DESCENDING), ('years_experience', DESCENDING)])
+
+def encode_cursor(value, mechanic_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([value, mechanic_id]).encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        value, mechanic_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return value, mechanic_id
+    except (ValueError, TypeError):
+        raise SearchError("Invalid cursor")
+
+def _filters(specialties, mobile_service, workshop_service, min_rating, min_experience) -> dict:
+    match = {'user_type': 'mechanic', 'approval_status': 'approved', 'is_active': True}
+    if specialties:
+        match['specialties'] = {'$in': specialties}
+    if mobile_service is not None:
+        match['mobile_service'] = mobile_service
+    if workshop_service is not None:
+        match['workshop_service'] = workshop_service
+    if min_rating is not None:
+        match['rating'] = {'$gte': min_rating}
+    if min_experience is not None:
+        match['years_experience'] = {'$gte': min_experience}
+    return match
+
+def _keyset(direction: int, cursor: Optional[str]) -> List[dict]:
+    if not cursor:
+        return []
+    value, mechanic_id = decode_cursor(cursor)
+    op = '$lt' if direction < 0 else '$gt'
+    return [{'$match': {'$or': [
+        {'_sort': {op: value}},
+        {'_sort': value, 'id': {'$gt': mechanic_id}}
+    ]}}]
+
+async def search_mechanics(
+    db,
+    specialties: Optional[List[str]] = None,
+    mobile_service: Optional[bool] = None,
+    workshop_service: Optional[bool] = None,
+    min_rating: Optional[float] = None,
+    min_experience: Optional[int] = None,
+    latitude: Optional[float] = None,
+    longitude: Optional[float] = None,
+    max_distance_km: Optional[float] = None,
+    sort: str = 'ranking',
+    cursor: Optional[str] = None,
+    limit: int = 20
+) -> dict:
+    """One page of matching mechanics plus facet counts over all matches"""
+    if sort not in SORTS:
+        raise SearchError(f"Unknown sort: {sort}")
+    has_location = latitude is not None and longitude is not None
+    if sort == 'distance' and not has_location:
+        raise SearchError("Sorting by distance requires latitude and longitude")
+    limit = min(max(limit, 1), MAX_LIMIT)
+
+    match = _filters(specialties, mobile_service, workshop_service, min_rating, min_experience)
+    if has_location:
+        # $geoNear must come first; it applies the filters through the geo index
+        pipeline = [
+            {'$geoNear': {
+                'near': {'type': 'Point', 'coordinates': [longitude, latitude]},
+                'distanceField': 'distance_m',
+                'maxDistance': (max_distance_km or DEFAULT_MAX_DISTANCE_KM) * 1000,
+                'query': match,
+                'spherical': True,
+                'key': 'geo'
+            }},
+            {'$set': {'distance_km': {'$round': [{'$divide': ['$distance_m', 1000]}, 2]}}}
+        ]
+    else:
+        pipeline = [{'$match': match}]
+
+    field, direction = SORTS[sort]
+    # Missing values sort last in both directions
+    missing = -1 if direction < 0 else float('inf')
+    pipeline.append({'$set': {'_sort': {'$ifNull': [f'${field}', missing]}}})
+
+    pipeline.append({'$facet': {
+        'results': _keyset(direction, cursor) + [
+            {'$sort': {'_sort': direction, 'id': 1}},
+            {'$limit': limit + 1},
+            {'$project': PUBLIC_FIELDS}
+        ],
+        'total': [{'$count': 'n'}],
+        'specialties': [
+            {'$unwind': '$specialties'},
+            {'$group': {'_id': '$specialties', 'count': {'$sum': 1}}},
+            {'$sort': {'count': -1, '_id': 1}}
+        ],
+        'service_modes': [{'$group': {
+            '_id': None,
+            'mobile': {'$sum': {'$cond': [{'$eq': ['$mobile_service', True]}, 1, 0]}},
+            'workshop': {'$sum': {'$cond': [{'$eq': ['$workshop_service', True]}, 1, 0]}}
+        }}],
+        'rating': [{'$bucket': {
+            'groupBy': {'$ifNull': ['$rating', -1]},
+            'boundaries': RATING_BUCKETS,
+            'default': 'unrated',
+            'output': {'count': {'$sum': 1}}
+        }}],
+        'experience': [{'$bucket': {
+            'groupBy': {'$ifNull': ['$years_experience', -1]},
+            'boundaries': EXPERIENCE_BUCKETS,
+            'default': 'unknown',
+            'output': {'count': {'$sum': 1}}
+        }}]
+    }})
+
+    rows = await db.users.aggregate(pipeline).to_list(1)
+    facet = rows[0] if rows else {}
+
+    results = facet.get('results', [])
+    has_more = len(results) > limit
+    results = results[:limit]
+    next_cursor = encode_cursor(results[-1]['_sort'], results[-1]['id']) if has_more else None
+    for mechanic in results:
+        mechanic.pop('_sort', None)
+        if 'distance_km' in mechanic:
+            mechanic['travel_fee'] = calculate_travel_fee(mechanic['distance_km'])
+
+    modes = (facet.get('service_modes') or [{}])[0]
+    return {
+        'results': results,
+        'next_cursor': next_cursor,
+        'total': facet['total'][0]['n'] if facet.get('total') else 0,
+        'facets': {
+            'specialties': [{'value': row['_id'], 'count': row['count']} for row in facet.get('specialties', [])],
+            'service_modes': {'mobile': modes.get('mobile', 0), 'workshop': modes.get('workshop', 0)},
+            'rating': [{'min': row['_id'], 'count': row['count']} for row in facet.get('rating', [])],
+            'experience': [{'min_years': row['_id'], 'count': row['count']} for row in facet.get('experience', [])]
+        }
+    }
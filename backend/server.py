@@ -8,6 +8,7 @@ import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional
+import uuid
 from uuid import uuid4
 from datetime import datetime, timezone, timedelta
 import random
@@ -20,21 +21,52 @@ load_dotenv(ROOT_DIR / '.env', override=False)
 # Import models
 from models import (
     Vehicle, VehicleResponse, VehicleCreate, Quote, QuoteCreate, QuoteResponse, QuoteUpdateStatus,
-    User, UserCreate, UserLogin, UserResponse, Payment, PaymentCreate,
-    Order, OrderCreate, Review, ReviewCreate, MechanicQuote, MechanicQuoteCreate
+    User, UserCreate, UserUpdate, UserLogin, UserResponse, Payment, PaymentCreate,
+    Order, OrderCreate, Review, ReviewCreate, MechanicQuote, MechanicQuoteCreate,
+    MechanicAvailability, AvailabilityUpdate, BlockedSlot, BlockedSlotCreate, LocationUpdate
 )
 from vehicle_mock_db import search_vehicle_by_plate
 from brasil_placa_api import search_brasil_placa, validate_brasil_plate
 from auth import hash_password, verify_password, create_access_token, decode_token
-from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
-from email_service import email_new_order_to_mechanic, email_quote_to_client, email_payment_confirmed
+from emergentintegrations.payments.stripe.checkout import CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
+from email_service import email_new_order_to_mechanics, email_quote_to_client
+from order_events import ensure_indexes as ensure_order_event_indexes, record_order_event, get_order_timeline, read_events
+import availability
+import payments
+import ledger
+import earnings
+import payouts
+import admin_stats
+import rollups
+import exports
+import ratings
+import ranking
+import search
+import notifications
+import events
+import outbox
+from outbox import outbox_sender
+import sms_service
+import reminders
+import delayed_jobs
+from delayed_jobs import delayed_queue
+from notifications import notifier
+from idempotency import run_idempotent, request_fingerprint, ensure_indexes as ensure_idempotency_indexes
+from stripe_service import get_stripe_checkout, fetch_checkout_status, announce_paid, checkout_topic, StripeNotConfigured
+from pubsub import bus
+from webhook_queue import webhook_queue, ensure_indexes as ensure_webhook_indexes
 from fastapi import UploadFile, Form
+from fastapi.responses import StreamingResponse
+from pymongo.errors import DuplicateKeyError
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+# Unanswered quotes reopen the order after this long
+QUOTE_EXPIRY_HOURS = int(os.environ.get('QUOTE_EXPIRY_HOURS', '48'))
+
 # Logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -76,7 +108,8 @@ app.add_middleware(
 )
 
 # Socket.IO integration
-from socket_manager import sio
+from socket_manager import sio, publish_order_feed, ensure_feed_indexes
+from geolocation import normalize_area
 import socketio
 socket_app = socketio.ASGIApp(sio, app)
 
@@ -84,6 +117,69 @@ socket_app = socketio.ASGIApp(sio, app)
 from scheduler import start_scheduler
 start_scheduler()
 
+@app.on_event("startup")
+async def create_indexes():
+    """Create indexes used by the API and background jobs"""
+    # One module at a time: a failing index (e.g. a unique index over
+    # existing duplicates) must not skip every module after it
+    index_builders = [
+        ("order_events", ensure_order_event_indexes),
+        ("order_feed", ensure_feed_indexes),
+        ("availability", availability.ensure_indexes),
+        ("payments", payments.ensure_indexes),
+        ("idempotency", ensure_idempotency_indexes),
+        ("webhook_queue", ensure_webhook_indexes),
+        ("ledger", ledger.ensure_indexes),
+        ("earnings", earnings.ensure_indexes),
+        ("payouts", payouts.ensure_indexes),
+        ("rollups", rollups.ensure_indexes),
+        ("exports", exports.ensure_indexes),
+        ("ratings", ratings.ensure_indexes),
+        ("ranking", ranking.ensure_indexes),
+        ("search", search.ensure_indexes),
+        ("notifications", notifications.ensure_indexes),
+        ("outbox", outbox.ensure_indexes),
+        ("sms_service", sms_service.ensure_indexes),
+        ("reminders", reminders.ensure_indexes),
+        ("delayed_jobs", delayed_jobs.ensure_indexes),
+    ]
+    for name, ensure_indexes in index_builders:
+        try:
+            await ensure_indexes(db)
+        except Exception as e:
+            logger.error(f"Error creating {name} indexes: {str(e)}")
+
+@app.on_event("startup")
+async def run_migrations():
+    """One-shot data migrations; each module records what it has applied"""
+    migrations = [
+        ("notifications", notifications.migrate),
+    ]
+    for name, migrate in migrations:
+        try:
+            await migrate(db)
+        except Exception as e:
+            logger.error(f"Error migrating {name}: {str(e)}")
+
+@app.on_event("startup")
+async def start_background_workers():
+    """Start in-process background workers"""
+    await webhook_queue.start(db)
+    await notifier.start(db)
+    await outbox_sender.start(db)
+    await delayed_queue.start(db)
+    try:
+        await reminders.schedule_upcoming(db)
+    except Exception as e:
+        logger.error(f"Error scheduling upcoming reminders: {str(e)}")
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    await webhook_queue.stop()
+    await notifier.stop()
+    await outbox_sender.stop()
+    await delayed_queue.stop()
+
 # ===== HEALTH CHECK ENDPOINTS (for Kubernetes) =====
 @app.get("/health")
 async def health_check_root():
@@ -158,7 +254,8 @@ async def register(user_data: UserCreate):
             password_hash=hashed_password,
             name=user_data.name,
             phone=user_data.phone,
-            user_type=user_data.user_type
+            user_type=user_data.user_type,
+            locale=user_data.locale
         )
         
         # Convert to dict and handle datetime
@@ -167,6 +264,7 @@ async def register(user_data: UserCreate):
         
         # Insert into database
         await db.users.insert_one(user_dict)
+        await rollups.record_signup(db, user.user_type, user_dict['created_at'])
         
         # Create JWT token
         token = create_access_token({"user_id": user.id, "user_type": user.user_type})
@@ -183,6 +281,7 @@ async def register(user_data: UserCreate):
                 phone=user.phone,
                 user_type=user.user_type,
                 is_active=user.is_active,
+                locale=user.locale,
                 rating=user.rating,
                 review_count=user.review_count
             ),
@@ -228,6 +327,7 @@ async def login(credentials: UserLogin):
                 phone=user.phone,
                 user_type=user.user_type,
                 is_active=user.is_active,
+                locale=user.locale,
                 rating=user.rating,
                 review_count=user.review_count
             ),
@@ -251,11 +351,40 @@ async def get_me(current_user: User = Depends(get_current_user)):
             phone=current_user.phone,
             user_type=current_user.user_type,
             is_active=current_user.is_active,
+            locale=current_user.locale,
             rating=current_user.rating,
             review_count=current_user.review_count
         )
     }
 
+@api_router.put("/auth/me")
+async def update_me(update: UserUpdate, current_user: User = Depends(get_current_user)):
+    """Update name, phone or notification language"""
+    try:
+        fields = update.model_dump(exclude_none=True)
+        if fields:
+            await db.users.update_one({"id": current_user.id}, {"$set": fields})
+        user = current_user.model_copy(update=fields)
+        
+        return {
+            "success": True,
+            "data": UserResponse(
+                id=user.id,
+                email=user.email,
+                name=user.name,
+                phone=user.phone,
+                user_type=user.user_type,
+                is_active=user.is_active,
+                locale=user.locale,
+                rating=user.rating,
+                review_count=user.review_count
+            ),
+            "message": "Profile updated"
+        }
+    except Exception as e:
+        logger.error(f"Error updating profile: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # ===== VEHICLE ENDPOINTS =====
 
 @api_router.get("/vehicle/{plate}")
@@ -364,8 +493,18 @@ async def get_my_vehicles(current_user: User = Depends(get_current_user)):
 # ===== QUOTE/ORDER ENDPOINTS =====
 
 @api_router.post("/quotes")
-async def create_quote(quote_data: QuoteCreate, current_user: User = Depends(get_current_user)):
+async def create_quote(
+    quote_data: QuoteCreate,
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
+):
     """Create a new service quote/order"""
+    return await run_idempotent(
+        db, idempotency_key, current_user.id, "quotes", request_fingerprint(quote_data),
+        lambda: _create_quote(quote_data, current_user)
+    )
+
+async def _create_quote(quote_data: QuoteCreate, current_user: User):
     try:
         # Get vehicle info
         vehicle = await db.vehicles.find_one({"id": quote_data.vehicle_id}, {"_id": 0})
@@ -385,6 +524,7 @@ async def create_quote(quote_data: QuoteCreate, current_user: User = Depends(get
             description=quote_data.description,
             date=quote_data.date,
             time=quote_data.time,
+            estimated_duration_minutes=quote_data.estimated_duration_minutes,
             location_type=quote_data.location_type,
             status="pending"
         )
@@ -392,25 +532,23 @@ async def create_quote(quote_data: QuoteCreate, current_user: User = Depends(get
         order_dict = order.model_dump()
         order_dict['created_at'] = order_dict['created_at'].isoformat()
         order_dict['updated_at'] = order_dict['updated_at'].isoformat()
+        order_dict['area'] = normalize_area(quote_data.location)
         
         await db.quotes.insert_one(order_dict)
+        await record_order_event(db, order.id, "pending", current_user.id, current_user.user_type)
+        await rollups.record_order_created(db, order_dict['created_at'])
+        order_dict.pop('_id', None)
+        await publish_order_feed("new", order_dict)
         
         logger.info(f"Quote created: {order.id}")
         
         # Notify active mechanics (simple matching - can be improved with geolocation)
         mechanics = await db.users.find(
             {"user_type": "mechanic", "is_active": True, "approval_status": "approved"},
-            {"_id": 0, "email": 1, "name": 1}
+            {"_id": 0, "email": 1, "name": 1, "locale": 1}
         ).to_list(10)
         
-        for mechanic in mechanics:
-            email_new_order_to_mechanic(
-                mechanic['email'],
-                mechanic['name'],
-                order.id,
-                quote_data.service,
-                quote_data.location
-            )
+        await outbox.enqueue(db, email_new_order_to_mechanics(mechanics, order.id, quote_data.service, quote_data.location))
         
         return {
             "success": True,
@@ -424,9 +562,13 @@ async def create_quote(quote_data: QuoteCreate, current_user: User = Depends(get
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.post("/orders")
-async def create_order(order_data: OrderCreate, current_user: User = Depends(get_current_user)):
+async def create_order(
+    order_data: OrderCreate,
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
+):
     """Create order (alias for quotes for compatibility)"""
-    return await create_quote(order_data, current_user)
+    return await create_quote(order_data, current_user, idempotency_key)
 
 @api_router.get("/quotes/my-quotes")
 async def get_my_quotes(current_user: User = Depends(get_current_user)):
@@ -499,6 +641,27 @@ async def update_quote_status(
             {"id": quote_id},
             {"$set": update_fields}
         )
+        cancelled_by = ranking.cancelled_by_mechanic(quote, update_data.status, current_user.id)
+        await record_order_event(
+            db, quote_id, update_data.status, current_user.id, current_user.user_type,
+            data={"cancelled_mechanic_id": cancelled_by} if cancelled_by else None
+        )
+        if cancelled_by:
+            await ranking.record_cancel(db, cancelled_by)
+        if quote.get("status") == "pending" and update_data.status != "pending":
+            await publish_order_feed("taken", quote)
+        elif quote.get("status") != "pending" and update_data.status == "pending":
+            await publish_order_feed("reopened", {**quote, **update_fields})
+        if update_data.status == "quoted":
+            await delayed_jobs.schedule(
+                db, "quote_expiry", f"quote_expiry:{quote_id}",
+                datetime.now(timezone.utc) + timedelta(hours=QUOTE_EXPIRY_HOURS),
+                {"order_id": quote_id, "mechanic_id": update_fields.get("mechanic_id", quote.get("mechanic_id"))}
+            )
+        if update_data.status not in availability.BOOKED_STATUSES:
+            await availability.release(db, quote.get("mechanic_id"), quote.get("date"), quote_id)
+        availability.invalidate(quote.get("mechanic_id"), quote.get("date"))
+        availability.invalidate(update_fields.get("mechanic_id"), quote.get("date"))
         
         # Fetch updated quote
         updated_quote = await db.quotes.find_one({"id": quote_id}, {"_id": 0})
@@ -516,11 +679,45 @@ async def update_quote_status(
         logger.error(f"Error updating quote: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/quotes/{quote_id}/timeline")
+async def get_quote_timeline(quote_id: str, current_user: User = Depends(get_current_user)):
+    """Get status history of an order from the event log"""
+    try:
+        quote = await db.quotes.find_one({"id": quote_id}, {"_id": 0, "client_id": 1, "mechanic_id": 1})
+        if not quote:
+            raise HTTPException(status_code=404, detail="Quote not found")
+        
+        if current_user.user_type != "admin" and current_user.id not in (quote.get("client_id"), quote.get("mechanic_id")):
+            raise HTTPException(status_code=403, detail="Not authorized")
+        
+        events = await get_order_timeline(db, quote_id)
+        
+        return {
+            "success": True,
+            "data": events,
+            "message": f"{len(events)} events found"
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching timeline: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # ===== PAYMENT ENDPOINTS =====
 
 @api_router.post("/payments")
-async def create_payment(payment_data: PaymentCreate, current_user: User = Depends(get_current_user)):
+async def create_payment(
+    payment_data: PaymentCreate,
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
+):
     """Process payment for quote"""
+    return await run_idempotent(
+        db, idempotency_key, current_user.id, "payments", request_fingerprint(payment_data),
+        lambda: _create_payment(payment_data, current_user)
+    )
+
+async def _create_payment(payment_data: PaymentCreate, current_user: User):
     try:
         # Find quote
         quote = await db.quotes.find_one({"id": payment_data.quote_id}, {"_id": 0})
@@ -561,45 +758,23 @@ async def create_payment(payment_data: PaymentCreate, current_user: User = Depen
             status="completed"
         )
         
-        payment_dict = payment.model_dump()
-        payment_dict['created_at'] = payment_dict['created_at'].isoformat()
-        await db.payments.insert_one(payment_dict)
-        
         # Update quote status
-        update_data = {
-            "status": new_status,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }
+        update_data = {"status": new_status}
         
         if payment_data.payment_type == "prebooking":
             update_data["prebooking_paid"] = True
         
-        await db.quotes.update_one({"id": payment_data.quote_id}, {"$set": update_data})
-        
-        # Update mechanic wallet if final payment
-        if payment_data.payment_type == "final" and quote.get("mechanic_id"):
-            mechanic_wallet = await db.wallets.find_one({"mechanic_id": quote["mechanic_id"]}, {"_id": 0})
-            
-            if mechanic_wallet:
-                await db.wallets.update_one(
-                    {"mechanic_id": quote["mechanic_id"]},
-                    {
-                        "$inc": {
-                            "pending_balance": mechanic_earnings,
-                            "total_earned": mechanic_earnings
-                        }
-                    }
-                )
-            else:
-                from models import Wallet
-                wallet = Wallet(
-                    mechanic_id=quote["mechanic_id"],
-                    pending_balance=mechanic_earnings,
-                    total_earned=mechanic_earnings
-                )
-                wallet_dict = wallet.model_dump()
-                wallet_dict['updated_at'] = wallet_dict['updated_at'].isoformat()
-                await db.wallets.insert_one(wallet_dict)
+        # Payment, order and wallet are written in one transaction
+        await payments.apply_payment(
+            db, client, payment, update_data,
+            mechanic_id=quote.get("mechanic_id") if payment_data.payment_type == "final" else None
+        )
+        await record_order_event(
+            db, payment_data.quote_id, new_status, current_user.id, current_user.user_type,
+            data={"payment_id": payment.id, "payment_type": payment_data.payment_type, "amount": payment_data.amount}
+        )
+        if new_status == "paid":
+            await reminders.schedule_for_order(db, quote)
         
         logger.info(f"Payment processed: {payment.id}")
         
@@ -625,12 +800,12 @@ async def create_payment(payment_data: PaymentCreate, current_user: User = Depen
 
 @api_router.get("/mechanics")
 async def list_mechanics():
-    """List all active mechanics"""
+    """List active mechanics, best ranked first"""
     try:
         mechanics = await db.users.find(
             {"user_type": "mechanic", "is_active": True},
             {"_id": 0, "password_hash": 0}
-        ).to_list(100)
+        ).sort([("ranking_score", -1), ("id", 1)]).limit(100).to_list(100)
         
         return {
             "success": True,
@@ -641,6 +816,50 @@ async def list_mechanics():
         logger.error(f"Error listing mechanics: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/mechanics/search")
+async def search_mechanics(
+    specialties: Optional[str] = None,
+    mobile_service: Optional[bool] = None,
+    workshop_service: Optional[bool] = None,
+    min_rating: Optional[float] = None,
+    min_experience: Optional[int] = None,
+    latitude: Optional[float] = None,
+    longitude: Optional[float] = None,
+    max_distance_km: Optional[float] = None,
+    sort: str = "ranking",
+    cursor: Optional[str] = None,
+    limit: int = 20
+):
+    """Filter the mechanic directory with facet counts (pass next_cursor as `cursor`)"""
+    try:
+        result = await search.search_mechanics(
+            db,
+            specialties=specialties.split(",") if specialties else None,
+            mobile_service=mobile_service,
+            workshop_service=workshop_service,
+            min_rating=min_rating,
+            min_experience=min_experience,
+            latitude=latitude,
+            longitude=longitude,
+            max_distance_km=max_distance_km,
+            sort=sort,
+            cursor=cursor,
+            limit=limit
+        )
+        
+        return {
+            "success": True,
+            "data": result["results"],
+            "facets": result["facets"],
+            "total": result["total"],
+            "next_cursor": result["next_cursor"]
+        }
+    except search.SearchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error searching mechanics: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @api_router.get("/mechanics/wallet")
 async def get_wallet(current_user: User = Depends(get_current_user)):
     """Get mechanic wallet"""
@@ -655,7 +874,12 @@ async def get_wallet(current_user: User = Depends(get_current_user)):
             wallet = Wallet(mechanic_id=current_user.id)
             wallet_dict = wallet.model_dump()
             wallet_dict['updated_at'] = wallet_dict['updated_at'].isoformat()
-            await db.wallets.insert_one(wallet_dict)
+            # Upsert: a concurrent payment may create the wallet first
+            await db.wallets.update_one(
+                {"mechanic_id": current_user.id},
+                {"$setOnInsert": wallet_dict},
+                upsert=True
+            )
             return {
                 "success": True,
                 "data": wallet,
@@ -673,48 +897,79 @@ async def get_wallet(current_user: User = Depends(get_current_user)):
         logger.error(f"Error fetching wallet: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-# ===== ADMIN ENDPOINTS =====
-
-async def require_admin(current_user: User = Depends(get_current_user)):
-    """Ensure user is admin"""
-    if current_user.user_type != "admin":
-        raise HTTPException(status_code=403, detail="Admin access required")
-    return current_user
+@api_router.get("/mechanics/wallet/balance")
+async def get_wallet_balance(at: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    """Ledger balance now, or at a point in time (ISO timestamp)"""
+    try:
+        if current_user.user_type != "mechanic":
+            raise HTTPException(status_code=403, detail="Only mechanics can view wallet")
+        
+        balance = await ledger.get_balance(db, current_user.id, at)
+        
+        return {
+            "success": True,
+            "data": balance
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching balance: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.get("/admin/stats")
-async def get_admin_stats(admin: User = Depends(require_admin)):
-    """Get platform statistics"""
+@api_router.get("/mechanics/wallet/ledger")
+async def get_wallet_ledger(before: Optional[str] = None, limit: int = 50, current_user: User = Depends(get_current_user)):
+    """Wallet ledger entries, newest first (pass next_cursor as `before`)"""
     try:
-        total_users = await db.users.count_documents({})
-        total_mechanics = await db.users.count_documents({"user_type": "mechanic"})
-        total_clients = await db.users.count_documents({"user_type": "client"})
-        total_quotes = await db.quotes.count_documents({})
-        completed_quotes = await db.quotes.count_documents({"status": "completed"})
+        if current_user.user_type != "mechanic":
+            raise HTTPException(status_code=403, detail="Only mechanics can view wallet")
         
-        # Calculate total revenue
-        payments = await db.payments.find({}, {"_id": 0, "amount": 1}).to_list(10000)
-        total_revenue = sum(p.get("amount", 0) for p in payments)
+        limit = min(max(limit, 1), 200)
+        cursor = None
+        if before:
+            try:
+                cursor = exports.decode_cursor(before)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+        
+        entries = await ledger.list_entries(db, current_user.id, cursor, limit + 1)
+        has_more = len(entries) > limit
+        entries = entries[:limit]
         
         return {
             "success": True,
-            "data": {
-                "total_users": total_users,
-                "total_mechanics": total_mechanics,
-                "total_clients": total_clients,
-                "total_quotes": total_quotes,
-                "completed_quotes": completed_quotes,
-                "total_revenue": total_revenue
-            }
+            "data": entries,
+            "next_cursor": exports.encode_cursor(entries[-1]["ts"], entries[-1]["id"]) if has_more else None
         }
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error fetching stats: {str(e)}")
+        logger.error(f"Error fetching ledger: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# ===== ADMIN ENDPOINTS =====
+
+async def require_admin(current_user: User = Depends(get_current_user)):
+    """Ensure user is admin"""
+    if current_user.user_type != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
 # ===== STRIPE PAYMENT ENDPOINTS =====
 
 @api_router.post("/stripe/checkout")
-async def create_stripe_checkout(request: dict, http_request: Request, current_user: User = Depends(get_current_user)):
+async def create_stripe_checkout(
+    request: dict,
+    http_request: Request,
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
+):
     """Create Stripe checkout session"""
+    return await run_idempotent(
+        db, idempotency_key, current_user.id, "stripe_checkout", request_fingerprint(request),
+        lambda: _create_stripe_checkout(request, http_request, current_user)
+    )
+
+async def _create_stripe_checkout(request: dict, http_request: Request, current_user: User):
     try:
         # Get Stripe API key
         stripe_api_key = os.environ.get('STRIPE_API_KEY')
@@ -725,8 +980,8 @@ async def create_stripe_checkout(request: dict, http_request: Request, current_u
         host_url = str(http_request.base_url).rstrip('/')
         webhook_url = f"{host_url}/api/webhook/stripe"
         
-        # Initialize Stripe
-        stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
+        # Shared Stripe client
+        stripe_checkout = get_stripe_checkout(webhook_url)
         
         # Get order info
         order_id = request.get("order_id")
@@ -785,14 +1040,66 @@ async def create_stripe_checkout(request: dict, http_request: Request, current_u
         logger.error(f"Error creating Stripe checkout: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _refresh_checkout_status(transaction: dict, current_user: User) -> dict:
+    """Ask Stripe (cached) for a session's status and record it once paid"""
+    session_id = transaction["session_id"]
+    checkout_status: CheckoutStatusResponse = await fetch_checkout_status(session_id)
+    
+    # Update transaction if status changed
+    if checkout_status.payment_status == "paid":
+        # Only the first caller to flip the transaction updates the order
+        result = await db.payment_transactions.update_one(
+            {"session_id": session_id, "payment_status": {"$ne": "paid"}},
+            {
+                "$set": {
+                    "payment_status": "paid",
+                    "status": "complete",
+                    "updated_at": datetime.now(timezone.utc).isoformat()
+                }
+            }
+        )
+        
+        # Update order
+        order_id = transaction.get("order_id")
+        if result.modified_count and order_id:
+            await db.quotes.update_one(
+                {"id": order_id},
+                {
+                    "$set": {
+                        "prebooking_paid": True,
+                        "status": "prebooked",
+                        "updated_at": datetime.now(timezone.utc).isoformat()
+                    }
+                }
+            )
+            await record_order_event(
+                db, order_id, "prebooked", current_user.id, current_user.user_type,
+                data={"session_id": session_id}
+            )
+            
+            logger.info(f"Payment confirmed for order {order_id}")
+        announce_paid(session_id, order_id, transaction.get("user_id"))
+    
+    return {
+        "success": True,
+        "status": checkout_status.status,
+        "payment_status": checkout_status.payment_status,
+        "amount_total": checkout_status.amount_total,
+        "currency": checkout_status.currency
+    }
+
+def _paid_status_response(transaction: dict) -> dict:
+    return {
+        "success": True,
+        "status": "complete",
+        "payment_status": "paid",
+        "data": transaction
+    }
+
 @api_router.get("/stripe/status/{session_id}")
 async def get_stripe_status(session_id: str, current_user: User = Depends(get_current_user)):
     """Get Stripe checkout session status"""
     try:
-        stripe_api_key = os.environ.get('STRIPE_API_KEY')
-        if not stripe_api_key:
-            raise HTTPException(status_code=500, detail="Stripe not configured")
-        
         # Get from DB first
         transaction = await db.payment_transactions.find_one({"session_id": session_id}, {"_id": 0})
         
@@ -801,62 +1108,96 @@ async def get_stripe_status(session_id: str, current_user: User = Depends(get_cu
         
         # If already processed, return cached status
         if transaction.get("payment_status") == "paid":
-            return {
-                "success": True,
-                "status": "complete",
-                "payment_status": "paid",
-                "data": transaction
-            }
+            return _paid_status_response(transaction)
         
-        # Poll Stripe for latest status
-        host_url = "https://clickmecanico.com"  # Will be replaced in production
-        webhook_url = f"{host_url}/api/webhook/stripe"
-        stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
+        return await _refresh_checkout_status(transaction, current_user)
         
-        checkout_status: CheckoutStatusResponse = await stripe_checkout.get_checkout_status(session_id)
+    except HTTPException:
+        raise
+    except StripeNotConfigured:
+        raise HTTPException(status_code=500, detail="Stripe not configured")
+    except Exception as e:
+        logger.error(f"Error getting Stripe status: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/stripe/status/{session_id}/wait")
+async def wait_stripe_status(session_id: str, timeout: float = 25, current_user: User = Depends(get_current_user)):
+    """Long-poll: return as soon as the webhook marks the session paid.
+    
+    Without a webhook before `timeout`, falls back to one (cached) Stripe check.
+    """
+    try:
+        timeout = max(1.0, min(timeout, 55.0))
         
-        # Update transaction if status changed
-        if checkout_status.payment_status == "paid" and transaction.get("payment_status") != "paid":
-            # Update transaction
-            await db.payment_transactions.update_one(
-                {"session_id": session_id},
-                {
-                    "$set": {
-                        "payment_status": "paid",
-                        "status": "complete",
-                        "updated_at": datetime.now(timezone.utc).isoformat()
-                    }
-                }
-            )
+        # Subscribe before reading the DB so a webhook landing in between is not missed
+        async with bus.subscription(checkout_topic(session_id)) as queue:
+            transaction = await db.payment_transactions.find_one({"session_id": session_id}, {"_id": 0})
+            if not transaction:
+                raise HTTPException(status_code=404, detail="Transaction not found")
             
-            # Update order
-            order_id = transaction.get("order_id")
-            if order_id:
-                await db.quotes.update_one(
-                    {"id": order_id},
-                    {
-                        "$set": {
-                            "prebooking_paid": True,
-                            "status": "prebooked",
-                            "updated_at": datetime.now(timezone.utc).isoformat()
-                        }
-                    }
-                )
-                
-                logger.info(f"Payment confirmed for order {order_id}")
+            if transaction.get("payment_status") != "paid":
+                message = await bus.wait_for(queue, timeout)
+                if not message:
+                    return await _refresh_checkout_status(transaction, current_user)
+                transaction = await db.payment_transactions.find_one({"session_id": session_id}, {"_id": 0})
         
-        return {
-            "success": True,
-            "status": checkout_status.status,
-            "payment_status": checkout_status.payment_status,
-            "amount_total": checkout_status.amount_total,
-            "currency": checkout_status.currency
-        }
+        return _paid_status_response(transaction)
         
     except HTTPException:
         raise
+    except StripeNotConfigured:
+        raise HTTPException(status_code=500, detail="Stripe not configured")
     except Exception as e:
-        logger.error(f"Error getting Stripe status: {str(e)}")
+        logger.error(f"Error waiting for Stripe status: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/events/stream")
+async def event_stream(
+    request: Request,
+    token: Optional[str] = None,
+    last_event_id: Optional[str] = None,
+    authorization: Optional[str] = Header(None)
+):
+    """Server-Sent Events: notifications, order status and payments for the current user.
+    
+    EventSource cannot set headers, so the JWT may be passed as `token`.
+    Reconnects resume from the Last-Event-ID header.
+    """
+    if not token and authorization:
+        token = authorization.replace("Bearer ", "")
+    payload = decode_token(token) if token else None
+    if not payload or not payload.get("user_id"):
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    
+    user = await db.users.find_one({"id": payload["user_id"]}, {"_id": 0, "id": 1})
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+    
+    resume_from = request.headers.get("last-event-id") or last_event_id
+    return StreamingResponse(
+        events.stream(user["id"], resume_from, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.post("/webhook/twilio/status")
+async def twilio_status_callback(request: Request):
+    """Twilio delivery status callback for sent SMS"""
+    form = dict(await request.form())
+    url = f"{sms_service.PUBLIC_API_URL}/api/webhook/twilio/status" if sms_service.PUBLIC_API_URL else str(request.url)
+    if not sms_service.valid_signature(url, form, request.headers.get("X-Twilio-Signature", "")):
+        raise HTTPException(status_code=403, detail="Invalid signature")
+    
+    sid = form.get("MessageSid")
+    status = form.get("MessageStatus")
+    if not sid or not status:
+        raise HTTPException(status_code=400, detail="Missing MessageSid or MessageStatus")
+    
+    try:
+        await sms_service.update_status(db, sid, status, form.get("ErrorCode"))
+        return {"success": True}
+    except Exception as e:
+        logger.error(f"Error updating SMS status: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.post("/webhook/stripe")
@@ -874,50 +1215,188 @@ async def stripe_webhook(request: Request):
         if not signature:
             raise HTTPException(status_code=400, detail="Missing signature")
         
-        # Initialize Stripe
+        # Verify signature with the shared client
         host_url = str(request.base_url).rstrip('/')
-        webhook_url = f"{host_url}/api/webhook/stripe"
-        stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
-        
-        # Handle webhook
+        stripe_checkout = get_stripe_checkout(f"{host_url}/api/webhook/stripe")
         webhook_response = await stripe_checkout.handle_webhook(body, signature)
         
-        # Process based on event type
-        if webhook_response.payment_status == "paid":
-            session_id = webhook_response.session_id
-            metadata = webhook_response.metadata
-            
-            # Update transaction
-            await db.payment_transactions.update_one(
-                {"session_id": session_id},
-                {
-                    "$set": {
-                        "payment_status": "paid",
-                        "status": "complete",
-                        "webhook_received": True,
-                        "updated_at": datetime.now(timezone.utc).isoformat()
-                    }
-                }
-            )
-            
-            # Update order
-            order_id = metadata.get("order_id")
-            if order_id:
-                await db.quotes.update_one(
-                    {"id": order_id},
-                    {
-                        "$set": {
-                            "payment_status": "succeeded",
-                            "status": "paid"
-                        }
-                    }
-                )
+        # Persist and acknowledge; order/transaction updates run in the background
+        await webhook_queue.ingest(webhook_response)
         
         return {"received": True}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Webhook error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/admin/ledger/reconcile")
+async def run_ledger_reconciliation(admin: User = Depends(require_admin)):
+    """Snapshot and reconcile the wallet ledger now"""
+    try:
+        await ledger.take_snapshots(db)
+        report = await ledger.reconcile(db)
+        
+        return {
+            "success": True,
+            "data": report
+        }
+    except Exception as e:
+        logger.error(f"Error reconciling ledger: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/admin/metrics")
+async def get_metric_series(
+    start: str,
+    end: Optional[str] = None,
+    granularity: str = "day",
+    metrics: Optional[str] = None,
+    admin: User = Depends(require_admin)
+):
+    """Time series of platform metrics (hour or day buckets)"""
+    try:
+        start_dt = datetime.fromisoformat(start)
+        end_dt = datetime.fromisoformat(end) if end else datetime.now(timezone.utc)
+        series = await rollups.get_series(
+            db, granularity, start_dt, end_dt,
+            metrics.split(",") if metrics else None
+        )
+        
+        return {
+            "success": True,
+            "data": series
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error fetching metrics: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/admin/metrics/rebuild")
+async def rebuild_metric_rollups(since: Optional[str] = None, admin: User = Depends(require_admin)):
+    """Recompute metric rollups from orders and users"""
+    try:
+        buckets = await rollups.rebuild(db, since)
+        
+        return {
+            "success": True,
+            "data": {"buckets": buckets},
+            "message": "Metric rollups rebuilt"
+        }
+    except Exception as e:
+        logger.error(f"Error rebuilding metrics: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/admin/ratings/check")
+async def check_rating_counters(fix: bool = False, admin: User = Depends(require_admin)):
+    """Compare mechanic rating counters with the reviews (fix=true rewrites them)"""
+    try:
+        report = await ratings.check(db, fix=fix)
+        
+        return {
+            "success": True,
+            "data": report
+        }
+    except Exception as e:
+        logger.error(f"Error checking ratings: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/admin/notifications/counters/rebuild")
+async def rebuild_notification_counters(admin: User = Depends(require_admin)):
+    """Recount unread notifications per user"""
+    try:
+        users = await notifications.rebuild_counters(db)
+        
+        return {
+            "success": True,
+            "data": {"users": users}
+        }
+    except Exception as e:
+        logger.error(f"Error rebuilding notification counters: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/admin/payouts/run")
+async def run_payout_settlement(admin: User = Depends(require_admin)):
+    """Run payout settlement now"""
+    try:
+        run = await payouts.run_settlement(db, client)
+        
+        return {
+            "success": True,
+            "data": run,
+            "message": "Payout settlement completed"
+        }
+    except Exception as e:
+        logger.error(f"Error running payout settlement: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/admin/payouts/batches")
+async def get_payout_batches(before: Optional[str] = None, limit: int = 50, admin: User = Depends(require_admin)):
+    """List exported payout batches"""
+    try:
+        batches = await payouts.list_batches(db, min(max(limit, 1), 200), before)
+        
+        return {
+            "success": True,
+            "data": batches
+        }
+    except Exception as e:
+        logger.error(f"Error fetching payout batches: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/admin/earnings/backfill")
+async def backfill_earnings(mechanic_id: Optional[str] = None, admin: User = Depends(require_admin)):
+    """Rebuild earnings counters from order and payment history"""
+    try:
+        buckets = await earnings.backfill(db, mechanic_id)
+        
+        return {
+            "success": True,
+            "data": {"buckets": buckets},
+            "message": "Earnings backfill completed"
+        }
+    except Exception as e:
+        logger.error(f"Error backfilling earnings: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/admin/webhooks/stats")
+async def get_webhook_stats(admin: User = Depends(require_admin)):
+    """Webhook ingestion queue metrics"""
+    queued = await db.inbound_events.count_documents({"status": {"$in": ["queued", "processing"]}})
+    failed = await db.inbound_events.count_documents({"status": "failed"})
+    
+    return {
+        "success": True,
+        "data": {
+            **webhook_queue.stats(),
+            "stored_unprocessed": queued,
+            "stored_failed": failed
+        }
+    }
+
+@api_router.get("/admin/outbox/stats")
+async def get_outbox_stats(admin: User = Depends(require_admin)):
+    """Email/SMS outbox worker metrics and stored messages per status"""
+    return {
+        "success": True,
+        "data": {
+            **outbox_sender.stats(),
+            "stored": await outbox.status_counts(db),
+            "sms_delivery": await sms_service.status_counts(db)
+        }
+    }
+
+@api_router.get("/admin/jobs/stats")
+async def get_delayed_job_stats(admin: User = Depends(require_admin)):
+    """Delayed job queue metrics and stored jobs per status"""
+    return {
+        "success": True,
+        "data": {
+            **delayed_queue.stats(),
+            "stored": await delayed_jobs.status_counts(db)
+        }
+    }
+
 # ===== CHAT ENDPOINTS =====
 
 @api_router.get("/chat/{order_id}")
@@ -1020,33 +1499,39 @@ async def get_order_photos(order_id: str, current_user: User = Depends(get_curre
 async def get_notifications(current_user: User = Depends(get_current_user)):
     """Get user notifications"""
     try:
-        notifications = await db.notifications.find(
-            {"user_id": current_user.id},
-            {"_id": 0}
-        ).sort("created_at", -1).limit(50).to_list(50)
-        
-        unread_count = await db.notifications.count_documents({
-            "user_id": current_user.id,
-            "read": False
-        })
+        items, unread_count = await notifications.list_for_user(db, current_user.id)
         
         return {
             "success": True,
-            "data": notifications,
+            "data": items,
             "unread_count": unread_count
         }
     except Exception as e:
         logger.error(f"Error fetching notifications: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/notifications/read-all")
+@api_router.put("/notifications/read-all")
+async def mark_all_notifications_read(current_user: User = Depends(get_current_user)):
+    """Mark every notification as read"""
+    try:
+        updated = await notifications.mark_all_read(db, current_user.id)
+        
+        return {
+            "success": True,
+            "data": {"updated": updated},
+            "message": "All marked as read"
+        }
+    except Exception as e:
+        logger.error(f"Error marking notifications: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @api_router.post("/notifications/{notification_id}/read")
+@api_router.put("/notifications/{notification_id}/read")
 async def mark_notification_read(notification_id: str, current_user: User = Depends(get_current_user)):
     """Mark notification as read"""
     try:
-        await db.notifications.update_one(
-            {"id": notification_id, "user_id": current_user.id},
-            {"$set": {"read": True}}
-        )
+        await notifications.mark_read(db, current_user.id, notification_id)
         
         return {
             "success": True,
@@ -1056,6 +1541,26 @@ async def mark_notification_read(notification_id: str, current_user: User = Depe
         logger.error(f"Error marking notification: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/notifications/preferences")
+async def get_notification_preferences(current_user: User = Depends(get_current_user)):
+    """Email/SMS delivery preferences"""
+    preferences = await notifications.get_preferences(db, current_user.id)
+    return {"success": True, "data": preferences}
+
+@api_router.put("/notifications/preferences")
+async def update_notification_preferences(preferences: dict, current_user: User = Depends(get_current_user)):
+    """Turn email/SMS delivery on or off"""
+    try:
+        updated = await notifications.set_preferences(db, current_user.id, preferences)
+        
+        return {
+            "success": True,
+            "data": updated,
+            "message": "Preferences updated"
+        }
+    except Exception as e:
+        logger.error(f"Error updating notification preferences: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 # ===== MECHANIC QUOTE ENDPOINTS =====
 
@@ -1075,6 +1580,20 @@ async def mechanic_send_quote(
         if not order:
             raise HTTPException(status_code=404, detail="Order not found")
         
+        # Refuse double-booking the mechanic (their own earlier quote of this order doesn't count)
+        reserved = False
+        if order.get("date") and order.get("time"):
+            try:
+                await availability.check_booking(
+                    db, current_user.id, order["date"], order["time"], order.get("estimated_duration_minutes"), order_id
+                )
+                await availability.reserve(
+                    db, current_user.id, order["date"], order["time"], order.get("estimated_duration_minutes"), order_id
+                )
+                reserved = True
+            except availability.SlotConflictError as e:
+                raise HTTPException(status_code=409, detail=str(e))
+        
         # Calculate total
         total_price = quote_data.labor_price + (quote_data.parts_price or 0)
         
@@ -1093,21 +1612,48 @@ async def mechanic_send_quote(
         quote_dict = quote.model_dump()
         quote_dict['created_at'] = quote_dict['created_at'].isoformat()
         
-        # Save quote
-        await db.mechanic_quotes.insert_one(quote_dict)
-        
-        # Update order status and add mechanic
-        await db.quotes.update_one(
-            {"id": order_id},
-            {
-                "$set": {
-                    "status": "quoted",
-                    "mechanic_id": current_user.id,
-                    "final_price": total_price,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
+        previous_mechanic = order.get("mechanic_id")
+        try:
+            # Save quote
+            await db.mechanic_quotes.insert_one(quote_dict)
+            
+            # Update order status and add mechanic
+            await db.quotes.update_one(
+                {"id": order_id},
+                {
+                    "$set": {
+                        "status": "quoted",
+                        "mechanic_id": current_user.id,
+                        "final_price": total_price,
+                        "updated_at": datetime.now(timezone.utc).isoformat()
+                    }
                 }
-            }
+            )
+        except Exception:
+            # Don't leave a booking behind for a quote that wasn't saved (a re-quote keeps the old one)
+            if reserved and previous_mechanic != current_user.id:
+                await availability.release(db, current_user.id, order["date"], order_id)
+            raise
+        if previous_mechanic and previous_mechanic != current_user.id:
+            # The order moved to this mechanic: free the previous quote's slot
+            await availability.release(db, previous_mechanic, order.get("date"), order_id)
+        await record_order_event(
+            db, order_id, "quoted", current_user.id, current_user.user_type,
+            data={"mechanic_quote_id": quote.id, "total_price": total_price}
+        )
+        await delayed_jobs.schedule(
+            db, "quote_expiry", f"quote_expiry:{order_id}",
+            datetime.now(timezone.utc) + timedelta(hours=QUOTE_EXPIRY_HOURS),
+            {"order_id": order_id, "mechanic_id": current_user.id}
         )
+        if order.get("status") == "pending":
+            await publish_order_feed("taken", order)
+        availability.invalidate(current_user.id, order.get("date"))
+        
+        # Send email to client
+        client = await db.users.find_one({"id": order["client_id"]}, {"_id": 0, "email": 1, "name": 1, "locale": 1})
+        if client:
+            await outbox.enqueue(db, email_quote_to_client(client, order_id, current_user.name, total_price))
         
         logger.info(f"Mechanic {current_user.id} sent quote for order {order_id}")
         
@@ -1144,6 +1690,159 @@ async def get_mechanic_agenda(date: str, current_user: User = Depends(get_curren
         logger.error(f"Error fetching agenda: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/mechanic/availability")
+async def get_my_availability(current_user: User = Depends(get_current_user)):
+    """Get mechanic working hours and blocked slots"""
+    if current_user.user_type != "mechanic":
+        raise HTTPException(status_code=403, detail="Only mechanics can access")
+    
+    doc = await db.availability.find_one({"mechanic_id": current_user.id}, {"_id": 0})
+    if not doc:
+        doc = MechanicAvailability(
+            mechanic_id=current_user.id,
+            working_hours=availability.DEFAULT_WORKING_HOURS
+        ).model_dump()
+    
+    return {
+        "success": True,
+        "data": doc
+    }
+
+@api_router.put("/mechanic/location")
+async def update_my_location(update: LocationUpdate, current_user: User = Depends(get_current_user)):
+    """Set mechanic coordinates used by distance search"""
+    try:
+        if current_user.user_type != "mechanic":
+            raise HTTPException(status_code=403, detail="Only mechanics can access")
+        
+        fields = search.geo_fields(update.latitude, update.longitude)
+        if update.location is not None:
+            fields["location"] = update.location
+        await db.users.update_one({"id": current_user.id}, {"$set": fields})
+        
+        return {
+            "success": True,
+            "data": {"latitude": update.latitude, "longitude": update.longitude},
+            "message": "Location updated"
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error updating location: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.put("/mechanic/availability")
+async def update_my_availability(update: AvailabilityUpdate, current_user: User = Depends(get_current_user)):
+    """Set mechanic weekly working hours"""
+    try:
+        if current_user.user_type != "mechanic":
+            raise HTTPException(status_code=403, detail="Only mechanics can access")
+        
+        for wh in update.working_hours:
+            if not 0 <= wh.weekday <= 6 or availability.parse_minutes(wh.start) >= availability.parse_minutes(wh.end):
+                raise HTTPException(status_code=400, detail="Invalid working hours")
+        
+        await db.availability.update_one(
+            {"mechanic_id": current_user.id},
+            {
+                "$set": {
+                    "working_hours": [wh.model_dump() for wh in update.working_hours],
+                    "slot_step_minutes": update.slot_step_minutes or availability.DEFAULT_SLOT_STEP_MINUTES,
+                    "updated_at": datetime.now(timezone.utc).isoformat()
+                },
+                "$setOnInsert": {"mechanic_id": current_user.id, "blocked_slots": []}
+            },
+            upsert=True
+        )
+        availability.invalidate(current_user.id)
+        
+        return {
+            "success": True,
+            "message": "Availability updated"
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error updating availability: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/mechanic/availability/blocked")
+async def block_slot(slot_data: BlockedSlotCreate, current_user: User = Depends(get_current_user)):
+    """Block a time range (day off, lunch, personal)"""
+    try:
+        if current_user.user_type != "mechanic":
+            raise HTTPException(status_code=403, detail="Only mechanics can access")
+        
+        if availability.parse_minutes(slot_data.start) >= availability.parse_minutes(slot_data.end):
+            raise HTTPException(status_code=400, detail="Invalid time range")
+        
+        slot = BlockedSlot(**slot_data.model_dump())
+        await db.availability.update_one(
+            {"mechanic_id": current_user.id},
+            {
+                "$push": {"blocked_slots": slot.model_dump()},
+                "$set": {"updated_at": datetime.now(timezone.utc).isoformat()},
+                "$setOnInsert": {
+                    "mechanic_id": current_user.id,
+                    "working_hours": availability.DEFAULT_WORKING_HOURS,
+                    "slot_step_minutes": availability.DEFAULT_SLOT_STEP_MINUTES
+                }
+            },
+            upsert=True
+        )
+        availability.invalidate(current_user.id, slot.date)
+        
+        return {
+            "success": True,
+            "data": slot,
+            "message": "Slot blocked"
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error blocking slot: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.delete("/mechanic/availability/blocked/{slot_id}")
+async def unblock_slot(slot_id: str, current_user: User = Depends(get_current_user)):
+    """Remove a blocked slot"""
+    try:
+        result = await db.availability.update_one(
+            {"mechanic_id": current_user.id},
+            {"$pull": {"blocked_slots": {"id": slot_id}}}
+        )
+        
+        if result.modified_count == 0:
+            raise HTTPException(status_code=404, detail="Slot not found")
+        
+        availability.invalidate(current_user.id)
+        
+        return {
+            "success": True,
+            "message": "Slot removed"
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error removing slot: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/mechanics/{mechanic_id}/free-slots")
+async def get_free_slots(mechanic_id: str, date: str, duration_minutes: int = availability.DEFAULT_DURATION_MINUTES):
+    """Get free start times of a mechanic on a date"""
+    try:
+        slots = await availability.free_slots(db, mechanic_id, date, duration_minutes)
+        
+        return {
+            "success": True,
+            "data": slots
+        }
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date")
+    except Exception as e:
+        logger.error(f"Error fetching free slots: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @api_router.post("/mechanic/orders/{order_id}/start")
 async def start_service(order_id: str, current_user: User = Depends(get_current_user)):
     """Start service timer"""
@@ -1161,16 +1860,17 @@ async def start_service(order_id: str, current_user: User = Depends(get_current_
                 }
             }
         )
+        await record_order_event(db, order_id, "in_progress", current_user.id, current_user.user_type)
+        await reminders.cancel_for_order(db, order_id)
         
         # Create notification for client
-        await db.notifications.insert_one({
-            "id": str(uuid.uuid4()),
-            "user_id": order["client_id"],
-            "title": "Serviço Iniciado",
-            "message": f"O mecânico iniciou o serviço #{order_id[:8]}",
-            "read": False,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
+        notifier.notify(
+            order["client_id"],
+            "Serviço Iniciado",
+            f"O mecânico iniciou o serviço #{order_id[:8]}",
+            type="order",
+            reference_id=order_id
+        )
         
         logger.info(f"Service started for order {order_id}")
         
@@ -1196,26 +1896,40 @@ async def complete_service(
         if not order:
             raise HTTPException(status_code=404, detail="Order not found")
         
-        await db.quotes.update_one(
-            {"id": order_id},
+        completed_at = datetime.now(timezone.utc).isoformat()
+        # Conditional on the previous status so a repeated call is not counted twice
+        result = await db.quotes.update_one(
+            {"id": order_id, "status": {"$nin": earnings.COMPLETED_STATUSES}},
             {
                 "$set": {
                     "status": "completed",
-                    "completed_at": datetime.now(timezone.utc).isoformat(),
+                    "completed_at": completed_at,
                     "duration_minutes": completion_data.get("duration_minutes", 0)
                 }
             }
         )
+        if result.modified_count == 0:
+            return {
+                "success": True,
+                "message": "Service already completed"
+            }
+        await earnings.record_completion(db, current_user.id, order.get("final_price", 0), completed_at)
+        await rollups.record_order_completed(db, order.get("final_price", 0), completed_at)
+        await ranking.record_completion(db, current_user.id)
+        await record_order_event(
+            db, order_id, "completed", current_user.id, current_user.user_type,
+            data={"duration_minutes": completion_data.get("duration_minutes", 0)}
+        )
+        await reminders.cancel_for_order(db, order_id)
         
         # Create notification for client
-        await db.notifications.insert_one({
-            "id": str(uuid.uuid4()),
-            "user_id": order["client_id"],
-            "title": "Serviço Concluído!",
-            "message": f"Seu serviço #{order_id[:8]} foi concluído. Avalie o mecânico!",
-            "read": False,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
+        notifier.notify(
+            order["client_id"],
+            "Serviço Concluído!",
+            f"Seu serviço #{order_id[:8]} foi concluído. Avalie o mecânico!",
+            type="order",
+            reference_id=order_id
+        )
         
         logger.info(f"Service completed for order {order_id}")
         
@@ -1230,31 +1944,28 @@ async def complete_service(
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/mechanic/earnings")
-async def get_mechanic_earnings(current_user: User = Depends(get_current_user)):
+async def get_mechanic_earnings(
+    days: int = earnings.DEFAULT_DAYS,
+    months: int = earnings.DEFAULT_MONTHS,
+    current_user: User = Depends(get_current_user)
+):
     """Get mechanic earnings summary"""
     try:
         if current_user.user_type != "mechanic":
             raise HTTPException(status_code=403, detail="Only mechanics can access")
         
-        completed_orders = await db.quotes.find(
-            {"mechanic_id": current_user.id, "status": {"$in": ["completed", "reviewed"]}},
+        summary = await earnings.get_summary(db, current_user.id, min(max(days, 1), 366), min(max(months, 1), 60))
+        summary["orders"] = await db.quotes.find(
+            {"mechanic_id": current_user.id, "status": {"$in": earnings.COMPLETED_STATUSES}},
             {"_id": 0}
-        ).to_list(1000)
-        
-        total_earnings = sum(order.get("final_price", 0) for order in completed_orders)
-        platform_fee = total_earnings * 0.15  # 15% platform fee
-        net_earnings = total_earnings - platform_fee
+        ).sort("completed_at", -1).limit(10).to_list(10)  # Last 10 orders
         
         return {
             "success": True,
-            "data": {
-                "total_orders": len(completed_orders),
-                "total_earnings": total_earnings,
-                "platform_fee": platform_fee,
-                "net_earnings": net_earnings,
-                "orders": completed_orders[-10:]  # Last 10 orders
-            }
+            "data": summary
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching earnings: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1285,53 +1996,49 @@ async def find_nearby_mechanics(location_data: dict, current_user: User = Depend
         logger.error(f"Error finding mechanics: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/mechanics/nearby/slots")
+async def find_nearby_slots(slot_request: dict, current_user: User = Depends(get_current_user)):
+    """Next available slots across mechanics near the client"""
+    try:
+        from geolocation import find_nearby_mechanics
+        
+        client_lat = slot_request.get("latitude")
+        client_lon = slot_request.get("longitude")
+        if not client_lat or not client_lon:
+            raise HTTPException(status_code=400, detail="Location required")
+        
+        mechanics = await find_nearby_mechanics(db, client_lat, client_lon, slot_request.get("max_distance_km", 20))
+        slots = await availability.next_available_slots(
+            db,
+            mechanics,
+            duration_minutes=slot_request.get("duration_minutes", availability.DEFAULT_DURATION_MINUTES),
+            count=min(slot_request.get("count", 5), 50),
+            from_date=slot_request.get("from_date"),
+            days=min(slot_request.get("days", 7), 30)
+        )
+        
+        return {
+            "success": True,
+            "data": slots,
+            "count": len(slots)
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error finding slots: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # ===== ADMIN STATS & MANAGEMENT =====
 
 @api_router.get("/admin/stats")
 async def get_admin_stats(admin: User = Depends(require_admin)):
     """Get platform statistics"""
     try:
-        total_clients = await db.users.count_documents({"user_type": "client"})
-        active_mechanics = await db.users.count_documents({
-            "user_type": "mechanic",
-            "is_active": True,
-            "approval_status": "approved"
-        })
-        pending_mechanics = await db.users.count_documents({
-            "user_type": "mechanic",
-            "approval_status": "pending_approval"
-        })
-        
-        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
-        orders_today = await db.quotes.count_documents({
-            "created_at": {"$regex": f"^{today}"}
-        })
-        
-        active_orders = await db.quotes.count_documents({
-            "status": {"$in": ["pending", "quoted", "approved", "paid", "in_progress"]}
-        })
-        
-        # Revenue this month
-        month_start = datetime.now(timezone.utc).replace(day=1).isoformat()
-        completed_orders = await db.quotes.find(
-            {"status": {"$in": ["completed", "reviewed"]}, "created_at": {"$gte": month_start}},
-            {"_id": 0, "final_price": 1}
-        ).to_list(10000)
-        
-        revenue_month = sum(o.get("final_price", 0) for o in completed_orders) * 0.15  # 15% commission
+        stats = await admin_stats.get_stats(db)
         
         return {
             "success": True,
-            "data": {
-                "total_clients": total_clients,
-                "active_mechanics": active_mechanics,
-                "pending_mechanics": pending_mechanics,
-                "orders_today": orders_today,
-                "active_orders": active_orders,
-                "revenue_month": revenue_month,
-                "open_disputes": 0,  # TODO: Implement disputes
-                "recent_activity": []
-            }
+            "data": stats
         }
     except Exception as e:
         logger.error(f"Error fetching stats: {str(e)}")
@@ -1381,6 +2088,7 @@ async def google_auth(google_data: dict):
             user_dict['created_at'] = user_dict['created_at'].isoformat()
             
             await db.users.insert_one(user_dict)
+            await rollups.record_signup(db, new_user.user_type, user_dict['created_at'])
             
             token = create_access_token({"sub": new_user.id})
             
@@ -1415,14 +2123,13 @@ async def create_dispute(dispute_data: dict, current_user: User = Depends(get_cu
         await db.disputes.insert_one(dispute)
         
         # Notify admin
-        await db.notifications.insert_one({
-            "id": str(uuid.uuid4()),
-            "user_id": "admin",
-            "title": "Nova Disputa",
-            "message": f"Disputa criada para pedido #{dispute_data.get('order_id')[:8]}",
-            "read": False,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
+        notifier.notify(
+            "admin",
+            "Nova Disputa",
+            f"Disputa criada para pedido #{dispute_data.get('order_id')[:8]}",
+            type="dispute",
+            reference_id=dispute["id"]
+        )
         
         logger.info(f"Dispute created: {dispute['id']}")
         
@@ -1478,25 +2185,23 @@ async def resolve_dispute(
         order = await db.quotes.find_one({"id": dispute["order_id"]}, {"_id": 0})
         if order:
             # Notify client
-            await db.notifications.insert_one({
-                "id": str(uuid.uuid4()),
-                "user_id": dispute["client_id"],
-                "title": "Disputa Resolvida",
-                "message": f"Sua disputa foi resolvida. Decisão: {resolution_data.get('decision')}",
-                "read": False,
-                "created_at": datetime.now(timezone.utc).isoformat()
-            })
+            notifier.notify(
+                dispute["client_id"],
+                "Disputa Resolvida",
+                f"Sua disputa foi resolvida. Decisão: {resolution_data.get('decision')}",
+                type="dispute",
+                reference_id=dispute_id
+            )
             
             # Notify mechanic
             if order.get("mechanic_id"):
-                await db.notifications.insert_one({
-                    "id": str(uuid.uuid4()),
-                    "user_id": order["mechanic_id"],
-                    "title": "Disputa Resolvida",
-                    "message": f"Disputa do pedido #{dispute['order_id'][:8]} foi resolvida",
-                    "read": False,
-                    "created_at": datetime.now(timezone.utc).isoformat()
-                })
+                notifier.notify(
+                    order["mechanic_id"],
+                    "Disputa Resolvida",
+                    f"Disputa do pedido #{dispute['order_id'][:8]} foi resolvida",
+                    type="dispute",
+                    reference_id=dispute_id
+                )
         
         logger.info(f"Dispute {dispute_id} resolved by {admin.id}")
         
@@ -1510,6 +2215,34 @@ async def resolve_dispute(
         logger.error(f"Error resolving dispute: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/admin/exports/{export}")
+async def export_data(
+    export: str,
+    format: str = "csv",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    status: Optional[str] = None,
+    after: Optional[str] = None,
+    admin: User = Depends(require_admin)
+):
+    """Stream orders, payments or reviews as CSV or Parquet"""
+    try:
+        query = exports.build_query(
+            start, end,
+            status.split(",") if status else None,
+            exports.parse_after(after)
+        )
+        body = exports.stream_export(db, export, format, query)
+    except exports.ExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    filename = f"{export}_{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}.{format}"
+    return StreamingResponse(
+        body,
+        media_type=exports.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @api_router.get("/admin/orders")
 async def get_all_orders(admin: User = Depends(require_admin)):
     """Get all orders for admin"""
@@ -1523,30 +2256,6 @@ async def get_all_orders(admin: User = Depends(require_admin)):
     except Exception as e:
         logger.error(f"Error fetching orders: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
-        
-        # Send email to client
-        client = await db.users.find_one({"id": order["client_id"]}, {"_id": 0})
-        if client:
-            email_quote_to_client(
-                client['email'],
-                client['name'],
-                order_id,
-                current_user.name,
-                total_price
-            )
-        
-        logger.info(f"Mechanic {current_user.id} sent quote for order {order_id}")
-        
-        return {
-            "success": True,
-            "data": quote,
-            "message": "Orçamento enviado com sucesso"
-        }
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error sending quote: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/mechanic/available-orders")
 async def get_available_orders(current_user: User = Depends(get_current_user)):
@@ -1596,6 +2305,8 @@ async def approve_quote(order_id: str, current_user: User = Depends(get_current_
                 }
             }
         )
+        await record_order_event(db, order_id, "approved", current_user.id, current_user.user_type)
+        await delayed_jobs.cancel(db, f"quote_expiry:{order_id}")
         
         logger.info(f"Client approved quote for order {order_id}")
         
@@ -1632,6 +2343,13 @@ async def reject_quote(order_id: str, current_user: User = Depends(get_current_u
                 }
             }
         )
+        await record_order_event(
+            db, order_id, "pending", current_user.id, current_user.user_type,
+            notes="Quote rejected", data={"rejected_mechanic_id": order.get("mechanic_id")}
+        )
+        await delayed_jobs.cancel(db, f"quote_expiry:{order_id}")
+        await publish_order_feed("reopened", {**order, "status": "pending", "mechanic_id": None, "final_price": None})
+        await availability.release(db, order.get("mechanic_id"), order.get("date"), order_id)
         
         logger.info(f"Client rejected quote for order {order_id}")
         
@@ -1645,11 +2363,55 @@ async def reject_quote(order_id: str, current_user: User = Depends(get_current_u
         logger.error(f"Error rejecting quote: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@delayed_jobs.handler("quote_expiry")
+async def expire_quote(db, payload: dict):
+    """Reopen an order whose quote went unanswered for QUOTE_EXPIRY_HOURS"""
+    order_id = payload["order_id"]
+    # Only the quote this job was scheduled for; a newer quote has its own job
+    order = await db.quotes.find_one_and_update(
+        {"id": order_id, "status": "quoted", "mechanic_id": payload.get("mechanic_id")},
+        {
+            "$set": {
+                "status": "pending",
+                "mechanic_id": None,
+                "final_price": None,
+                "updated_at": datetime.now(timezone.utc).isoformat()
+            }
+        },
+        projection={"_id": 0}
+    )
+    if not order:
+        return
+    await record_order_event(
+        db, order_id, "pending", "system", "system",
+        notes="Quote expired", data={"expired_mechanic_id": order.get("mechanic_id")}
+    )
+    await publish_order_feed("reopened", {**order, "status": "pending", "mechanic_id": None, "final_price": None})
+    await availability.release(db, order.get("mechanic_id"), order.get("date"), order_id)
+    notifier.notify(
+        order["client_id"],
+        "Orçamento Expirado",
+        f"O orçamento do pedido #{order_id[:8]} expirou e o pedido foi reaberto",
+        type="order",
+        reference_id=order_id
+    )
+    logger.info(f"Quote expired for order {order_id}")
+
 # ===== REVIEW ENDPOINTS =====
 
 @api_router.post("/reviews")
-async def create_review(review_data: ReviewCreate, current_user: User = Depends(get_current_user)):
+async def create_review(
+    review_data: ReviewCreate,
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
+):
     """Create review for mechanic after service"""
+    return await run_idempotent(
+        db, idempotency_key, current_user.id, "reviews", request_fingerprint(review_data),
+        lambda: _create_review(review_data, current_user)
+    )
+
+async def _create_review(review_data: ReviewCreate, current_user: User):
     try:
         # Get order
         order = await db.quotes.find_one({"id": review_data.order_id}, {"_id": 0})
@@ -1673,33 +2435,30 @@ async def create_review(review_data: ReviewCreate, current_user: User = Depends(
             client_id=current_user.id,
             mechanic_id=review_data.mechanic_id,
             rating=review_data.rating,
-            comment=review_data.comment
+            comment=review_data.comment,
+            client_name=current_user.name
         )
         
         review_dict = review.model_dump()
         review_dict['created_at'] = review_dict['created_at'].isoformat()
         
-        await db.reviews.insert_one(review_dict)
-        
-        # Update mechanic rating
-        mechanic_reviews = await db.reviews.find({"mechanic_id": review_data.mechanic_id}, {"_id": 0}).to_list(1000)
-        avg_rating = sum(r['rating'] for r in mechanic_reviews) / len(mechanic_reviews)
+        try:
+            await db.reviews.insert_one(review_dict)
+        except DuplicateKeyError:
+            raise HTTPException(status_code=400, detail="Order already reviewed")
         
-        await db.users.update_one(
-            {"id": review_data.mechanic_id},
-            {
-                "$set": {
-                    "rating": round(avg_rating, 1),
-                    "review_count": len(mechanic_reviews)
-                }
-            }
-        )
+        # Update mechanic rating counters
+        await ratings.add_rating(db, review_data.mechanic_id, review_data.rating)
         
         # Update order status
         await db.quotes.update_one(
             {"id": review_data.order_id},
             {"$set": {"status": "reviewed"}}
         )
+        await record_order_event(
+            db, review_data.order_id, "reviewed", current_user.id, current_user.user_type,
+            data={"review_id": review.id, "rating": review_data.rating}
+        )
         
         logger.info(f"Review created for order {review_data.order_id}")
         
@@ -1714,22 +2473,65 @@ async def create_review(review_data: ReviewCreate, current_user: User = Depends(
         logger.error(f"Error creating review: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.get("/mechanics/{mechanic_id}/reviews")
-async def get_mechanic_reviews(mechanic_id: str):
-    """Get reviews for a mechanic"""
+@api_router.get("/mechanics/{mechanic_id}/rating")
+async def get_mechanic_rating(mechanic_id: str):
+    """Average rating and star distribution of a mechanic"""
     try:
-        reviews = await db.reviews.find({"mechanic_id": mechanic_id}, {"_id": 0}).sort("created_at", -1).to_list(100)
+        summary = await ratings.get_summary(db, mechanic_id)
+        if summary is None:
+            raise HTTPException(status_code=404, detail="Mechanic not found")
         
-        # Get client names
-        for review in reviews:
-            client = await db.users.find_one({"id": review["client_id"]}, {"_id": 0, "name": 1})
-            review["client_name"] = client["name"] if client else "Cliente"
+        return {
+            "success": True,
+            "data": summary
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching rating: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/mechanics/{mechanic_id}/reviews")
+async def get_mechanic_reviews(mechanic_id: str, before: Optional[str] = None, limit: int = 20):
+    """Get reviews for a mechanic, newest first (pass next_cursor as `before`)"""
+    try:
+        limit = min(max(limit, 1), 100)
+        query = {"mechanic_id": mechanic_id}
+        if before:
+            try:
+                created_at, review_id = exports.decode_cursor(before)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            query["$or"] = [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "id": {"$lt": review_id}}
+            ]
+        
+        reviews = await db.reviews.find(query, {"_id": 0}).sort(
+            [("created_at", -1), ("id", -1)]
+        ).limit(limit + 1).to_list(limit + 1)
+        has_more = len(reviews) > limit
+        reviews = reviews[:limit]
+        
+        # Client names are stored on new reviews; older ones are resolved in one query
+        missing = {r["client_id"] for r in reviews if not r.get("client_name")}
+        if missing:
+            clients = await db.users.find({"id": {"$in": list(missing)}}, {"_id": 0, "id": 1, "name": 1}).to_list(len(missing))
+            names = {c["id"]: c["name"] for c in clients}
+            for review in reviews:
+                if not review.get("client_name"):
+                    review["client_name"] = names.get(review["client_id"], "Cliente")
+        
+        next_cursor = exports.encode_cursor(reviews[-1]["created_at"], reviews[-1]["id"]) if has_more else None
         
         return {
             "success": True,
             "data": reviews,
+            "next_cursor": next_cursor,
             "message": f"{len(reviews)} reviews found"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching reviews: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1765,6 +2567,8 @@ async def approve_mechanic(mechanic_id: str, admin: User = Depends(require_admin
         
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Mechanic not found")
+        # Searchable from now on: make sure distance search sees the right point
+        await search.sync_geo(db, mechanic_id)
         
         logger.info(f"Admin {admin.id} approved mechanic {mechanic_id}")
         
@@ -1803,6 +2607,22 @@ async def reject_mechanic(mechanic_id: str, admin: User = Depends(require_admin)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@api_router.get("/admin/order-events")
+async def get_order_events(after: int = 0, limit: int = 100, admin: User = Depends(require_admin)):
+    """Tail the order event log from a global position (resumable)"""
+    try:
+        events = await read_events(db, after, min(limit, 1000))
+        
+        return {
+            "success": True,
+            "data": events,
+            "next_position": events[-1]["position"] if events else after
+        }
+    except Exception as e:
+        logger.error(f"Error reading order events: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 # Root endpoint
 @api_router.get("/")
 async def root():
@@ -1927,16 +2747,13 @@ async def create_reservation(
     await db.part_reservations.insert_one(reservation)
     
     # Create notification for shop
-    await db.notifications.insert_one({
-        "id": str(uuid4()),
-        "user_id": shop['id'],
-        "title": "Nova Pré-Reserva",
-        "message": f"{current_user['name']} solicitou {reservation_data['quantity']}x {reservation_data['part_name']}",
-        "type": "reservation",
-        "reference_id": reservation['id'],
-        "is_read": False,
-        "created_at": datetime.now(timezone.utc)
-    })
+    notifier.notify(
+        shop['id'],
+        "Nova Pré-Reserva",
+        f"{current_user['name']} solicitou {reservation_data['quantity']}x {reservation_data['part_name']}",
+        type="reservation",
+        reference_id=reservation['id']
+    )
     
     return {"success": True, "reservation": reservation}
 
@@ -1992,6 +2809,10 @@ async def confirm_reservation(
         }
         
         await db.pickup_codes.insert_one(code_doc)
+        await delayed_jobs.schedule(
+            db, "pickup_code_expiry", f"pickup_code_expiry:{reservation_id}", expires_at,
+            {"reservation_id": reservation_id, "code_id": code_doc["id"]}
+        )
         
         await db.part_reservations.update_one(
             {"id": reservation_id},
@@ -2006,16 +2827,13 @@ async def confirm_reservation(
         )
         
         # Notify mechanic
-        await db.notifications.insert_one({
-            "id": str(uuid4()),
-            "user_id": reservation['mechanic_id'],
-            "title": "Pré-Reserva Confirmada",
-            "message": f"Código de retirada: {pickup_code}. Válido até {expires_at.strftime('%d/%m/%Y')}",
-            "type": "reservation",
-            "reference_id": reservation_id,
-            "is_read": False,
-            "created_at": datetime.now(timezone.utc)
-        })
+        notifier.notify(
+            reservation['mechanic_id'],
+            "Pré-Reserva Confirmada",
+            f"Código de retirada: {pickup_code}. Válido até {expires_at.strftime('%d/%m/%Y')}",
+            type="reservation",
+            reference_id=reservation_id
+        )
         
         return {"success": True, "pickup_code": pickup_code}
     
@@ -2031,16 +2849,13 @@ async def confirm_reservation(
         )
         
         # Notify mechanic
-        await db.notifications.insert_one({
-            "id": str(uuid4()),
-            "user_id": reservation['mechanic_id'],
-            "title": "Pré-Reserva Recusada",
-            "message": f"Peça não disponível: {reservation['part_name']}",
-            "type": "reservation",
-            "reference_id": reservation_id,
-            "is_read": False,
-            "created_at": datetime.now(timezone.utc)
-        })
+        notifier.notify(
+            reservation['mechanic_id'],
+            "Pré-Reserva Recusada",
+            f"Peça não disponível: {reservation['part_name']}",
+            type="reservation",
+            reference_id=reservation_id
+        )
         
         return {"success": True, "message": "Reservation rejected"}
     
@@ -2085,6 +2900,7 @@ async def confirm_pickup(
             }
         }
     )
+    await delayed_jobs.cancel(db, f"pickup_code_expiry:{reservation_id}")
     
     # Update reservation
     await db.part_reservations.update_one(
@@ -2114,43 +2930,37 @@ async def confirm_pickup(
     
     return {"success": True, "message": "Pickup confirmed"}
 
-# ===== NOTIFICATIONS ENDPOINTS =====
-@api_router.get("/notifications")
-async def get_notifications(current_user: dict = Depends(get_current_user)):
-    """Get user notifications"""
-    notifications = await db.notifications.find(
-        {"user_id": current_user['id']},
-        {"_id": 0}
-    ).sort("created_at", -1).limit(50).to_list(50)
-    
-    unread_count = await db.notifications.count_documents({
-        "user_id": current_user['id'],
-        "is_read": False
-    })
-    
-    return {
-        "success": True,
-        "notifications": notifications,
-        "unread_count": unread_count
-    }
-
-@api_router.put("/notifications/{notification_id}/read")
-async def mark_notification_read(
-    notification_id: str,
-    current_user: dict = Depends(get_current_user)
-):
-    """Mark notification as read"""
-    await db.notifications.update_one(
-        {"id": notification_id, "user_id": current_user['id']},
+@delayed_jobs.handler("pickup_code_expiry")
+async def expire_pickup_code(db, payload: dict):
+    """Release a confirmed reservation whose pickup code ran out unused"""
+    reservation_id = payload["reservation_id"]
+    result = await db.pickup_codes.update_one(
+        {"id": payload["code_id"], "is_used": False},
+        {"$set": {"is_expired": True}}
+    )
+    if result.modified_count == 0:
+        return
+    reservation = await db.part_reservations.find_one_and_update(
+        {"id": reservation_id, "status": "confirmed"},
         {
             "$set": {
-                "is_read": True,
-                "read_at": datetime.now(timezone.utc)
+                "status": "expired",
+                "updated_at": datetime.now(timezone.utc)
             }
-        }
+        },
+        projection={"_id": 0}
     )
-    
-    return {"success": True}
+    if not reservation:
+        return
+    for user_id in (reservation["mechanic_id"], reservation["shop_id"]):
+        notifier.notify(
+            user_id,
+            "Pré-Reserva Expirada",
+            f"O código de retirada de {reservation['part_name']} expirou",
+            type="reservation",
+            reference_id=reservation_id
+        )
+    logger.info(f"Pickup code expired for reservation {reservation_id}")
 
 async def health_check():
     return {"status": "healthy"}
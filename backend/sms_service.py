@@ -1,6 +1,17 @@
+import asyncio
+import base64
+import hashlib
+import hmac
 import os
 import logging
-from datetime import datetime, timezone, timedelta
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import httpx
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+import notification_templates as templates
+from rate_limit import TokenBucket
 
 logger = logging.getLogger(__name__)
 
@@ -9,40 +20,195 @@ TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID', '')
 TWILIO_AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN', '')
 TWILIO_PHONE_NUMBER = os.environ.get('TWILIO_PHONE_NUMBER', '')
 FRONTEND_URL = os.environ.get('FRONTEND_URL', 'https://clickmecanico.emergent.host')
+# Public base URL of this API, for Twilio delivery callbacks (optional)
+PUBLIC_API_URL = os.environ.get('PUBLIC_API_URL', '')
 
-def send_sms(to_phone: str, message: str):
-    """Send SMS via Twilio"""
+SMS_CONCURRENCY = int(os.environ.get('SMS_CONCURRENCY', '10'))
+TWILIO_RATE_PER_SECOND = float(os.environ.get('TWILIO_RATE_PER_SECOND', '1'))
+
+# Delivery status per message, updated by Twilio's status callback. A row
+# is written (with a placeholder sid) before each send and gets Twilio's
+# sid once it's accepted; a callback that arrives first creates the row.
+COLLECTION = 'sms_messages'
+FINAL_STATUSES = ['delivered', 'undelivered', 'failed']
+
+class SmsError(Exception):
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+async def ensure_indexes(db):
+    await db[COLLECTION].create_index([('sid', ASCENDING)], unique=True)
+    await db[COLLECTION].create_index([('status', ASCENDING), ('updated_at', ASCENDING)])
+
+class TwilioTransport:
+    """Twilio REST API over one long-lived HTTP client"""
+
+    def __init__(self, account_sid: str, auth_token: str, from_number: str):
+        self.from_number = from_number
+        self.client = httpx.AsyncClient(
+            base_url=f"https://api.twilio.com/2010-04-01/Accounts/{account_sid}",
+            auth=(account_sid, auth_token),
+            timeout=httpx.Timeout(10.0),
+            limits=httpx.Limits(max_connections=SMS_CONCURRENCY, max_keepalive_connections=SMS_CONCURRENCY)
+        )
+
+    async def send(self, to: str, body: str) -> dict:
+        data = {'To': to, 'From': self.from_number, 'Body': body}
+        if PUBLIC_API_URL:
+            data['StatusCallback'] = f"{PUBLIC_API_URL}/api/webhook/twilio/status"
+        try:
+            response = await self.client.post('/Messages.json', data=data)
+        except httpx.HTTPError as e:
+            raise SmsError(f"Twilio request failed: {str(e)}")
+        if response.status_code == 429 or response.status_code >= 500:
+            raise SmsError(f"Twilio {response.status_code}: {response.text[:200]}")
+        if response.status_code >= 400:
+            # Invalid number, unsubscribed recipient...: retrying won't help
+            raise SmsError(f"Twilio {response.status_code}: {response.text[:200]}", retryable=False)
+        result = response.json()
+        return {'sid': result['sid'], 'status': result.get('status', 'queued')}
+
+    async def close(self):
+        await self.client.aclose()
+
+class StubTransport:
+    """Local transport: records messages instead of sending them"""
+
+    def __init__(self):
+        self.sent: List[dict] = []
+
+    async def send(self, to: str, body: str) -> dict:
+        sid = f"SM{uuid.uuid4().hex}"
+        self.sent.append({'sid': sid, 'to': to, 'body': body})
+        logger.info(f"[stub] SMS to {to}: {body}")
+        return {'sid': sid, 'status': 'sent'}
+
+    async def close(self):
+        pass
+
+class SmsSender:
+    """Bounded-concurrency, rate-limited sender that records delivery status"""
+
+    def __init__(self, db, transport, concurrency: int = SMS_CONCURRENCY, rate_per_second: float = TWILIO_RATE_PER_SECOND):
+        self.db = db
+        self.transport = transport
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(rate_per_second)
+
+    async def send(self, to: str, body: str, message_id: Optional[str] = None) -> str:
+        """Send one SMS; returns the provider sid"""
+        attempt_id = str(uuid.uuid4())
+        now = datetime.now(timezone.utc).isoformat()
+        try:
+            await self.db[COLLECTION].insert_one({
+                '_id': attempt_id,
+                'sid': f"pending:{attempt_id}",
+                'message_id': message_id,
+                'to': to,
+                'status': 'sending',
+                'created_at': now,
+                'updated_at': now
+            })
+        except Exception as e:
+            raise SmsError(f"Could not record SMS before sending: {str(e)}")
+        async with self.semaphore:
+            await self.bucket.acquire()
+            result = await self.transport.send(to, body)
+        # Twilio accepted it: bookkeeping errors from here on must not cause a resend
+        try:
+            await self._attach(attempt_id, result)
+        except Exception as e:
+            logger.error(f"Error recording SMS {result['sid']}: {str(e)}")
+        return result['sid']
+
+    async def _attach(self, attempt_id: str, result: dict):
+        try:
+            await self.db[COLLECTION].update_one(
+                {'_id': attempt_id},
+                {'$set': {'sid': result['sid'], 'status': result['status'], 'updated_at': datetime.now(timezone.utc).isoformat()}}
+            )
+        except DuplicateKeyError:
+            # A status callback got here first: keep its status, add our details
+            pending = await self.db[COLLECTION].find_one({'_id': attempt_id})
+            await self.db[COLLECTION].update_one(
+                {'sid': result['sid']},
+                {'$set': {'message_id': pending['message_id'], 'to': pending['to'], 'created_at': pending['created_at']}}
+            )
+            await self.db[COLLECTION].delete_one({'_id': attempt_id})
+
+    async def send_many(self, messages: List[dict]) -> Dict[str, SmsError]:
+        """Send outbox messages concurrently; returns the failures by message id"""
+        results = await asyncio.gather(
+            *[self.send(m['to'], m['body'], m['_id']) for m in messages],
+            return_exceptions=True
+        )
+        failures = {}
+        for message, result in zip(messages, results):
+            if isinstance(result, SmsError):
+                failures[message['_id']] = result
+            elif isinstance(result, Exception):
+                failures[message['_id']] = SmsError(str(result))
+        return failures
+
+    async def close(self):
+        await self.transport.close()
+
+def build_transport(provider: str):
+    """Transport for SMS_PROVIDER, or None when Twilio isn't configured"""
+    if provider in ('fake', 'stub'):
+        return StubTransport()
     if not TWILIO_ACCOUNT_SID:
         logger.warning("Twilio not configured - SMS not sent")
+        return None
+    return TwilioTransport(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_PHONE_NUMBER)
+
+def valid_signature(url: str, params: dict, signature: str) -> bool:
+    """Check Twilio's X-Twilio-Signature for a callback"""
+    if not TWILIO_AUTH_TOKEN or not signature:
         return False
-    
+    payload = url + ''.join(f"{key}{params[key]}" for key in sorted(params))
+    digest = hmac.new(TWILIO_AUTH_TOKEN.encode(), payload.encode(), hashlib.sha1).digest()
+    return hmac.compare_digest(base64.b64encode(digest).decode(), signature)
+
+async def update_status(db, sid: str, status: str, error_code: Optional[str] = None) -> bool:
+    """Apply a status callback; final statuses are never overwritten"""
+    now = datetime.now(timezone.utc).isoformat()
+    update = {'status': status, 'updated_at': now}
+    if error_code:
+        update['error_code'] = error_code
     try:
-        from twilio.rest import Client
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-        
-        msg = client.messages.create(
-            body=message,
-            from_=TWILIO_PHONE_NUMBER,
-            to=to_phone
+        # Upsert: the callback may arrive before the sender has attached the sid
+        result = await db[COLLECTION].update_one(
+            {'sid': sid, 'status': {'$nin': FINAL_STATUSES}},
+            {'$set': update, '$setOnInsert': {'created_at': now}},
+            upsert=True
         )
-        
-        logger.info(f"SMS sent to {to_phone}: {msg.sid}")
-        return True
-    except Exception as e:
-        logger.error(f"Error sending SMS: {str(e)}")
+    except DuplicateKeyError:
+        # Already in a final status
         return False
+    return result.modified_count > 0 or result.upserted_id is not None
+
+async def status_counts(db) -> Dict[str, int]:
+    return {
+        row['_id']: row['count'] async for row in db[COLLECTION].aggregate([
+            {'$group': {'_id': '$status', 'count': {'$sum': 1}}}
+        ])
+    }
+
+# SMS builders, rendered from the compiled templates as outbox messages
+def sms_reminder_24h(clients: List[dict], service: str, date: str, time: str) -> List[dict]:
+    """24h reminder"""
+    return templates.sms_batch('reminder_24h', {'service': service, 'date': date, 'time': time}, clients)
 
-def sms_reminder_24h(client_name: str, client_phone: str, service: str, date: str, time: str):
-    """Send 24h reminder"""
-    message = f"Olá {client_name}! Lembrete: seu serviço '{service}' está agendado para amanhã ({date}) às {time}. ClickMecanico"
-    return send_sms(client_phone, message)
+def sms_reminder_1h(clients: List[dict], service: str, time: str) -> List[dict]:
+    """1h reminder"""
+    return templates.sms_batch('reminder_1h', {'service': service, 'time': time}, clients)
 
-def sms_reminder_1h(client_name: str, client_phone: str, service: str, time: str):
-    """Send 1h reminder"""
-    message = f"Olá {client_name}! Seu mecânico chegará em 1 hora (às {time}). ClickMecanico"
-    return send_sms(client_phone, message)
+def sms_service_completed(clients: List[dict], order_id: str) -> List[dict]:
+    """Service completed"""
+    return templates.sms_batch('service_completed', {'order_id': order_id, 'url': f"{FRONTEND_URL}/dashboard"}, clients)
 
-def sms_service_completed(client_name: str, client_phone: str, order_id: str):
-    """Notify service completed"""
-    message = f"Olá {client_name}! Seu serviço #{order_id} foi concluído. Avalie o mecânico: {FRONTEND_URL}/dashboard"
-    return send_sms(client_phone, message)
+def sms_notification(phone: str, title: str, message: str) -> List[dict]:
+    """In-app notification mirrored to SMS"""
+    return templates.sms_batch('notification', {'title': title, 'message': message}, [{'phone': phone}])
@@ -1,6 +1,9 @@
 import socketio
 import logging
+import re
 from datetime import datetime, timezone
+from pymongo import ASCENDING, DESCENDING
+from geolocation import normalize_area
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +18,40 @@ sio = socketio.AsyncServer(
 # Store active connections
 active_users = {}  # {user_id: sid}
 
+# Pending-order feed rooms
+ALL_ORDERS_ROOM = 'orders:all'  # mechanics without area/specialties
+FEED_SNAPSHOT_LIMIT = 50
+
+def user_room(user_id: str) -> str:
+    """Every socket of a user (several tabs/devices) joins this room"""
+    return f"user:{user_id}"
+
+def area_room(area: str) -> str:
+    return f"orders:area:{area}"
+
+def specialty_room(specialty: str) -> str:
+    return f"orders:specialty:{specialty.strip().lower()}"
+
+def service_pattern(specialty: str):
+    """Matches order services the way specialty_room groups them (trimmed, any case)"""
+    return re.compile(rf"^\s*{re.escape(specialty.strip())}\s*$", re.IGNORECASE)
+
+def feed_rooms_for_order(order: dict) -> list:
+    """Rooms interested in an order: its area, its service and the catch-all room"""
+    rooms = [ALL_ORDERS_ROOM]
+    area = order.get('area') or normalize_area(order.get('location'))
+    if area:
+        rooms.append(area_room(area))
+    if order.get('service'):
+        rooms.append(specialty_room(order['service']))
+    return rooms
+
+async def ensure_feed_indexes(db):
+    """Indexes backing the pending-order snapshot query"""
+    await db.quotes.create_index([('status', ASCENDING), ('area', ASCENDING), ('created_at', DESCENDING)])
+    await db.quotes.create_index([('status', ASCENDING), ('service', ASCENDING), ('created_at', DESCENDING)])
+    await db.quotes.create_index([('status', ASCENDING), ('created_at', DESCENDING)])
+
 @sio.event
 async def connect(sid, environ):
     logger.info(f"Client connected: {sid}")
@@ -36,9 +73,79 @@ async def authenticate(sid, data):
     user_id = data.get('user_id')
     if user_id:
         active_users[user_id] = sid
+        await sio.save_session(sid, {'user_id': user_id})
+        await sio.enter_room(sid, user_room(user_id))
         await sio.emit('authenticated', {'user_id': user_id}, room=sid)
         logger.info(f"User {user_id} authenticated on socket {sid}")
 
+@sio.event
+async def subscribe_orders(sid, data=None):
+    """Mechanic subscribes to the pending-order feed.
+
+    Joins area/specialty rooms and receives one snapshot; afterwards only
+    `order_feed` deltas are pushed (new, reopened, taken).
+    """
+    try:
+        from server import db
+        session = await sio.get_session(sid)
+        user_id = session.get('user_id') or (data or {}).get('user_id')
+        if not user_id:
+            await sio.emit('error', {'message': 'Not authenticated'}, room=sid)
+            return
+        
+        mechanic = await db.users.find_one(
+            {'id': user_id, 'user_type': 'mechanic'},
+            {'_id': 0, 'location': 1, 'specialties': 1}
+        )
+        if not mechanic:
+            await sio.emit('error', {'message': 'Only mechanics can subscribe'}, room=sid)
+            return
+        
+        area = normalize_area(mechanic.get('location'))
+        specialties = [sp.strip() for sp in (mechanic.get('specialties') or []) if sp]
+        
+        query = {'status': 'pending'}
+        if area or specialties:
+            if area:
+                await sio.enter_room(sid, area_room(area))
+            for specialty in specialties:
+                await sio.enter_room(sid, specialty_room(specialty))
+            
+            matches = []
+            if area:
+                matches.append({'area': area})
+            if specialties:
+                matches.append({'service': {'$in': [service_pattern(sp) for sp in specialties]}})
+            query['$or'] = matches
+        else:
+            await sio.enter_room(sid, ALL_ORDERS_ROOM)
+        
+        orders = await db.quotes.find(query, {'_id': 0}).sort('created_at', -1).to_list(FEED_SNAPSHOT_LIMIT)
+        await sio.emit('orders_snapshot', {'orders': orders}, room=sid)
+        logger.info(f"Mechanic {user_id} subscribed to order feed ({len(orders)} orders)")
+    except Exception as e:
+        logger.error(f"Error subscribing to orders: {str(e)}")
+        await sio.emit('error', {'message': str(e)}, room=sid)
+
+async def publish_order_feed(action: str, order: dict):
+    """Push an order delta (new, reopened, taken) to interested mechanics"""
+    try:
+        payload = {'action': action, 'order_id': order['id']}
+        if action != 'taken':
+            payload['order'] = order
+        
+        # python-socketio delivers once per client even if it is in several rooms
+        await sio.emit('order_feed', payload, to=feed_rooms_for_order(order))
+    except Exception as e:
+        logger.error(f"Error publishing order feed: {str(e)}")
+
+async def push_to_user(user_id: str, event: str, data: dict):
+    """Emit to all of a user's connected sockets (no-op when offline)"""
+    try:
+        await sio.emit(event, data, to=user_room(user_id))
+    except Exception as e:
+        logger.error(f"Error pushing {event} to {user_id}: {str(e)}")
+
 @sio.event
 async def send_message(sid, data):
     """Send chat message"""
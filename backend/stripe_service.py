@@ -0,0 +1,53 @@
+import os
+import logging
+from typing import Optional
+from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutStatusResponse
+from cache import TTLCache
+from pubsub import bus
+import events
+
+logger = logging.getLogger(__name__)
+
+STRIPE_API_KEY = os.environ.get('STRIPE_API_KEY')
+# Public webhook URL; falls back to the URL of the first request that needs the client
+STRIPE_WEBHOOK_URL = os.environ.get('STRIPE_WEBHOOK_URL')
+
+# Repeated status polls within this window share one Stripe call
+STATUS_CACHE_TTL_SECONDS = 5
+
+class StripeNotConfigured(Exception):
+    pass
+
+_checkout: Optional[StripeCheckout] = None
+
+def get_stripe_checkout(webhook_url: Optional[str] = None) -> StripeCheckout:
+    """One StripeCheckout client per process"""
+    global _checkout
+    if _checkout is None:
+        api_key = STRIPE_API_KEY or os.environ.get('STRIPE_API_KEY')
+        if not api_key:
+            raise StripeNotConfigured("Stripe not configured")
+        _checkout = StripeCheckout(api_key=api_key, webhook_url=STRIPE_WEBHOOK_URL or webhook_url)
+        logger.info("Stripe checkout client created")
+    return _checkout
+
+_status_cache = TTLCache(STATUS_CACHE_TTL_SECONDS)
+
+def checkout_topic(session_id: str) -> str:
+    """Pub/sub topic announcing that a checkout session was paid"""
+    return f"checkout:{session_id}"
+
+async def fetch_checkout_status(session_id: str) -> CheckoutStatusResponse:
+    """Stripe session status, cached for a few seconds"""
+    status = _status_cache.get(session_id)
+    if status is None:
+        status = await get_stripe_checkout().get_checkout_status(session_id)
+        _status_cache.set(session_id, status)
+    return status
+
+def announce_paid(session_id: str, order_id: str = None, user_id: str = None):
+    """Wake long-poll waiters of a session once it is marked paid, and tell the payer's event stream"""
+    _status_cache.invalidate(session_id)
+    message = {"session_id": session_id, "order_id": order_id, "payment_status": "paid"}
+    bus.publish(checkout_topic(session_id), message)
+    events.publish(user_id, "payment", message)
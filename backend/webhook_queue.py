@@ -0,0 +1,262 @@
+import asyncio
+import logging
+import os
+import uuid
+import zlib
+from datetime import datetime, timezone, timedelta
+from typing import List, Optional
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from order_events import record_order_event
+from stripe_service import announce_paid
+import reminders
+
+logger = logging.getLogger(__name__)
+
+# Verified webhook events are persisted here (unique on the Stripe event id)
+# and acknowledged at once; workers apply them in the background. A worker
+# claims its batch with a lease before applying it, so with several
+# processes each event is applied by one of them. Events left behind by a
+# dead process (still queued after RECOVER_AFTER_SECONDS, or with an
+# expired lease) are swept up periodically.
+COLLECTION = 'inbound_events'
+NUM_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', '4'))
+BATCH_SIZE = int(os.environ.get('WEBHOOK_BATCH_SIZE', '50'))
+MAX_ATTEMPTS = 5
+RETRY_DELAY_SECONDS = 2
+LEASE_SECONDS = 60
+RECOVER_AFTER_SECONDS = 60
+RECOVER_INTERVAL_SECONDS = 30
+# Order statuses a payment may move to 'paid'; later ones are never rolled back
+PAYABLE_STATUSES = ['pending', 'quoted', 'approved', 'prebooked']
+
+async def ensure_indexes(db):
+    """Index used to recover unprocessed events"""
+    await db[COLLECTION].create_index([('status', ASCENDING), ('received_at', ASCENDING)])
+    await db[COLLECTION].create_index([('status', ASCENDING), ('lease_until', ASCENDING)])
+
+class WebhookQueue:
+    """Partitioned in-process queue of webhook events.
+
+    Events are routed by session id, so each checkout session is always
+    handled by the same worker, in arrival order. A failed batch is
+    retried in place, so later events of its sessions wait behind it.
+    """
+
+    def __init__(self, num_workers: int = NUM_WORKERS, batch_size: int = BATCH_SIZE):
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+        self.db = None
+        self.queues: List[asyncio.Queue] = []
+        self.tasks: List[asyncio.Task] = []
+        self.metrics = {
+            'received': 0,
+            'duplicates': 0,
+            'processed': 0,
+            'failed': 0,
+            'batches': 0,
+            'recovered': 0,
+            'skipped': 0
+        }
+
+    async def start(self, db):
+        self.db = db
+        self.queues = [asyncio.Queue() for _ in range(self.num_workers)]
+        self.tasks = [asyncio.create_task(self._worker(i)) for i in range(self.num_workers)]
+        self.tasks.append(asyncio.create_task(self._recover_loop()))
+        logger.info(f"Webhook queue started with {self.num_workers} workers")
+
+    async def _recover_loop(self):
+        while True:
+            try:
+                await self.recover()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error recovering webhook events: {str(e)}")
+            await asyncio.sleep(RECOVER_INTERVAL_SECONDS)
+
+    async def recover(self) -> int:
+        """Queue events no live worker is handling (acknowledged before a crash)"""
+        now = datetime.now(timezone.utc)
+        # Fresh queued events belong to the process that received them
+        stale = self.db[COLLECTION].find({'$or': [
+            {'status': 'queued', 'received_at': {'$lt': now - timedelta(seconds=RECOVER_AFTER_SECONDS)}},
+            {'status': 'processing', 'lease_until': {'$lt': now}}
+        ]}).sort('received_at', 1)
+        recovered = 0
+        async for event in stale:
+            # Whichever process claims it first applies it; the others skip it
+            self._enqueue(event)
+            recovered += 1
+        self.metrics['recovered'] += recovered
+        return recovered
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def _partition(self, session_id: Optional[str]) -> int:
+        return zlib.crc32((session_id or '').encode()) % self.num_workers
+
+    def _enqueue(self, event: dict):
+        self.queues[self._partition(event.get('session_id'))].put_nowait(event)
+
+    async def ingest(self, webhook_response) -> bool:
+        """Persist a verified event and queue it. Returns False for duplicates."""
+        self.metrics['received'] += 1
+        event = {
+            '_id': webhook_response.event_id,
+            'event_type': webhook_response.event_type,
+            'session_id': webhook_response.session_id,
+            'payment_status': webhook_response.payment_status,
+            'metadata': dict(webhook_response.metadata or {}),
+            'status': 'queued',
+            'attempts': 0,
+            'received_at': datetime.now(timezone.utc)
+        }
+        try:
+            await self.db[COLLECTION].insert_one(event)
+        except DuplicateKeyError:
+            self.metrics['duplicates'] += 1
+            logger.info(f"Duplicate webhook event {event['_id']} ignored")
+            return False
+
+        self._enqueue(event)
+        return True
+
+    def stats(self) -> dict:
+        depths = [q.qsize() for q in self.queues]
+        return {
+            **self.metrics,
+            'queue_depth': sum(depths),
+            'queue_depth_per_worker': depths,
+            'workers': len(self.tasks)
+        }
+
+    async def _claim(self, batch: List[dict], lease: str) -> List[dict]:
+        """Take (or renew) the lease on a batch; returns the events this worker holds"""
+        now = datetime.now(timezone.utc)
+        await self.db[COLLECTION].update_many(
+            {
+                '_id': {'$in': [event['_id'] for event in batch]},
+                '$or': [
+                    {'status': 'queued'},
+                    {'status': 'processing', 'lease_until': {'$lt': now}},
+                    {'status': 'processing', 'lease': lease}
+                ]
+            },
+            {
+                '$set': {'status': 'processing', 'lease': lease, 'lease_until': now + timedelta(seconds=LEASE_SECONDS)},
+                '$inc': {'attempts': 1}
+            }
+        )
+        held = {
+            event['_id']: event async for event in self.db[COLLECTION].find(
+                {'_id': {'$in': [event['_id'] for event in batch]}, 'lease': lease, 'status': 'processing'}
+            )
+        }
+        self.metrics['skipped'] += len(batch) - len(held)
+        # Keep arrival order
+        return [held[event['_id']] for event in batch if event['_id'] in held]
+
+    async def _worker(self, index: int):
+        queue = self.queues[index]
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            lease = str(uuid.uuid4())
+            try:
+                batch = await self._claim(batch, lease)
+                while batch:
+                    try:
+                        await self._process_batch(batch, lease)
+                        break
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        logger.error(f"Webhook worker {index} batch error: {str(e)}")
+                        batch = await self._retry(batch, lease, str(e))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Claim failed (database down): the recovery sweep picks the events up again
+                logger.error(f"Webhook worker {index} error: {str(e)}")
+
+    async def _process_batch(self, batch: List[dict], lease: str):
+        ids = [event['_id'] for event in batch]
+
+        now = datetime.now(timezone.utc).isoformat()
+        paid = [e for e in batch if e.get('payment_status') == 'paid' and e.get('session_id')]
+        transaction_ops = [
+            UpdateOne(
+                {'session_id': e['session_id']},
+                {'$set': {
+                    'payment_status': 'paid',
+                    'status': 'complete',
+                    'webhook_received': True,
+                    'updated_at': now
+                }}
+            )
+            for e in paid
+        ]
+
+        # Ordered bulk writes keep per-session arrival order
+        if transaction_ops:
+            await self.db.payment_transactions.bulk_write(transaction_ops, ordered=True)
+
+        # One conditional update per order, so a retried batch or a late
+        # redelivery neither rolls an order back nor repeats its side effects
+        paid_order_ids = []
+        for event in paid:
+            order_id = event['metadata'].get('order_id')
+            if order_id:
+                result = await self.db.quotes.update_one(
+                    {'id': order_id, 'status': {'$in': PAYABLE_STATUSES}},
+                    {'$set': {'payment_status': 'succeeded', 'status': 'paid', 'updated_at': now}}
+                )
+                if not result.modified_count:
+                    continue
+                paid_order_ids.append(order_id)
+                await record_order_event(self.db, order_id, 'paid', 'stripe', 'system', data={'session_id': event['session_id']})
+            announce_paid(event['session_id'], order_id, event['metadata'].get('user_id'))
+
+        if paid_order_ids:
+            async for order in self.db.quotes.find({'id': {'$in': paid_order_ids}}, reminders.ORDER_FIELDS):
+                await reminders.schedule_for_order(self.db, order)
+
+        await self.db[COLLECTION].update_many(
+            {'_id': {'$in': ids}, 'lease': lease},
+            {
+                '$set': {'status': 'processed', 'processed_at': datetime.now(timezone.utc)},
+                '$unset': {'lease': '', 'lease_until': ''}
+            }
+        )
+        self.metrics['processed'] += len(batch)
+        self.metrics['batches'] += 1
+
+    async def _retry(self, batch: List[dict], lease: str, error: str) -> List[dict]:
+        """Give up on exhausted events, then re-claim the rest for another attempt.
+
+        Retrying in place (rather than re-queueing at the back) keeps each
+        session's events in arrival order.
+        """
+        exhausted = [event for event in batch if event.get('attempts', 0) >= MAX_ATTEMPTS]
+        if exhausted:
+            self.metrics['failed'] += len(exhausted)
+            await self.db[COLLECTION].update_many(
+                {'_id': {'$in': [event['_id'] for event in exhausted]}, 'lease': lease},
+                {'$set': {'status': 'failed', 'error': error}, '$unset': {'lease': '', 'lease_until': ''}}
+            )
+            for event in exhausted:
+                logger.error(f"Webhook event {event['_id']} failed after {MAX_ATTEMPTS} attempts")
+        remaining = [event for event in batch if event.get('attempts', 0) < MAX_ATTEMPTS]
+        if not remaining:
+            return []
+        await asyncio.sleep(RETRY_DELAY_SECONDS * remaining[0].get('attempts', 1))
+        return await self._claim(remaining, lease)
+
+webhook_queue = WebhookQueue()
@@ -3,6 +3,7 @@ import { Bell } from 'lucide-react';
 import { Badge } from './ui/badge';
 import { Card } from './ui/card';
 import { useAuth } from '../contexts/AuthContext';
+import eventStream from '../services/events';
 
 export const NotificationBell = () => {
   const { user } = useAuth();
@@ -13,8 +14,18 @@ export const NotificationBell = () => {
   useEffect(() => {
     if (user) {
       loadNotifications();
-      const interval = setInterval(loadNotifications, 30000); // Refresh every 30s
-      return () => clearInterval(interval);
+
+      // New notifications arrive on the event stream; no polling
+      const unsubscribe = eventStream.subscribe('notification', (notif) => {
+        setNotifications((prev) => [notif, ...prev].slice(0, 50));
+        setUnreadCount((count) => count + 1);
+      });
+      // Missed events could not be replayed: reload once
+      const unsubscribeResync = eventStream.subscribe('resync', loadNotifications);
+      return () => {
+        unsubscribe();
+        unsubscribeResync();
+      };
     }
   }, [user]);
 
@@ -53,6 +64,23 @@ export const NotificationBell = () => {
     }
   };
 
+  const markAllAsRead = async () => {
+    try {
+      const API_URL = process.env.REACT_APP_BACKEND_URL;
+      const token = localStorage.getItem('token');
+
+      await fetch(`${API_URL}/api/notifications/read-all`, {
+        method: 'POST',
+        headers: { 'Authorization': `Bearer ${token}` }
+      });
+
+      setNotifications((prev) => prev.map((notif) => ({ ...notif, is_read: true })));
+      setUnreadCount(0);
+    } catch (error) {
+      console.error('Error marking notifications:', error);
+    }
+  };
+
   return (
     <div className="relative">
       <button
@@ -71,8 +99,13 @@ export const NotificationBell = () => {
         <>
           <div className="fixed inset-0 z-40" onClick={() => setIsOpen(false)} />
           <Card className="absolute right-0 top-12 w-80 max-h-96 overflow-y-auto z-50 shadow-xl">
-            <div className="p-4 border-b">
+            <div className="p-4 border-b flex items-center justify-between">
               <h3 className="font-bold">Notificações</h3>
+              {unreadCount > 0 && (
+                <button onClick={markAllAsRead} className="text-xs text-blue-600 hover:underline">
+                  Marcar todas como lidas
+                </button>
+              )}
             </div>
             <div className="divide-y">
               {notifications.length === 0 ? (
@@ -83,9 +116,9 @@ export const NotificationBell = () => {
                 notifications.map((notif) => (
                   <div
                     key={notif.id}
-                    onClick={() => !notif.read && markAsRead(notif.id)}
+                    onClick={() => !notif.is_read && markAsRead(notif.id)}
                     className={`p-4 hover:bg-gray-50 cursor-pointer ${
-                      !notif.read ? 'bg-blue-50' : ''
+                      !notif.is_read ? 'bg-blue-50' : ''
                     }`}
                   >
                     <p className="text-sm font-semibold">{notif.title}</p>
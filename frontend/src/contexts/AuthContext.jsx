@@ -1,5 +1,6 @@
 import React, { createContext, useContext, useState, useEffect } from 'react';
 import { login as apiLogin, register as apiRegister, getCurrentUser } from '../services/api';
+import eventStream from '../services/events';
 
 const AuthContext = createContext(null);
 
@@ -65,6 +66,7 @@ export const AuthProvider = ({ children }) => {
     setToken(null);
     setUser(null);
     localStorage.removeItem('token');
+    eventStream.disconnect();
   };
 
   const value = {
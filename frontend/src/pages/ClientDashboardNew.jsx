@@ -8,6 +8,7 @@ import { Badge } from '../components/ui/badge';
 import { useAuth } from '../contexts/AuthContext';
 import { ReviewModal } from '../components/ReviewModal';
 import { toast } from '../hooks/use-toast';
+import eventStream from '../services/events';
 import { Car, MapPin, Clock, DollarSign, Loader2, CheckCircle, X, Star } from 'lucide-react';
 
 export const ClientDashboard = () => {
@@ -20,6 +21,11 @@ export const ClientDashboard = () => {
 
   useEffect(() => {
     loadOrders();
+    // Reload when one of the orders changes status or a payment lands
+    const unsubscribers = ['order_status', 'payment', 'resync'].map((event) =>
+      eventStream.subscribe(event, loadOrders)
+    );
+    return () => unsubscribers.forEach((unsubscribe) => unsubscribe());
   }, []);
 
   const loadOrders = async () => {
@@ -8,6 +8,7 @@ import { useAuth } from '../contexts/AuthContext';
 import { useNavigate } from 'react-router-dom';
 import { SendQuoteModal } from '../components/SendQuoteModal';
 import { toast } from '../hooks/use-toast';
+import socketService from '../services/socket';
 import { Car, MapPin, Clock, CheckCircle, Loader2, DollarSign, AlertCircle, Calendar } from 'lucide-react';
 
 export const MechanicDashboard = () => {
@@ -24,6 +25,19 @@ export const MechanicDashboard = () => {
     loadOrders();
   }, []);
 
+  // Live pending-order feed: one snapshot, then deltas
+  useEffect(() => {
+    if (!user?.id) return;
+    socketService.connect(user.id);
+    socketService.subscribeOrders(user.id, setAvailableOrders, ({ action, order_id, order }) => {
+      setAvailableOrders((orders) => {
+        const others = orders.filter((o) => o.id !== order_id);
+        return action === 'taken' ? others : [order, ...others];
+      });
+    });
+    return () => socketService.unsubscribeOrders();
+  }, [user?.id]);
+
   const loadOrders = async () => {
     try {
       const API_URL = process.env.REACT_APP_BACKEND_URL;
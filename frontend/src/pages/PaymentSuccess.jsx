@@ -9,7 +9,6 @@ export const PaymentSuccess = () => {
   const [searchParams] = useSearchParams();
   const navigate = useNavigate();
   const [status, setStatus] = useState('checking'); // checking, success, error
-  const [attempts, setAttempts] = useState(0);
   const sessionId = searchParams.get('session_id');
 
   useEffect(() => {
@@ -21,52 +20,50 @@ export const PaymentSuccess = () => {
   }, [sessionId]);
 
   const pollPaymentStatus = async () => {
-    const maxAttempts = 5;
-    const pollInterval = 2000; // 2 seconds
-
-    if (attempts >= maxAttempts) {
-      setStatus('error');
-      toast({
-        title: "Tempo esgotado",
-        description: "Verifique seu dashboard em alguns minutos.",
-        variant: "destructive"
-      });
-      return;
-    }
+    // Each request is held open by the server until the webhook confirms payment
+    const maxAttempts = 3;
+    const API_URL = process.env.REACT_APP_BACKEND_URL;
+    const token = localStorage.getItem('token');
 
     try {
-      const API_URL = process.env.REACT_APP_BACKEND_URL;
-      const token = localStorage.getItem('token');
+      for (let attempt = 0; attempt < maxAttempts; attempt++) {
+        const response = await fetch(`${API_URL}/api/stripe/status/${sessionId}/wait?timeout=25`, {
+          headers: {
+            'Authorization': `Bearer ${token}`
+          }
+        });
 
-      const response = await fetch(`${API_URL}/api/stripe/status/${sessionId}`, {
-        headers: {
-          'Authorization': `Bearer ${token}`
-        }
-      });
+        const data = await response.json();
 
-      const data = await response.json();
+        if (data.success && data.payment_status === 'paid') {
+          setStatus('success');
+          toast({
+            title: "✅ Pagamento Confirmado!",
+            description: "R$ 50,00 pagos com sucesso. Você receberá propostas de mecânicos em breve."
+          });
+          
+          // Clear any pending booking
+          localStorage.removeItem('pendingBooking');
 
-      if (data.success && data.payment_status === 'paid') {
-        setStatus('success');
-        toast({
-          title: "✅ Pagamento Confirmado!",
-          description: "R$ 50,00 pagos com sucesso. Você receberá propostas de mecânicos em breve."
-        });
-        
-        // Clear any pending booking
-        localStorage.removeItem('pendingBooking');
+          // Redirect to dashboard after 3 seconds
+          setTimeout(() => {
+            navigate('/dashboard');
+          }, 3000);
+          return;
+        }
 
-        // Redirect to dashboard after 3 seconds
-        setTimeout(() => {
-          navigate('/dashboard');
-        }, 3000);
-      } else if (data.status === 'expired') {
-        setStatus('error');
-      } else {
-        // Still pending, continue polling
-        setAttempts(attempts + 1);
-        setTimeout(pollPaymentStatus, pollInterval);
+        if (!response.ok || data.status === 'expired') {
+          setStatus('error');
+          return;
+        }
       }
+
+      setStatus('error');
+      toast({
+        title: "Tempo esgotado",
+        description: "Verifique seu dashboard em alguns minutos.",
+        variant: "destructive"
+      });
     } catch (error) {
       console.error('Error checking payment:', error);
       setStatus('error');
@@ -0,0 +1,50 @@
+const API_URL = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
+
+// One EventSource per tab for notifications, order status and payments.
+// The browser reconnects on its own and sends Last-Event-ID, so missed
+// events are replayed by the server.
+class EventStream {
+  constructor() {
+    this.source = null;
+    this.handlers = {};
+  }
+
+  connect() {
+    const token = localStorage.getItem('token');
+    if (this.source || !token) {
+      return;
+    }
+    this.source = new EventSource(`${API_URL}/api/events/stream?token=${encodeURIComponent(token)}`);
+
+    ['notification', 'order_status', 'payment', 'resync'].forEach((event) => {
+      this.source.addEventListener(event, (e) => {
+        const data = e.data ? JSON.parse(e.data) : {};
+        (this.handlers[event] || []).forEach((callback) => callback(data));
+      });
+    });
+
+    this.source.onerror = () => {
+      // Closed for good (e.g. expired token): drop it so the next subscribe reconnects
+      if (this.source && this.source.readyState === EventSource.CLOSED) {
+        this.source = null;
+      }
+    };
+  }
+
+  subscribe(event, callback) {
+    this.handlers[event] = [...(this.handlers[event] || []), callback];
+    this.connect();
+    return () => {
+      this.handlers[event] = (this.handlers[event] || []).filter((cb) => cb !== callback);
+    };
+  }
+
+  disconnect() {
+    if (this.source) {
+      this.source.close();
+      this.source = null;
+    }
+  }
+}
+
+export default new EventStream();
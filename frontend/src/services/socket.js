@@ -6,6 +6,7 @@ class SocketService {
   constructor() {
     this.socket = null;
     this.listeners = {};
+    this.orderHandlers = null;
   }
 
   connect(userId) {
@@ -62,6 +63,46 @@ class SocketService {
     }
   }
 
+  onNotification(callback) {
+    if (this.socket) {
+      this.socket.on('notification', callback);
+    }
+  }
+
+  offNotification(callback) {
+    if (this.socket) {
+      this.socket.off('notification', callback);
+    }
+  }
+
+  subscribeOrders(userId, onSnapshot, onDelta) {
+    if (this.socket) {
+      this.unsubscribeOrders();
+      this.orderHandlers = {
+        snapshot: (data) => onSnapshot(data.orders),
+        delta: onDelta,
+        // Re-subscribe after reconnects
+        resubscribe: () => {
+          this.socket.emit('subscribe_orders', { user_id: userId });
+        }
+      };
+      this.socket.on('orders_snapshot', this.orderHandlers.snapshot);
+      this.socket.on('order_feed', this.orderHandlers.delta);
+      this.socket.on('authenticated', this.orderHandlers.resubscribe);
+      this.socket.emit('subscribe_orders', { user_id: userId });
+    }
+  }
+
+  unsubscribeOrders() {
+    // Only our own handlers: other listeners on these events stay attached
+    if (this.socket && this.orderHandlers) {
+      this.socket.off('orders_snapshot', this.orderHandlers.snapshot);
+      this.socket.off('order_feed', this.orderHandlers.delta);
+      this.socket.off('authenticated', this.orderHandlers.resubscribe);
+    }
+    this.orderHandlers = null;
+  }
+
   markRead(orderId, userId) {
     if (this.socket) {
       this.socket.emit('mark_read', {
@@ -0,0 +1,55 @@
+import io from 'socket.io-client';
+import socketService from './socket';
+
+jest.mock('socket.io-client');
+
+// Just enough of a Socket.IO client: off(event) without a handler drops
+// every listener of the event, like the real one
+const fakeSocket = () => {
+  const listeners = {};
+  return {
+    listeners,
+    on: jest.fn((event, fn) => {
+      (listeners[event] = listeners[event] || []).push(fn);
+    }),
+    off: jest.fn((event, fn) => {
+      listeners[event] = fn ? (listeners[event] || []).filter((l) => l !== fn) : [];
+    }),
+    emit: jest.fn(),
+    disconnect: jest.fn(),
+    fire: (event, data) => (listeners[event] || []).forEach((fn) => fn(data)),
+  };
+};
+
+afterEach(() => {
+  socketService.unsubscribeOrders();
+  socketService.disconnect();
+});
+
+test('unsubscribing the order feed keeps handlers registered by others', () => {
+  const socket = fakeSocket();
+  io.mockReturnValue(socket);
+  socketService.connect('m1');
+
+  const foreign = { snapshot: jest.fn(), delta: jest.fn(), authenticated: jest.fn() };
+  socket.on('orders_snapshot', foreign.snapshot);
+  socket.on('order_feed', foreign.delta);
+  socket.on('authenticated', foreign.authenticated);
+
+  const onSnapshot = jest.fn();
+  const onDelta = jest.fn();
+  socketService.subscribeOrders('m1', onSnapshot, onDelta);
+  socketService.unsubscribeOrders();
+
+  socket.fire('orders_snapshot', { orders: [] });
+  socket.fire('order_feed', { action: 'taken' });
+  socket.fire('authenticated', {});
+
+  expect(foreign.snapshot).toHaveBeenCalledTimes(1);
+  expect(foreign.delta).toHaveBeenCalledTimes(1);
+  expect(foreign.authenticated).toHaveBeenCalledTimes(1);
+  // The feed's own handlers are gone
+  expect(onSnapshot).not.toHaveBeenCalled();
+  expect(onDelta).not.toHaveBeenCalled();
+  expect(socket.emit).toHaveBeenCalledTimes(1);
+});
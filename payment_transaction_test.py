@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+QuickMechanic - Transactional Payment Test
+Benchmarks payments/second under concurrency and checks crash consistency
+of payments.apply_payment against a local MongoDB replica set.
+
+    MONGO_URL="mongodb://localhost:27017/?replicaSet=rs0" python payment_transaction_test.py
+"""
+
+import asyncio
+import os
+import sys
+import time
+from uuid import uuid4
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from models import Payment
+from payments import apply_payment, ensure_indexes
+
+MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/?replicaSet=rs0')
+DB_NAME = os.environ.get('TEST_DB_NAME', 'quickmechanic_payment_test')
+TOTAL_PAYMENTS = int(os.environ.get('TOTAL_PAYMENTS', '2000'))
+CONCURRENCY = int(os.environ.get('CONCURRENCY', '50'))
+MECHANICS = 20
+
+class SimulatedCrash(Exception):
+    pass
+
+class CrashingCollection:
+    """Collection proxy that fails on update_one, like a process dying mid-payment"""
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    async def update_one(self, *args, **kwargs):
+        raise SimulatedCrash("crash before wallet credit")
+
+class CrashingDB:
+    def __init__(self, db, crash_collection):
+        self._db = db
+        self._crash_collection = crash_collection
+
+    def __getattr__(self, name):
+        collection = self._db[name]
+        return CrashingCollection(collection) if name == self._crash_collection else collection
+
+async def create_orders(db, count):
+    orders = [
+        {
+            "id": str(uuid4()),
+            "client_id": "client-bench",
+            "mechanic_id": f"mechanic-{i % MECHANICS}",
+            "status": "approved",
+            "final_price": 200.0
+        }
+        for i in range(count)
+    ]
+    await db.quotes.insert_many(orders)
+    return orders
+
+def final_payment(order):
+    return Payment(
+        quote_id=order["id"],
+        client_id=order["client_id"],
+        amount=200.0,
+        payment_method="mock",
+        payment_type="final",
+        platform_fee=40.0,
+        mechanic_earnings=160.0
+    )
+
+async def run_throughput_benchmark(client, db):
+    """Payments per second with CONCURRENCY in-flight transactions"""
+    print(f"\n1. Benchmark: {TOTAL_PAYMENTS} payments, concurrency {CONCURRENCY}...")
+    orders = await create_orders(db, TOTAL_PAYMENTS)
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def pay(order):
+        async with semaphore:
+            await apply_payment(db, client, final_payment(order), {"status": "paid"}, order["mechanic_id"])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(pay(order) for order in orders))
+    elapsed = time.perf_counter() - started
+
+    payments = await db.payments.count_documents({})
+    paid = await db.quotes.count_documents({"status": "paid"})
+    wallets = await db.wallets.find({}, {"_id": 0}).to_list(MECHANICS)
+    credited = sum(w["pending_balance"] for w in wallets)
+    entries = await db.ledger_entries.count_documents({})
+
+    ok = (
+        payments == paid == TOTAL_PAYMENTS
+        and len(wallets) == MECHANICS
+        and credited == 160.0 * TOTAL_PAYMENTS
+        and entries == 2 * TOTAL_PAYMENTS
+    )
+    print(f"   {TOTAL_PAYMENTS / elapsed:.0f} payments/s ({elapsed:.2f}s)")
+    print(f"{'✅' if ok else '❌'} payments={payments} paid_orders={paid} wallets={len(wallets)} "
+          f"credited={credited:.2f} ledger_entries={entries}")
+    return ok
+
+async def run_crash_consistency_check(client, db):
+    """A failure between writes must leave no payment, order or wallet change"""
+    print("\n2. Crash consistency...")
+    [order] = await create_orders(db, 1)
+    payments_before = await db.payments.count_documents({})
+    entries_before = await db.ledger_entries.count_documents({})
+    wallet_before = await db.wallets.find_one({"mechanic_id": order["mechanic_id"]}, {"_id": 0})
+
+    try:
+        await apply_payment(
+            CrashingDB(db, "wallets"), client, final_payment(order), {"status": "paid"}, order["mechanic_id"]
+        )
+        print("❌ Simulated crash did not happen")
+        return False
+    except SimulatedCrash:
+        pass
+
+    payments_after = await db.payments.count_documents({})
+    entries_after = await db.ledger_entries.count_documents({})
+    quote_after = await db.quotes.find_one({"id": order["id"]}, {"_id": 0})
+    wallet_after = await db.wallets.find_one({"mechanic_id": order["mechanic_id"]}, {"_id": 0})
+
+    ok = (
+        payments_after == payments_before
+        and entries_after == entries_before
+        and quote_after["status"] == "approved"
+        and wallet_after == wallet_before
+    )
+    print(f"{'✅' if ok else '❌'} payments unchanged={payments_after == payments_before} "
+          f"order status={quote_after['status']} wallet unchanged={wallet_after == wallet_before}")
+    return ok
+
+async def main():
+    print("🚀 Testing transactional payments")
+    print("=" * 70)
+    client = AsyncIOMotorClient(MONGO_URL)
+    await client.drop_database(DB_NAME)
+    db = client[DB_NAME]
+    await ensure_indexes(db)
+
+    try:
+        results = [
+            await run_throughput_benchmark(client, db),
+            await run_crash_consistency_check(client, db)
+        ]
+    finally:
+        await client.drop_database(DB_NAME)
+
+    print("\n" + "=" * 70)
+    print(f"{sum(results)}/{len(results)} checks passed")
+    return all(results)
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
@@ -0,0 +1,49 @@
+import asyncio
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pydantic import ValidationError
+import availability
+from availability import IntervalIndex, SlotConflictError
+from models import AvailabilityUpdate
+
+def test_slot_step_must_be_positive_and_bounded():
+    for step in (0, -15, availability.MAX_SLOT_STEP_MINUTES + 1):
+        with pytest.raises(ValidationError):
+            AvailabilityUpdate(working_hours=[], slot_step_minutes=step)
+    assert AvailabilityUpdate(working_hours=[], slot_step_minutes=15).slot_step_minutes == 15
+
+def test_free_slots_refuses_a_step_that_would_never_advance():
+    with pytest.raises(ValueError):
+        list(IntervalIndex().free_slots(480, 1080, 60, 0))
+
+def test_overlapping_reservations_conflict_across_concurrent_requests():
+    async def scenario():
+        db = AsyncMongoMockClient()['test']
+        results = await asyncio.gather(
+            availability.reserve(db, 'm1', '2026-10-20', '10:00', 60, 'order-a'),
+            availability.reserve(db, 'm1', '2026-10-20', '10:30', 60, 'order-b'),
+            return_exceptions=True
+        )
+        assert sum(isinstance(r, SlotConflictError) for r in results) == 1
+
+        # Adjacent slot and re-quoting the same order are fine
+        await availability.reserve(db, 'm1', '2026-10-20', '12:00', 60, 'order-c')
+        await availability.reserve(db, 'm1', '2026-10-20', '12:00', 90, 'order-c')
+
+        # Releasing frees the interval again
+        winner = 'order-a' if results[0] is None else 'order-b'
+        await availability.release(db, 'm1', '2026-10-20', winner)
+        await availability.reserve(db, 'm1', '2026-10-20', '10:30', 60, 'order-d')
+    asyncio.run(scenario())
+
+def test_requoting_an_order_ignores_its_own_interval():
+    async def scenario():
+        db = AsyncMongoMockClient()['test']
+        await db.quotes.insert_many([
+            {'id': 'o1', 'mechanic_id': 'm1', 'date': '2026-10-20', 'time': '10:00', 'status': 'quoted'},
+            {'id': 'o2', 'mechanic_id': 'm1', 'date': '2026-10-20', 'time': '14:00', 'status': 'paid'}
+        ])
+        await availability.check_booking(db, 'm1', '2026-10-20', '10:00', 60, order_id='o1')
+        with pytest.raises(SlotConflictError):
+            await availability.check_booking(db, 'm1', '2026-10-20', '14:00', 60, order_id='o1')
+    asyncio.run(scenario())
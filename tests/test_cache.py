@@ -0,0 +1,40 @@
+import asyncio
+from cache import TTLCache
+
+def test_cancelling_the_first_caller_does_not_cancel_the_shared_compute():
+    async def scenario():
+        cache = TTLCache(60)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'value'
+
+        first = asyncio.create_task(cache.get_or_compute('k', compute))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(cache.get_or_compute('k', compute))
+        await asyncio.sleep(0)
+        first.cancel()
+
+        assert await second == 'value'
+        assert first.cancelled()
+        assert calls == [1]
+        assert cache.get('k') == 'value'
+    asyncio.run(scenario())
+
+def test_failures_reach_every_waiter_and_are_not_cached():
+    async def scenario():
+        cache = TTLCache(60)
+
+        async def compute():
+            await asyncio.sleep(0.01)
+            raise RuntimeError('down')
+
+        results = await asyncio.gather(
+            cache.get_or_compute('k', compute), cache.get_or_compute('k', compute), return_exceptions=True
+        )
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert cache.get('k') is None
+        assert not cache._inflight
+    asyncio.run(scenario())
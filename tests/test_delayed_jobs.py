@@ -0,0 +1,130 @@
+import asyncio
+import random
+import time
+from datetime import datetime, timezone, timedelta
+from mongomock_motor import AsyncMongoMockClient
+import delayed_jobs
+import reminders
+from delayed_jobs import DelayedJobQueue, TimingWheel
+
+def test_timing_wheel_fires_every_entry_on_its_tick():
+    rng = random.Random(7)
+    for sizes in ((60, 60, 24), (4, 3, 2)):
+        wheel = TimingWheel(sizes=sizes)
+        start = wheel.current
+        horizon = int(wheel.horizon_seconds)
+        expected = {}
+        for i in range(500):
+            due = start + rng.randint(1, horizon + 5)
+            if wheel.add(f'k{i}', due - rng.random() * 0.99, i):
+                expected[f'k{i}'] = due
+            else:
+                # The top level reaches at least one full coarse slot short of the horizon
+                assert due - start > horizon - wheel.spans[-1]
+        # Some get moved or removed along the way
+        for key in rng.sample(sorted(expected), 50):
+            wheel.remove(key)
+            del expected[key]
+
+        fired = {}
+        tick = start
+        while tick < start + horizon + 10:
+            tick += rng.randint(1, 3)
+            for key, _ in wheel.advance(tick):
+                assert key not in fired
+                fired[key] = tick
+                assert expected[key] <= tick
+                # Never later than the tick we were advanced to
+                assert expected[key] > tick - 3
+        assert set(fired) == set(expected)
+        assert len(wheel) == 0
+
+def test_timing_wheel_refuses_entries_already_due():
+    wheel = TimingWheel()
+    assert not wheel.add('past', time.time() - 5, None)
+    assert len(wheel) == 0
+
+def _queue(db, monkeypatch):
+    queue = DelayedJobQueue(lookahead_seconds=600)
+    queue.db = db
+    queue.wheel = TimingWheel()
+    monkeypatch.setattr(delayed_jobs, 'delayed_queue', queue)
+    return queue
+
+def test_loader_fires_due_jobs_through_their_handler(monkeypatch):
+    ran = []
+
+    async def test_job(db, payload):
+        ran.append(payload['n'])
+    monkeypatch.setitem(delayed_jobs.HANDLERS, 'test_job', test_job)
+
+    async def scenario():
+        db = AsyncMongoMockClient()['test']
+        now = datetime.now(timezone.utc)
+        await db[delayed_jobs.COLLECTION].insert_many([
+            {'_id': 'due', 'kind': 'test_job', 'run_at': now - timedelta(seconds=1), 'payload': {'n': 1}, 'status': 'scheduled', 'attempts': 0},
+            {'_id': 'later', 'kind': 'test_job', 'run_at': now + timedelta(hours=2), 'payload': {'n': 2}, 'status': 'scheduled', 'attempts': 0}
+        ])
+        queue = _queue(db, monkeypatch)
+        await queue.load()
+        await asyncio.gather(*queue.running)
+        assert ran == [1]
+        jobs = {j['_id']: j async for j in db[delayed_jobs.COLLECTION].find()}
+        assert jobs['due']['status'] == 'done'
+        assert jobs['later']['status'] == 'scheduled'
+        assert queue.wheel.due_tick('later') is None
+    asyncio.run(scenario())
+
+def test_rescheduling_a_running_job_applies_after_the_run(monkeypatch):
+    async def scenario():
+        db = AsyncMongoMockClient()['test']
+        queue = _queue(db, monkeypatch)
+        started, finish = asyncio.Event(), asyncio.Event()
+
+        async def slow_job(db, payload):
+            started.set()
+            await finish.wait()
+        monkeypatch.setitem(delayed_jobs.HANDLERS, 'slow_job', slow_job)
+
+        await delayed_jobs.schedule(db, 'slow_job', 'slow', datetime.now(timezone.utc) - timedelta(seconds=1))
+        await asyncio.wait_for(started.wait(), 1)
+
+        later = datetime.now(timezone.utc) + timedelta(minutes=5)
+        await delayed_jobs.schedule(db, 'slow_job', 'slow', later, {'n': 2})
+        finish.set()
+        await asyncio.gather(*queue.running)
+
+        job = await db[delayed_jobs.COLLECTION].find_one({'_id': 'slow'})
+        assert job['status'] == 'scheduled'
+        assert job['payload'] == {'n': 2}
+        assert 'next' not in job
+        assert queue.wheel.due_tick('slow') is not None
+    asyncio.run(scenario())
+
+def test_cancelling_a_running_job_drops_its_reschedule(monkeypatch):
+    async def scenario():
+        db = AsyncMongoMockClient()['test']
+        queue = _queue(db, monkeypatch)
+        started, finish = asyncio.Event(), asyncio.Event()
+
+        async def slow_job(db, payload):
+            started.set()
+            await finish.wait()
+        monkeypatch.setitem(delayed_jobs.HANDLERS, 'slow_job', slow_job)
+
+        await delayed_jobs.schedule(db, 'slow_job', 'slow', datetime.now(timezone.utc) - timedelta(seconds=1))
+        await asyncio.wait_for(started.wait(), 1)
+        await delayed_jobs.schedule(db, 'slow_job', 'slow', datetime.now(timezone.utc) + timedelta(minutes=5))
+
+        assert await delayed_jobs.cancel(db, 'slow')
+        finish.set()
+        await asyncio.gather(*queue.running)
+
+        job = await db[delayed_jobs.COLLECTION].find_one({'_id': 'slow'})
+        assert job['status'] == 'done'
+        assert queue.wheel.due_tick('slow') is None
+    asyncio.run(scenario())
+
+def test_reminders_use_the_service_timezone():
+    starts_at = reminders.service_time({'date': '2026-10-20', 'time': '14:00'})
+    assert starts_at == datetime(2026, 10, 20, 17, 0, tzinfo=timezone.utc)
@@ -0,0 +1,31 @@
+import asyncio
+import csv
+import io
+from mongomock_motor import AsyncMongoMockClient
+import exports
+
+def test_csv_export_resumes_from_the_last_rows_cursor():
+    async def collect(db, after):
+        query = exports.build_query(after=exports.parse_after(after))
+        body = b''.join([chunk async for chunk in exports.stream_csv(db, 'reviews', query, batch_size=2)])
+        return list(csv.DictReader(io.StringIO(body.decode())))
+
+    async def scenario():
+        db = AsyncMongoMockClient()['test']
+        await db.reviews.insert_many([
+            {'id': f'r{i}', 'created_at': f'2026-10-0{i}T10:00:00+00:00', 'rating': 5} for i in range(1, 6)
+        ])
+        first = await collect(db, None)
+        assert len(first) == 5
+        cursor = first[2]['cursor']
+        assert '+' not in cursor and ',' not in cursor
+        assert [row['id'] for row in await collect(db, cursor)] == ['r4', 'r5']
+    asyncio.run(scenario())
+
+def test_malformed_cursor_is_rejected():
+    for after in ('2026-10-01T10:00:00+00:00,r1', exports.encode_cursor('only-one')):
+        try:
+            exports.parse_after(after)
+        except exports.ExportError:
+            continue
+        raise AssertionError(f"accepted {after!r}")
@@ -0,0 +1,44 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+from mongomock_motor import AsyncMongoMockClient
+import idempotency
+
+def test_a_taken_over_owner_cannot_release_or_complete_the_new_claim():
+    async def scenario():
+        db = AsyncMongoMockClient()['test']
+        record_id = 'payments:u1:k1'
+        started, fail = asyncio.Event(), asyncio.Event()
+
+        async def slow_failure():
+            started.set()
+            await fail.wait()
+            raise RuntimeError('gateway timeout')
+
+        first = asyncio.create_task(idempotency.run_idempotent(db, 'k1', 'u1', 'payments', 'f', slow_failure))
+        await started.wait()
+        # The first request outlives the in-progress timeout
+        stale = datetime.now(timezone.utc) - timedelta(seconds=idempotency.IN_PROGRESS_TIMEOUT_SECONDS + 1)
+        await db[idempotency.COLLECTION].update_one({'_id': record_id}, {'$set': {'created_at': stale}})
+
+        taken, finish = asyncio.Event(), asyncio.Event()
+
+        async def second_handler():
+            taken.set()
+            await finish.wait()
+            return {'paid': True}
+
+        second = asyncio.create_task(idempotency.run_idempotent(db, 'k1', 'u1', 'payments', 'f', second_handler))
+        await taken.wait()
+
+        fail.set()
+        try:
+            await first
+        except RuntimeError:
+            pass
+        assert (await db[idempotency.COLLECTION].find_one({'_id': record_id}))['status'] == 'in_progress'
+
+        finish.set()
+        assert await second == {'paid': True}
+        record = await db[idempotency.COLLECTION].find_one({'_id': record_id})
+        assert record['status'] == 'completed' and record['response'] == {'paid': True}
+    asyncio.run(scenario())
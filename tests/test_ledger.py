@@ -0,0 +1,22 @@
+import asyncio
+from mongomock_motor import AsyncMongoMockClient
+import ledger
+
+TS = '2026-10-19T12:00:00+00:00'
+
+def test_paging_does_not_skip_entries_that_share_a_ts():
+    async def scenario():
+        db = AsyncMongoMockClient()['test']
+        # Both sides of a release land on the mechanic's accounts with one ts
+        for i in range(3):
+            await ledger.post_entries(db, ledger.release_entries('m1', 10.0 + i, f'run{i}', TS))
+
+        seen, before = [], None
+        while True:
+            page = await ledger.list_entries(db, 'm1', before, limit=4)
+            if not page:
+                break
+            seen += [entry['id'] for entry in page]
+            before = (page[-1]['ts'], page[-1]['id'])
+        assert len(seen) == len(set(seen)) == 6
+    asyncio.run(scenario())
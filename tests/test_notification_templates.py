@@ -0,0 +1,31 @@
+import notification_templates as templates
+
+def _deliver(message: dict) -> dict:
+    """What SendGrid sends: every tag replaced by the recipient's value"""
+    delivered = {}
+    for part in ('subject', 'html', 'text'):
+        body = message[part]
+        for tag, value in message['substitutions'].items():
+            body = body.replace(tag, value)
+        delivered[part] = body
+    return delivered
+
+def test_per_recipient_fields_keep_their_format_spec():
+    recipients = [{'email': 'ana@example.com', 'name': 'Ana', 'price': 150}]
+    message = _deliver(templates.email_batch('quote_received', {'order_id': 'o1', 'mechanic_name': 'Zé', 'url': 'u'}, recipients)[0])
+    rendered = templates.render('quote_received', {**recipients[0], 'order_id': 'o1', 'mechanic_name': 'Zé', 'url': 'u'})
+    assert 'R$ 150.00' in message['text']
+    assert message == {part: rendered[part] for part in ('subject', 'html', 'text')}
+
+def test_html_values_are_escaped_shared_and_per_recipient():
+    script = '<script>alert(1)</script>'
+    recipients = [{'email': 'ana@example.com', 'name': script}]
+    message = templates.email_batch('notification', {'title': 'Hi', 'message': script}, recipients)[0]
+    assert script not in message['html']
+    assert '&lt;script&gt;' in message['html']
+
+    message = _deliver(templates.email_batch('new_order', {'order_id': 'o1', 'service': script, 'location': 'SP', 'url': 'u'}, recipients)[0])
+    assert script not in message['html']
+    assert message['html'].count('&lt;script&gt;') == 2
+    # Plain text is left as written
+    assert script in message['text']
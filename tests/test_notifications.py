@@ -0,0 +1,88 @@
+import asyncio
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import BulkWriteError
+import notifications
+
+def _notification(user_id: str, is_read: bool = False) -> dict:
+    doc = notifications.build(user_id, 'Title', 'Message')
+    doc['is_read'] = is_read
+    return doc
+
+def test_first_increment_counts_existing_unread_notifications():
+    async def scenario():
+        db = AsyncMongoMockClient()['test']
+        collection = db[notifications.COLLECTION]
+        await collection.insert_many([_notification('u1'), _notification('u1'), _notification('u1', is_read=True)])
+
+        new = [_notification('u1')]
+        await collection.insert_many(new)
+        await notifications.increment_unread(db, new)
+        assert await notifications.unread_count(db, 'u1') == 3
+
+        # Later increments add to the seeded counter
+        newer = [_notification('u1'), _notification('u2')]
+        await collection.insert_many(newer)
+        await notifications.increment_unread(db, newer)
+        assert await notifications.unread_count(db, 'u1') == 4
+        assert await notifications.unread_count(db, 'u2') == 1
+    asyncio.run(scenario())
+
+def test_migration_recounts_counters_once():
+    async def scenario():
+        db = AsyncMongoMockClient()['test']
+        await db[notifications.COLLECTION].insert_many([_notification('u1'), _notification('u1')])
+        # Left behind by the old upserting increment
+        await db[notifications.COUNTERS].insert_one({'_id': 'u1', 'unread': 0})
+
+        await notifications.migrate(db)
+        assert await notifications.unread_count(db, 'u1') == 2
+
+        await db[notifications.COUNTERS].update_one({'_id': 'u1'}, {'$set': {'unread': 7}})
+        await notifications.migrate(db)
+        assert await notifications.unread_count(db, 'u1') == 7
+    asyncio.run(scenario())
+
+def test_only_the_failed_documents_of_a_batch_are_retried(monkeypatch):
+    monkeypatch.setattr(notifications, 'STORE_BACKOFF_SECONDS', 0)
+
+    async def scenario():
+        db = AsyncMongoMockClient()['test']
+        inserted = []
+
+        class FlakyCollection:
+            """Stores the first document of each call, fails the rest once"""
+            def __init__(self):
+                self.calls = 0
+
+            async def insert_many(self, docs, ordered=True):
+                self.calls += 1
+                inserted.extend(doc['id'] for doc in docs[:1 if self.calls == 1 else None])
+                if self.calls == 1 and len(docs) > 1:
+                    raise BulkWriteError({'writeErrors': [{'index': i, 'code': 6} for i in range(1, len(docs))]})
+
+        class FlakyDb:
+            def __init__(self):
+                self.collection = FlakyCollection()
+
+            def __getitem__(self, name):
+                return self.collection if name == notifications.COLLECTION else db[name]
+
+        dispatcher = notifications.NotificationDispatcher()
+        dispatcher.db = FlakyDb()
+        batch = [(_notification(f'u{i}'), None) for i in range(3)]
+        stored = await dispatcher._store(batch)
+        assert stored == batch
+        assert sorted(inserted) == sorted(doc['id'] for doc, _ in batch)
+        assert dispatcher.db.collection.calls == 2
+    asyncio.run(scenario())
+
+def test_a_retried_document_that_was_written_counts_as_stored():
+    async def scenario():
+        db = AsyncMongoMockClient()['test']
+        dispatcher = notifications.NotificationDispatcher()
+        dispatcher.db = db
+        batch = [(_notification('u1'), None), (_notification('u2'), None)]
+        await db[notifications.COLLECTION].insert_one({**batch[0][0], '_id': batch[0][0]['id']})
+        assert await dispatcher._store(batch) == batch
+        assert await db[notifications.COLLECTION].count_documents({}) == 2
+    asyncio.run(scenario())
@@ -0,0 +1,37 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+from mongomock_motor import AsyncMongoMockClient
+import order_events
+from order_events import EventTail, read_events
+
+def _event(position: int, age_seconds: float = 0) -> dict:
+    created_at = datetime.now(timezone.utc) - timedelta(seconds=age_seconds)
+    return {'order_id': f'o{position}', 'seq': 1, 'position': position, 'created_at': created_at.isoformat()}
+
+def test_tail_waits_for_an_event_that_commits_out_of_order():
+    async def scenario():
+        db = AsyncMongoMockClient()['test']
+        collection = db[order_events.EVENTS_COLLECTION]
+        tail = EventTail(db, 'test')
+        # Position 2 was allocated first but commits after 3
+        await collection.insert_many([_event(1), _event(3)])
+
+        batch = await tail.next_batch()
+        assert [e['position'] for e in batch] == [1]
+        await tail.commit(batch[-1]['position'])
+
+        await collection.insert_one(_event(2))
+        assert [e['position'] for e in await tail.next_batch()] == [2, 3]
+    asyncio.run(scenario())
+
+def test_gap_left_by_a_failed_insert_is_skipped_after_the_grace_period():
+    async def scenario():
+        db = AsyncMongoMockClient()['test']
+        collection = db[order_events.EVENTS_COLLECTION]
+        await collection.insert_many([
+            _event(1, age_seconds=60),
+            _event(3, age_seconds=order_events.GAP_GRACE_SECONDS + 1),
+            _event(5)
+        ])
+        assert [e['position'] for e in await read_events(db, 0)] == [1, 3]
+    asyncio.run(scenario())
@@ -0,0 +1,94 @@
+import asyncio
+from mongomock_motor import AsyncMongoMockClient
+import outbox
+from outbox import Outbox, FakeProvider, ProviderError
+
+def run(coro):
+    return asyncio.run(coro)
+
+async def _outbox(n: int, provider):
+    db = AsyncMongoMockClient()['test']
+    await db[outbox.COLLECTION].insert_many([outbox.sms_message(f'+55110000{i:04d}', f'msg {i}') for i in range(n)])
+    sender = Outbox(num_workers=1, batch_size=100)
+    sender.db = db
+    sender.providers = {'sms': provider}
+    return db, sender
+
+async def _statuses(db):
+    return {m['_id']: m async for m in db[outbox.COLLECTION].find()}
+
+def test_claimed_messages_are_sent_once_and_released():
+    async def scenario():
+        provider = FakeProvider('sms')
+        db, sender = await _outbox(5, provider)
+        messages = await sender._claim()
+        await sender._send(messages, messages[0]['lease'])
+        stored = await _statuses(db)
+        assert len(provider.sent) == 5
+        assert all(m['status'] == 'sent' and 'lease' not in m for m in stored.values())
+        assert await sender._claim() == []
+    run(scenario())
+
+def test_each_batch_is_recorded_before_the_next_one_is_sent():
+    class CrashingProvider(FakeProvider):
+        def batches(self, messages):
+            return [messages[:2], messages[2:]]
+
+        async def send(self, batch):
+            if self.sent:
+                raise RuntimeError('worker crashed')
+            await super().send(batch)
+
+    async def scenario():
+        provider = CrashingProvider('sms')
+        db, sender = await _outbox(4, provider)
+        messages = await sender._claim()
+        try:
+            await sender._send(messages, messages[0]['lease'])
+        except RuntimeError:
+            pass
+        stored = await _statuses(db)
+        sent = [m for m in stored.values() if m['status'] == 'sent']
+        assert {m['_id'] for m in sent} == {m['_id'] for m in provider.sent}
+        assert len(sent) == 2
+    run(scenario())
+
+def test_messages_taken_over_by_another_worker_are_not_sent_or_overwritten():
+    class SlowProvider(FakeProvider):
+        def batches(self, messages):
+            return [messages[:2], messages[2:]]
+
+        async def send(self, batch):
+            await super().send(batch)
+            # Our lease expired meanwhile and another worker claimed the rest
+            await self.db[outbox.COLLECTION].update_many(
+                {'status': 'sending', '_id': {'$nin': [m['_id'] for m in batch]}},
+                {'$set': {'lease': 'other-worker'}}
+            )
+
+    async def scenario():
+        provider = SlowProvider('sms')
+        db, sender = await _outbox(4, provider)
+        provider.db = db
+        messages = await sender._claim()
+        await sender._send(messages, messages[0]['lease'])
+        stored = await _statuses(db)
+        assert len(provider.sent) == 2
+        assert sum(m['status'] == 'sent' for m in stored.values()) == 2
+        assert sum(m.get('lease') == 'other-worker' for m in stored.values()) == 2
+    run(scenario())
+
+def test_failures_are_only_recorded_under_the_workers_lease():
+    async def scenario():
+        provider = FakeProvider('sms')
+        provider.fail_with = ProviderError('Twilio 503')
+        db, sender = await _outbox(3, provider)
+        messages = await sender._claim()
+        await sender._send(messages, messages[0]['lease'])
+        stored = await _statuses(db)
+        assert all(m['status'] == 'queued' and m['attempts'] == 1 for m in stored.values())
+
+        update = sender._failure(messages[0], ProviderError('late'), 'stale-lease')
+        await db[outbox.COLLECTION].bulk_write([update])
+        assert (await _statuses(db))[messages[0]['_id']]['last_error'] == 'Twilio 503'
+    run(scenario())
@@ -0,0 +1,32 @@
+from pubsub import PubSub
+
+def test_replay_returns_missed_events():
+    bus = PubSub(history_size=5)
+    first = bus.publish_event('t', 'e', 1)
+    later = [bus.publish_event('t', 'e', n) for n in (2, 3)]
+    assert bus.replay('t', first['id']) == later
+    assert bus.replay('t', later[-1]['id']) == []
+
+def test_replay_is_none_once_missed_events_were_trimmed():
+    bus = PubSub(history_size=3)
+    first = bus.publish_event('t', 'e', 1)
+    second = bus.publish_event('t', 'e', 2)
+    for n in range(3, 6):
+        bus.publish_event('t', 'e', n)
+    assert bus.replay('t', first['id']) is None
+    # Only the trimmed event itself is gone; everything after it is kept
+    assert [m['data'] for m in bus.replay('t', second['id'])] == [3, 4, 5]
+
+def test_replay_is_none_when_the_topic_history_was_evicted():
+    bus = PubSub(history_size=10, max_topics=2)
+    seen = bus.publish_event('a', 'e', 1)
+    bus.publish_event('a', 'e', 2)
+    bus.publish_event('b', 'e', 1)
+    bus.publish_event('c', 'e', 1)  # evicts 'a'
+    assert bus.replay('a', seen['id']) is None
+    bus.publish_event('a', 'e', 3)  # history restarts after the gap
+    assert bus.replay('a', seen['id']) is None
+
+    # A subscriber that was up to date with 'b' before the eviction
+    latest = bus.publish_event('b', 'e', 2)
+    assert bus.replay('b', latest['id']) == []
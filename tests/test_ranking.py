@@ -0,0 +1,11 @@
+import ranking
+
+def test_only_a_mechanic_dropping_an_accepted_order_is_a_cancellation():
+    accepted = {'mechanic_id': 'm1', 'status': 'approved'}
+    assert ranking.cancelled_by_mechanic(accepted, 'cancelled', 'm1') == 'm1'
+    assert ranking.cancelled_by_mechanic(accepted, 'pending', 'm1') == 'm1'
+    # The client (or anyone else) changing the order is not held against the mechanic
+    assert ranking.cancelled_by_mechanic(accepted, 'cancelled', 'c1') is None
+    # Withdrawing a quote the client never accepted is not a cancellation
+    assert ranking.cancelled_by_mechanic({'mechanic_id': 'm1', 'status': 'quoted'}, 'pending', 'm1') is None
+    assert ranking.cancelled_by_mechanic(accepted, 'in_progress', 'm1') is None
@@ -0,0 +1,57 @@
+import asyncio
+from mongomock_motor import AsyncMongoMockClient
+import earnings
+import rebuilds
+
+FENCE = '2026-10-19T12:00:00+00:00'
+
+def test_increments_during_a_rebuild_survive_the_rewrite(monkeypatch):
+    monkeypatch.setattr(rebuilds, 'GRACE_SECONDS', 0)
+
+    async def scenario():
+        db = AsyncMongoMockClient()['test']
+        # Drifted counters from before the rebuild
+        await earnings.record_completion(db, 'm1', 100.0, '2026-01-10T10:00:00+00:00')
+        await earnings.record_completion(db, 'm1', 40.0, '2026-01-11T10:00:00+00:00')
+
+        async def recount(fence):
+            # Live writes while the history is being recounted
+            await earnings.record_completion(db, 'm1', 50.0, fence)
+            await earnings.record_payment(db, 'm2', 30.0, fence)
+            # Only the first order is in the history
+            return [
+                ({'mechanic_id': 'm1', 'period_type': period_type, 'period': period}, earnings.completion_increments(100.0))
+                for period_type, period in earnings._periods('2026-01-10T10:00:00+00:00')
+            ]
+
+        await rebuilds.run(db, 'earnings', earnings.COLLECTION, {}, earnings.FIELDS, recount, mechanic_id=None)
+
+        buckets = {(b['mechanic_id'], b['period_type'], b['period']): b async for b in db[earnings.COLLECTION].find()}
+        assert buckets[('m1', 'all', 'all')]['completed_orders'] == 2
+        assert buckets[('m1', 'all', 'all')]['gross'] == 150.0
+        assert buckets[('m1', 'day', '2026-01-11')]['completed_orders'] == 0
+        assert buckets[('m2', 'all', 'all')]['paid_amount'] == 30.0
+        assert all('since_fence' not in b for b in buckets.values())
+        assert await rebuilds.current(db, 'earnings') is None
+    asyncio.run(scenario())
+
+def test_only_writes_at_or_after_the_fence_are_counted_since_it():
+    assert rebuilds.fenced({'gross': 10.0}, '2026-10-19T11:59:59+00:00', FENCE) == {'gross': 10.0}
+    assert rebuilds.fenced({'gross': 10.0}, FENCE, None) == {'gross': 10.0}
+    assert rebuilds.fenced({'gross': 10.0}, FENCE, FENCE) == {'gross': 10.0, 'since_fence.gross': 10.0}
+
+def test_a_second_rebuild_is_refused_while_one_runs():
+    async def scenario():
+        db = AsyncMongoMockClient()['test']
+        await db[rebuilds.COLLECTION].insert_one({'_id': 'metric_rollups', 'fence': FENCE, 'started_at': '9999'})
+
+        async def recount(fence):
+            raise AssertionError('recounted behind a held lock')
+        try:
+            await rebuilds.run(db, 'metric_rollups', 'metric_rollups', {}, {}, recount)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError('second rebuild ran')
+        assert (await rebuilds.current(db, 'metric_rollups'))['fence'] == FENCE
+    asyncio.run(scenario())
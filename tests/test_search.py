@@ -0,0 +1,22 @@
+import asyncio
+from mongomock_motor import AsyncMongoMockClient
+import search
+
+def test_sync_geo_mirrors_missing_and_moved_coordinates():
+    async def scenario():
+        db = AsyncMongoMockClient()['test']
+        await db.users.insert_many([
+            {'id': 'new', 'user_type': 'mechanic', 'latitude': -23.5, 'longitude': -46.6},
+            {'id': 'moved', 'user_type': 'mechanic', **search.geo_fields(-22.9, -43.2)},
+            {'id': 'same', 'user_type': 'mechanic', **search.geo_fields(-19.9, -43.9)},
+            {'id': 'client', 'user_type': 'client', 'latitude': 1.0, 'longitude': 2.0}
+        ])
+        await db.users.update_one({'id': 'moved'}, {'$set': {'latitude': -23.0, 'longitude': -43.5}})
+
+        assert await search.sync_geo(db) == 2
+        users = {u['id']: u async for u in db.users.find()}
+        assert users['new']['geo'] == {'type': 'Point', 'coordinates': [-46.6, -23.5]}
+        assert users['moved']['geo']['coordinates'] == [-43.5, -23.0]
+        assert 'geo' not in users['client']
+        assert await search.sync_geo(db) == 0
+    asyncio.run(scenario())
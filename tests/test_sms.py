@@ -0,0 +1,56 @@
+import asyncio
+from mongomock_motor import AsyncMongoMockClient
+import sms_service
+from sms_service import SmsSender, StubTransport
+
+async def _sender():
+    db = AsyncMongoMockClient()['test']
+    await sms_service.ensure_indexes(db)
+    return db, SmsSender(db, StubTransport(), rate_per_second=1000)
+
+def test_row_is_recorded_before_sending_and_gets_the_sid():
+    class CheckingTransport(StubTransport):
+        async def send(self, to, body):
+            assert await self.db[sms_service.COLLECTION].count_documents({'status': 'sending', 'to': to}) == 1
+            return await super().send(to, body)
+
+    async def scenario():
+        db, sender = await _sender()
+        sender.transport = CheckingTransport()
+        sender.transport.db = db
+        sid = await sender.send('+5511999990000', 'hi', 'm1')
+        row = await db[sms_service.COLLECTION].find_one({'sid': sid})
+        assert row['message_id'] == 'm1' and row['status'] == 'sent'
+    asyncio.run(scenario())
+
+def test_bookkeeping_failure_after_send_is_not_a_send_failure():
+    async def scenario():
+        db, sender = await _sender()
+
+        async def broken(*args, **kwargs):
+            raise RuntimeError('db down')
+        sender._attach = broken
+        failures = await sender.send_many([{'_id': 'm1', 'to': '+5511999990000', 'body': 'hi'}])
+        assert failures == {}
+        assert len(sender.transport.sent) == 1
+    asyncio.run(scenario())
+
+def test_status_callback_before_the_sid_is_attached_is_kept():
+    class EarlyCallbackTransport(StubTransport):
+        async def send(self, to, body):
+            result = await super().send(to, body)
+            await sms_service.update_status(self.db, result['sid'], 'delivered')
+            return result
+
+    async def scenario():
+        db, sender = await _sender()
+        sender.transport = EarlyCallbackTransport()
+        sender.transport.db = db
+        sid = await sender.send('+5511999990000', 'hi', 'm1')
+        rows = await db[sms_service.COLLECTION].find().to_list(None)
+        assert len(rows) == 1
+        assert rows[0]['sid'] == sid
+        assert rows[0]['status'] == 'delivered'
+        assert rows[0]['message_id'] == 'm1'
+        assert not await sms_service.update_status(db, sid, 'sent')
+    asyncio.run(scenario())
@@ -0,0 +1,18 @@
+import asyncio
+from mongomock_motor import AsyncMongoMockClient
+from socket_manager import service_pattern, specialty_room
+
+def test_snapshot_matches_services_like_the_specialty_rooms():
+    async def scenario():
+        db = AsyncMongoMockClient()['test']
+        await db.quotes.insert_many([
+            {'id': 'a', 'status': 'pending', 'service': 'Troca de Óleo'},
+            {'id': 'b', 'status': 'pending', 'service': 'troca de óleo '},
+            {'id': 'c', 'status': 'pending', 'service': 'Freios'},
+            {'id': 'd', 'status': 'pending', 'service': 'Troca de Óleo e Filtro'}
+        ])
+        specialties = [' TROCA DE ÓLEO']
+        found = await db.quotes.find({'service': {'$in': [service_pattern(sp) for sp in specialties]}}).to_list(None)
+        assert sorted(o['id'] for o in found) == ['a', 'b']
+        assert {specialty_room(o['service']) for o in found} == {specialty_room(specialties[0])}
+    asyncio.run(scenario())